@@ -1,11 +1,53 @@
 from django.contrib import admin
-from .models import Board, Image, Folder, History, Tab, Care_giver, Care_recipient, Image_positions
+from django.db.models import Count, OuterRef, Subquery
+from .models import Board, Image, Folder, History, Tab, Care_giver, Care_recipient, Image_positions, AudioClip
+
+
+class FolderAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        # folder names tell staff folders apart, without a creator query per row
+        return super().get_queryset(request).with_visibility()
+
+
+class DuplicateImageFilter(admin.SimpleListFilter):
+    title = 'duplicates'
+    parameter_name = 'duplicates'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Same photo uploaded more than once')]
+
+    def queryset(self, request, queryset):
+        if self.value() != 'yes':
+            return queryset
+        shared = (Image.objects.exclude(phash='').values('phash')
+                  .annotate(copies=Count('id')).filter(copies__gt=1).values('phash'))
+        return queryset.filter(phash__in=shared)
+
+
+class ImageAdmin(admin.ModelAdmin):
+    # sort by fingerprint with the duplicates filter on to see each cluster together,
+    # `manage.py find_duplicate_images` also groups near-identical fingerprints
+    list_display = ['id', 'label', 'folder', 'creator', 'phash', 'copies', 'image']
+    list_filter = [DuplicateImageFilter]
+    list_select_related = ['folder__creator', 'creator']
+    search_fields = ['label', 'phash']
+
+    def get_queryset(self, request):
+        copies = (Image.objects.filter(phash=OuterRef('phash')).exclude(phash='').values('phash')
+                  .annotate(count=Count('id')).values('count'))
+        return super().get_queryset(request).annotate(copies=Subquery(copies))
+
+    @admin.display(ordering='copies')
+    def copies(self, obj):
+        return obj.copies or 1
+
 
 admin.site.register(Board)
-admin.site.register(Folder)
-admin.site.register(Image)
+admin.site.register(Folder, FolderAdmin)
+admin.site.register(Image, ImageAdmin)
 admin.site.register(Tab)
 admin.site.register(Care_giver)
 admin.site.register(Care_recipient)
 admin.site.register(Image_positions)
 admin.site.register(History)
+admin.site.register(AudioClip)
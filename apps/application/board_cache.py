@@ -0,0 +1,70 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from ..models import CacheVersion
+
+LIBRARY_SCOPE = 'library'
+
+
+def board_scope(board_id):
+    return f'board:{board_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def bump(*scopes):
+    """
+    Increments the versions of `scopes` and returns them as {scope: version}. Inside a
+    transaction the rows stay locked until commit, so versions of a scope become
+    visible to readers strictly in order.
+    """
+    scopes = set(scopes)
+    for scope in scopes:
+        if CacheVersion.objects.filter(scope=scope).update(version=F('version') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                CacheVersion.objects.create(scope=scope, version=1)
+        except IntegrityError:
+            # created by a concurrent bump in the meantime
+            CacheVersion.objects.filter(scope=scope).update(version=F('version') + 1)
+    return dict(CacheVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+
+
+def versions(*scopes):
+    found = dict(CacheVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    return [found.get(scope, 0) for scope in scopes]
+
+
+def board_etag(board_id, user, scope_versions=None):
+    """
+    The board payload depends on the board itself, the shared staff library and the
+    viewer's own folders and groups. Versions live in the database so every worker
+    agrees on them, the snapshots themselves can sit in a per-process cache.
+    """
+    board_version, library_version, user_version = scope_versions or versions(
+        board_scope(board_id), LIBRARY_SCOPE, user_scope(user.id)
+    )
+    digest = hashlib.sha1(
+        f'{board_id}:{user.id}:{board_version}:{library_version}:{user_version}'.encode('utf-8')
+    ).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+
+
+def get_snapshot(etag):
+    return cache.get(f'board-snapshot:{etag}')
+
+
+def set_snapshot(etag, data):
+    cache.set(f'board-snapshot:{etag}', data, settings.BOARD_SNAPSHOT_TTL_SECONDS)
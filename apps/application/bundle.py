@@ -0,0 +1,142 @@
+import hashlib
+import json
+import zipfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import board_cache, images, tts
+from ..models import AudioClip, Image_positions, Tab
+from ..serializers import ImagePositionSerializer, TabSerializer
+
+BUNDLE_FORMAT_VERSION = 1
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def revision(board):
+    """
+    The ETag of the bundle, cheap enough to answer a conditional request without
+    building anything. Everything in it comes from the board, which bumps its
+    version, except the label audio, so the clips that exist so far go in as well.
+    Read before any content, a bundle built from newer rows is only refetched early.
+    """
+    version, = board_cache.versions(board_cache.board_scope(board.id))
+    labels = Image_positions.objects.filter(tab__board=board).values_list('image__label', flat=True).distinct()
+    clip_keys = sorted(AudioClip.objects.filter(
+        key__in=[tts.clip_key(label) for label in labels if label and label.strip()]
+    ).values_list('key', flat=True))
+    digest = hashlib.sha1(json.dumps(
+        [BUNDLE_FORMAT_VERSION, board.id, version, settings.BUNDLE_IMAGE_SIZE, clip_keys]
+    ).encode('utf-8')).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def collect(board):
+    """
+    Returns ({path: bytes}, pending_labels, missing_images) for everything a tablet
+    needs to show and voice `board` offline. Card images are resized, label audio
+    is whatever has been synthesized already. Labels without a clip are scheduled
+    and listed so the client knows to come back for them.
+    """
+    tabs = list(Tab.objects.filter(board=board).order_by('id'))
+    positions = list(Image_positions.objects.filter(tab__board=board).select_related('image').order_by('id'))
+
+    files = {}
+    cards = {}
+    missing_images = []
+    for image in {position.image_id: position.image for position in positions}.values():
+        path = f'images/{image.id}.webp'
+        try:
+            files[path] = images.resized_bytes(image, settings.BUNDLE_IMAGE_SIZE)
+        except Exception:
+            # a missing or broken original should not take the whole board down with it
+            path = None
+            missing_images.append(image.id)
+        cards[image.id] = {'label': image.label, 'image': path, 'audio': None}
+
+    labels = {card['label'] for card in cards.values() if card['label'] and card['label'].strip()}
+    clips = AudioClip.objects.in_bulk([tts.clip_key(label) for label in labels], field_name='key')
+    audio = {}
+    pending = []
+    for label in sorted(labels):
+        clip = clips.get(tts.clip_key(label))
+        if clip is None:
+            tts.schedule_clip(label)
+            pending.append(label)
+            continue
+        audio[label] = f'audio/{clip.key}.{clip.response_format}'
+        files[audio[label]] = tts.get_clip_bytes(clip)
+    for card in cards.values():
+        card['audio'] = audio.get(card['label'])
+
+    files['board.json'] = json.dumps({
+        'board': {'id': board.id, 'name': board.name, 'color': board.color},
+        'tabs': TabSerializer(tabs, many=True).data,
+        'positions': ImagePositionSerializer(positions, many=True).data,
+        'cards': {str(image_id): card for image_id, card in sorted(cards.items())},
+    }, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return files, pending, missing_images
+
+
+def manifest(board, files, pending, missing_images):
+    entries = {path: {'sha256': _digest(data), 'size': len(data)} for path, data in sorted(files.items())}
+    return {
+        'version': BUNDLE_FORMAT_VERSION,
+        'board_id': board.id,
+        # identifies the content of the whole bundle
+        'hash': _digest(json.dumps(entries, sort_keys=True).encode('utf-8')),
+        'entries': entries,
+        'pending_audio': pending,
+        'missing_images': missing_images,
+    }
+
+
+def archive(bundle_manifest, files, have=()):
+    """
+    Zips the manifest and every entry whose hash is not in `have`. Images and audio
+    are compressed already, deflating them again would only burn CPU.
+    """
+    have = set(have)
+    out = BytesIO()
+    with zipfile.ZipFile(out, 'w') as bundle:
+        bundle.writestr('manifest.json', json.dumps(bundle_manifest, ensure_ascii=False, sort_keys=True),
+                        compress_type=zipfile.ZIP_DEFLATED)
+        for path, data in sorted(files.items()):
+            if bundle_manifest['entries'][path]['sha256'] in have:
+                continue
+            compress_type = zipfile.ZIP_DEFLATED if path.endswith('.json') else zipfile.ZIP_STORED
+            bundle.writestr(path, data, compress_type=compress_type)
+    return out.getvalue()
+
+
+def _manifest_key(board, etag):
+    return f'board-bundle-manifest:{board.id}:{etag}'
+
+
+def build(board, etag):
+    """
+    Returns (manifest, files) for `board` at revision `etag`. The files come from the
+    resized image and audio caches, only the manifest of a complete bundle is cached,
+    the bytes are not pickled along with it. Incomplete bundles are collected again
+    on every call, which schedules their missing audio.
+    """
+    key = _manifest_key(board, etag)
+    cached = cache.get(key)
+    files, pending, missing_images = collect(board)
+    if cached is not None:
+        return cached, files
+
+    bundle_manifest = manifest(board, files, pending, missing_images)
+    if not pending and not missing_images:
+        cache.set(key, bundle_manifest, settings.BOARD_SNAPSHOT_TTL_SECONDS)
+    return bundle_manifest, files
+
+
+def get_manifest(board, etag):
+    """The manifest alone, without collecting the files once the bundle is complete."""
+    cached = cache.get(_manifest_key(board, etag))
+    return cached if cached is not None else build(board, etag)[0]
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min
+
+from . import board_cache
+from ..models import Folder, Image
+from ..serializers import FolderSerializer, ImageSerializer
+
+
+def _folders(folders):
+    # the first image of each folder is its cover, fetched on its own rather than out of all images
+    folders = list(folders.annotate(cover_id=Min('image__id')).order_by('name', 'id'))
+    covers = Image.objects.select_related('creator').in_bulk([folder.cover_id for folder in folders if folder.cover_id])
+    covers = {folder.id: covers[folder.cover_id] for folder in folders if folder.cover_id in covers}
+    return {
+        'folders': FolderSerializer(folders, many=True).data,
+        'covers': {folder_id: ImageSerializer(image).data for folder_id, image in covers.items()},
+        'cover_names': {folder_id: image.image.name for folder_id, image in covers.items()},
+    }
+
+
+def _images(images):
+    return ImageSerializer(images.select_related('creator').order_by('id'), many=True).data
+
+
+def public_folders():
+    return _folders(Folder.objects.filter(creator__is_staff=True).with_visibility())
+
+
+def public_images():
+    return _images(Image.objects.filter(folder__creator__is_staff=True))
+
+
+def user_folders(user):
+    layer = _folders(Folder.objects.filter(creator=user, creator__is_staff=False).with_visibility())
+    # everything the user uploaded, staff folders included
+    layer['private_images'] = list(Image.objects.filter(creator=user).values('image', 'label').distinct())
+    return layer
+
+
+def user_images(user):
+    return _images(Image.objects.filter(folder__creator=user, folder__creator__is_staff=False))
+
+
+def _cached(key, build):
+    layer = cache.get(key)
+    if layer is None:
+        layer = build()
+        cache.set(key, layer, settings.LIBRARY_CATALOG_TTL_SECONDS)
+    return layer
+
+
+def library(user, scope_versions=None, images=True):
+    """
+    Returns (public, own): the staff library shared by everyone and the overlay of
+    `user`'s private folders. Each layer is cached under its scope version, bumped
+    by every Folder and Image write, so a changed layer is simply built again under
+    the new key. `scope_versions` are the (library, user) versions if the caller
+    has read them already. Folders with their covers and the full image lists are
+    cached apart, with `images=False` the image lists are neither built nor read.
+    """
+    # read before the data, a layer built from newer rows than its version is only rebuilt early
+    library_version, user_version = scope_versions or board_cache.versions(
+        board_cache.LIBRARY_SCOPE, board_cache.user_scope(user.id)
+    )
+    public = _cached(f'library-catalog:public:folders:{library_version}', public_folders)
+    own = _cached(f'library-catalog:user:{user.id}:folders:{user_version}', lambda: user_folders(user))
+    if images:
+        public = {**public, 'images': _cached(f'library-catalog:public:images:{library_version}', public_images)}
+        own = {**own, 'images': _cached(f'library-catalog:user:{user.id}:images:{user_version}',
+                                        lambda: user_images(user))}
+    return public, own
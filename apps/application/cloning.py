@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import Q
+
+from ..models import Board, Image_positions, Tab
+
+
+def visible_templates(user):
+    return Board.objects.filter(Q(creator__is_staff=True) | Q(creator=user), is_template=True)
+
+
+def clone_board(source, owners, name=None, is_template=False, caregiver=None):
+    """
+    Copies `source` with all of its tabs and card positions to a new board for each
+    of `owners`. Every level is one bulk insert, so the query count depends neither
+    on the number of owners nor on the size of the board. The copies are brand new,
+    clients load them in full, so nothing needs to go through the change log.
+    """
+    tabs = list(Tab.objects.filter(board=source).order_by('id'))
+    positions = list(Image_positions.objects.filter(tab__board=source).order_by('id'))
+
+    with transaction.atomic():
+        boards = Board.objects.bulk_create([
+            Board(name=name or source.name, creator=owner, color=source.color, is_template=is_template)
+            for owner in owners
+        ])
+
+        new_tabs = Tab.objects.bulk_create([
+            Tab(board=board, name=tab.name, straps_num=tab.straps_num, color=tab.color)
+            for board in boards for tab in tabs
+        ])
+        # bulk_create keeps the order, so the copies of a board's tabs come in runs of len(tabs)
+        tab_copies = {
+            (board.id, tab.id): new_tabs[i * len(tabs) + j]
+            for i, board in enumerate(boards) for j, tab in enumerate(tabs)
+        }
+
+        Image_positions.objects.bulk_create([
+            Image_positions(tab=tab_copies[(board.id, position.tab_id)], image_id=position.image_id,
+                            position_x=position.position_x, position_y=position.position_y)
+            for board in boards for position in positions
+        ], batch_size=1000)
+
+        if caregiver is not None:
+            Board.access_users.through.objects.bulk_create([
+                Board.access_users.through(board_id=board.id, care_giver_id=caregiver.id) for board in boards
+            ])
+    return boards
@@ -0,0 +1,84 @@
+from io import BytesIO
+
+from . import tts
+from ..models import AudioClip
+
+
+def _strip_id3(data):
+    # MP3 frames can be joined back to back, the tags around them can not
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        data = data[10 + size:]
+    if len(data) >= 128 and data[-128:-125] == b'TAG':
+        data = data[:-128]
+    return data
+
+
+def _crossfade(clips, crossfade_ms):
+    # decoding needs pydub and ffmpeg, only paid for when a crossfade is asked for
+    from pydub import AudioSegment
+
+    phrase = AudioSegment.from_file(BytesIO(clips[0]), format='mp3')
+    for clip in clips[1:]:
+        segment = AudioSegment.from_file(BytesIO(clip), format='mp3')
+        phrase = phrase.append(segment, crossfade=min(crossfade_ms, len(phrase), len(segment)))
+    out = BytesIO()
+    phrase.export(out, format='mp3')
+    return out.getvalue()
+
+
+def join_clips(clips, crossfade_ms=0):
+    if crossfade_ms and len(clips) > 1:
+        try:
+            return _crossfade(clips, crossfade_ms)
+        except Exception:
+            # no ffmpeg on this box, a hard cut is still better than a fresh synthesis
+            pass
+    return b''.join(_strip_id3(clip) for clip in clips)
+
+
+def compose_phrase(labels, voice, model, crossfade_ms=0):
+    """
+    Builds the phrase audio out of the per-card clips. Returns (key, clip, missing):
+    `clip` is the stored composition if there already is one, `missing` the labels
+    without a clip, in which case nothing is composed and `key` is None.
+    """
+    text = ' / '.join(labels)
+    composed_model = f'{model}+composed{crossfade_ms}'
+    key = tts.clip_key(text, voice, composed_model)
+
+    clip = AudioClip.objects.filter(key=key).first()
+    if clip is not None:
+        return key, clip, []
+
+    card_keys = [tts.clip_key(label, voice, model) for label in labels]
+    card_clips = AudioClip.objects.in_bulk(card_keys, field_name='key')
+    missing = [label for label, card_key in zip(labels, card_keys) if card_key not in card_clips]
+    if missing:
+        return None, None, missing
+
+    audio_content = join_clips([tts.get_clip_bytes(card_clips[card_key]) for card_key in card_keys], crossfade_ms)
+    tts.schedule_store(key, text, voice, composed_model, tts.TTS_FORMAT, audio_content)
+    return key, None, []
+
+
+def resolve_phrase(text, labels=None, compose=False, crossfade_ms=0, voice=tts.TTS_VOICE, model=tts.TTS_MODEL):
+    """
+    Returns (key, clip, ready) for the audio of a phrase. With `compose` the phrase
+    is assembled from the card clips, the same ones a card tap and presynthesis
+    store, so the voice and model default to theirs. Otherwise, or when a card has no clip yet, the
+    whole phrase is synthesized in the background, and so are the missing cards, so
+    the next composition of them costs nothing.
+    """
+    if compose and labels:
+        key, clip, missing = compose_phrase(labels, voice, model, crossfade_ms)
+        if not missing:
+            return key, clip, True
+        for label in missing:
+            tts.schedule_clip(label, voice, model)
+
+    key = tts.clip_key(text, voice, model)
+    clip = tts.find_clip(key)
+    if clip is None:
+        tts.schedule_clip(text, voice, model)
+    return key, clip, clip is not None
@@ -0,0 +1,85 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, close_old_connections, transaction
+
+from . import images
+from ..models import Image
+
+logger = logging.getLogger(__name__)
+
+# name -> how to produce it; cards are drawn at about 120 px, the larger sizes are for denser screens
+DERIVATIVES = {
+    'webp-128': {'size': 128, 'format': 'WEBP', 'extension': 'webp'},
+    'webp-256': {'size': 256, 'format': 'WEBP', 'extension': 'webp'},
+    'webp-512': {'size': 512, 'format': 'WEBP', 'extension': 'webp'},
+    # for clients without WebP support
+    'jpeg-256': {'size': 256, 'format': 'JPEG', 'extension': 'jpg'},
+}
+
+# resizing is CPU bound, a small pool keeps it from starving the web workers
+_resize_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                                      thread_name_prefix='image-derivatives')
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def derivative_path(image, name):
+    return f"{image.image.name.rsplit('.', 1)[0]}.{name}.{DERIVATIVES[name]['extension']}"
+
+
+def missing(image):
+    return [name for name in DERIVATIVES if name not in (image.derivatives or {})]
+
+
+def create_derivatives(image, data=None):
+    """
+    Stores the resized copies of `image` that do not exist yet next to the original.
+    Saved through the model so the signals bump the library and board versions and
+    cached payloads pick up the new srcset.
+    """
+    names = missing(image)
+    if not names:
+        return
+    if data is None:
+        data = images.read_original(image)
+
+    storage = image.image.storage
+    derivatives = dict(image.derivatives or {})
+    for name in names:
+        derivative = DERIVATIVES[name]
+        resized = images.resize(data, derivative['size'], derivative['format'])
+        derivatives[name] = storage.save(derivative_path(image, name), ContentFile(resized))
+    image.derivatives = derivatives
+    try:
+        with transaction.atomic():
+            image.save(update_fields=['derivatives'])
+    except DatabaseError:
+        if Image.objects.filter(id=image.id).exists():
+            raise
+        # deleted while it was being resized, the copies would be orphans
+        for name in names:
+            storage.delete(derivatives[name])
+
+
+def _create_derivatives_in_background(image, data):
+    try:
+        create_derivatives(image, data)
+    except Exception:
+        logger.exception('Creating derivatives of image %s failed', image.id)
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard(image.id)
+        close_old_connections()
+
+
+def schedule_derivatives(image, data=None):
+    """Resizes off the request thread. `data` saves reading the original back from storage."""
+    with _scheduled_lock:
+        if image.id in _scheduled:
+            return
+        _scheduled.add(image.id)
+    _resize_executor.submit(_create_derivatives_in_background, image, data)
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import images
+from ..models import FingerprintChunk, Image
+
+# uploads find their near duplicates through this many indexed pieces of the fingerprint,
+# which covers every IMAGE_DUPLICATE_DISTANCE up to INDEX_CHUNKS - 1 bits
+INDEX_CHUNKS = 5
+
+
+def fingerprint_or_blank(data):
+    # anything Pillow cannot read is stored as before, it just never counts as a duplicate
+    try:
+        return images.fingerprint(data)
+    except Exception:
+        return ''
+
+
+def distance(a, b):
+    """How far apart two fingerprints are, None when the average colours differ."""
+    if any(abs(int(x, 16) - int(y, 16)) > 1 for x, y in zip(a[16:], b[16:])):
+        return None
+    return (int(a[:16], 16) ^ int(b[:16], 16)).bit_count()
+
+
+def chunk_values(phash, chunks):
+    """
+    [(chunk, value)] of the 64 hash bits of `phash` cut into `chunks` pieces. Two
+    hashes at most chunks - 1 bits apart agree exactly on at least one of them.
+    """
+    bits = int(phash[:16], 16)
+    width = 64 // chunks
+    values = []
+    for chunk in range(chunks):
+        size = 64 - chunk * width if chunk == chunks - 1 else width
+        values.append((chunk, (bits >> (chunk * width)) & ((1 << size) - 1)))
+    return values
+
+
+def index_fingerprint(image_id, phash):
+    FingerprintChunk.objects.filter(image_id=image_id).delete()
+    if phash:
+        FingerprintChunk.objects.bulk_create([
+            FingerprintChunk(image_id=image_id, chunk=chunk, value=value)
+            for chunk, value in chunk_values(phash, INDEX_CHUNKS)
+        ])
+
+
+def find_duplicate(user, phash):
+    """
+    An image in `user`'s visible library that looks the same as `phash`, or None.
+    Exact fingerprints come straight from the index. Near ones, up to
+    IMAGE_DUPLICATE_DISTANCE differing bits, are looked for among the images that
+    share a fingerprint chunk with it.
+    """
+    if not phash:
+        return None
+    library = Image.objects.filter(Q(folder__creator__is_staff=True) | Q(folder__creator=user))
+    duplicate = library.filter(phash=phash).order_by('id').first()
+    if duplicate is not None or not settings.IMAGE_DUPLICATE_DISTANCE:
+        return duplicate
+
+    shares_chunk = Q()
+    for chunk, value in chunk_values(phash, INDEX_CHUNKS):
+        shares_chunk |= Q(fingerprint_chunks__chunk=chunk, fingerprint_chunks__value=value)
+    candidates = library.filter(shares_chunk).exclude(phash='').values_list('id', 'phash').distinct()
+
+    best = None
+    for image_id, other in candidates:
+        d = distance(phash, other)
+        if d is not None and d <= settings.IMAGE_DUPLICATE_DISTANCE and (best is None or d < best[0]):
+            best = d, image_id
+    return Image.objects.get(id=best[1]) if best else None
+
+
+def clusters(max_distance):
+    """
+    Groups of near-identical images across the whole library, largest first, for the
+    cleanup report. Only images with a fingerprint take part.
+    """
+    rows = list(Image.objects.exclude(phash='').order_by('id').values_list('id', 'phash'))
+    parent = {image_id: image_id for image_id, _ in rows}
+
+    def root(image_id):
+        while parent[image_id] != image_id:
+            parent[image_id] = parent[parent[image_id]]
+            image_id = parent[image_id]
+        return image_id
+
+    # only images sharing a chunk need comparing
+    buckets = defaultdict(list)
+    for image_id, phash in rows:
+        for chunk_value in chunk_values(phash, max_distance + 1):
+            buckets[chunk_value].append((image_id, phash))
+
+    for bucket in buckets.values():
+        for i, (a_id, a) in enumerate(bucket):
+            for b_id, b in bucket[i + 1:]:
+                d = distance(a, b)
+                if d is not None and d <= max_distance:
+                    parent[root(b_id)] = root(a_id)
+
+    groups = defaultdict(list)
+    for image_id, _ in rows:
+        groups[root(image_id)].append(image_id)
+    groups = [group for group in groups.values() if len(group) > 1]
+    found = Image.objects.select_related('folder__creator', 'creator').in_bulk([i for group in groups for i in group])
+    return sorted(([found[i] for i in group] for group in groups), key=lambda group: (-len(group), group[0].id))
@@ -0,0 +1,60 @@
+import hashlib
+from io import BytesIO
+
+from django.core.cache import cache
+from PIL import Image as PILImage, ImageOps
+
+
+def read_original(image):
+    with image.image.storage.open(image.image.name, 'rb') as f:
+        return f.read()
+
+
+def resize(data, size, image_format='WEBP', quality=80):
+    """Scales image bytes down to fit a size x size box, never up."""
+    with PILImage.open(BytesIO(data)) as picture:
+        picture = ImageOps.exif_transpose(picture)
+        picture.thumbnail((size, size), PILImage.LANCZOS)
+        if image_format == 'JPEG' and (picture.mode in ('RGBA', 'LA', 'PA') or 'transparency' in picture.info):
+            # JPEG has no alpha, transparent pictograms go onto white instead of black
+            rgba = picture.convert('RGBA')
+            picture = PILImage.new('RGB', rgba.size, 'white')
+            picture.paste(rgba, mask=rgba.getchannel('A'))
+        elif image_format == 'JPEG':
+            picture = picture.convert('RGB')
+        elif picture.mode not in ('RGB', 'RGBA'):
+            picture = picture.convert('RGBA')
+        out = BytesIO()
+        picture.save(out, image_format, quality=quality)
+        return out.getvalue()
+
+
+def resized_bytes(image, size, image_format='WEBP'):
+    # stored names never get overwritten, so the name identifies the content
+    name = hashlib.sha1(image.image.name.encode('utf-8')).hexdigest()
+    key = f'resized:{name}:{size}:{image_format}'
+    data = cache.get(key)
+    if data is None:
+        data = resize(read_original(image), size, image_format)
+        cache.set(key, data, None)
+    return data
+
+
+def fingerprint(data):
+    """
+    Perceptual fingerprint of image bytes: a 64 bit difference hash of the picture,
+    which survives rescaling and recompression, followed by its average colour in
+    4 bit steps, so the same pictogram in two colours is not taken for one image.
+    19 hex digits.
+    """
+    with PILImage.open(BytesIO(data)) as picture:
+        # JPEGs decode straight at a fraction of their size, the hash only needs 9x8 pixels
+        picture.draft('RGB', (160, 160))
+        picture = ImageOps.exif_transpose(picture).convert('RGB')
+        average = picture.resize((1, 1), PILImage.BOX).getpixel((0, 0))
+        pixels = list(picture.convert('L').resize((9, 8), PILImage.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f'{bits:016x}' + ''.join(f'{channel // 16:x}' for channel in average)
@@ -0,0 +1,20 @@
+from itertools import count
+
+from ..models import Image_positions
+
+
+def next_free_cell(tab):
+    """
+    First empty (x, y) on the tab. Cards fill the board slot by slot across all of its
+    straps (y < straps_num), so the straps stay evenly filled. One lookup on the
+    (tab, y, x) index.
+    """
+    straps_num = max(tab.straps_num, 1)
+    occupied = set(
+        Image_positions.objects.filter(tab=tab, position_y__gte=0, position_y__lt=straps_num)
+        .values_list('position_x', 'position_y')
+    )
+    for x in count():
+        for y in range(straps_num):
+            if (x, y) not in occupied:
+                return x, y
@@ -0,0 +1,37 @@
+import base64
+import json
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The sort key of the last row of the previous page. Raises ValueError on garbage."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor '{cursor}'.")
+    if not isinstance(values, list):
+        raise ValueError(f"Invalid cursor '{cursor}'.")
+    return values
+
+
+def page_size(value, default, maximum):
+    try:
+        return min(max(int(value), 1), maximum)
+    except (TypeError, ValueError):
+        return default
+
+
+def paginate(rows, limit, key):
+    """
+    `rows` holds up to limit + 1 rows, the extra one only tells whether there is a
+    next page. Returns (page, next_cursor).
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(key(page[-1]))
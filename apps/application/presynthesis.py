@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import tts
+from ..models import AudioClip, Image, Image_positions, PresynthesisJob
+
+# jobs started from the API run one at a time, each with its own bounded pool of synthesis workers
+_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='presynthesis')
+
+
+def folder_labels(folder):
+    return list(Image.objects.filter(folder=folder).values_list('label', flat=True).distinct())
+
+
+def board_labels(board):
+    return list(
+        Image_positions.objects.filter(tab__board=board).values_list('image__label', flat=True).distinct()
+    )
+
+
+def pending_labels(labels):
+    """
+    Drops labels that already have a clip. This is what makes a rerun resume
+    where an interrupted one stopped instead of starting over.
+    """
+    by_key = {}
+    for label in labels:
+        if label and label.strip():
+            by_key.setdefault(tts.clip_key(label), label)
+    existing = set(AudioClip.objects.filter(key__in=by_key).values_list('key', flat=True))
+    return [label for key, label in by_key.items() if key not in existing]
+
+
+def _synthesize_label(label):
+    try:
+        tts.get_or_create_clip(label)
+    finally:
+        close_old_connections()
+
+
+def presynthesize(labels, workers=None, progress=None):
+    """
+    Synthesizes every label without a clip on a bounded thread pool. `progress`
+    is called as progress(done, failed, total) after each label finishes.
+    Returns (done, failed, total).
+    """
+    labels = pending_labels(labels)
+    total = len(labels)
+    done = failed = 0
+    if not labels:
+        return done, failed, total
+
+    with ThreadPoolExecutor(max_workers=workers or settings.TTS_PRESYNTHESIS_WORKERS) as executor:
+        futures = [executor.submit(_synthesize_label, label) for label in labels]
+        for future in as_completed(futures):
+            if future.exception() is None:
+                done += 1
+            else:
+                failed += 1
+            if progress is not None:
+                progress(done, failed, total)
+    return done, failed, total
+
+
+def run_job(job_id):
+    job = PresynthesisJob.objects.get(id=job_id)
+    labels = board_labels(job.board) if job.board_id else folder_labels(job.folder)
+
+    # update() skips auto_now, updated_at is what tells a running job from a dead one
+    PresynthesisJob.objects.filter(id=job_id).update(status='running', updated_at=timezone.now())
+
+    def progress(done, failed, total):
+        PresynthesisJob.objects.filter(id=job_id).update(done=done, failed=failed, total=total,
+                                                         updated_at=timezone.now())
+
+    try:
+        done, failed, total = presynthesize(labels, progress=progress)
+        PresynthesisJob.objects.filter(id=job_id).update(
+            status='failed' if failed else 'done', done=done, failed=failed, total=total, updated_at=timezone.now()
+        )
+    except Exception:
+        PresynthesisJob.objects.filter(id=job_id).update(status='failed', updated_at=timezone.now())
+        raise
+    finally:
+        close_old_connections()
+
+
+def start_job(job):
+    transaction.on_commit(lambda: _job_executor.submit(run_job, job.id))
@@ -0,0 +1,77 @@
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from ..models import Folder, Image
+
+# Russian labels get stemmed, the 'simple' configuration keeps Kazakh (PostgreSQL ships no
+# Kazakh stemmer) and everything else as plain lowercased words. Trigram similarity catches
+# the inflections and typos that neither of them matches. The vector expression has to stay
+# identical to the one indexed in migration 0020, otherwise the GIN index is not used.
+IMAGE_VECTOR_SQL = "(to_tsvector('russian', \"apps_image\".\"label\") || to_tsvector('simple', \"apps_image\".\"label\"))"
+QUERY_SQL = "(websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s))"
+
+
+def is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def visible_images(user):
+    return Image.objects.filter(Q(folder__creator__is_staff=True) | Q(folder__creator=user))
+
+
+def ranked_images(user, q):
+    images = visible_images(user)
+    if is_postgres():
+        match = RawSQL(
+            f"({IMAGE_VECTOR_SQL} @@ {QUERY_SQL} OR \"apps_image\".\"label\" %% %s)", (q, q, q),
+            output_field=BooleanField(),
+        )
+        # both return real, the keyset cursor round-trips the rank as a Python float and
+        # only finds its row again in double precision
+        rank = RawSQL(
+            f"(ts_rank({IMAGE_VECTOR_SQL}, {QUERY_SQL}) + similarity(\"apps_image\".\"label\", %s))::double precision",
+            (q, q, q),
+            output_field=FloatField(),
+        )
+        return images.filter(match).annotate(rank=rank)
+
+    # anything but PostgreSQL, for development and tests: substring match, exact and prefix hits first
+    return images.filter(label__icontains=q).annotate(rank=Case(
+        When(label__iexact=q, then=Value(3.0)),
+        When(label__istartswith=q, then=Value(2.0)),
+        default=Value(1.0),
+        output_field=FloatField(),
+    ))
+
+
+def search_images(user, q, limit, after=None):
+    """
+    One page of the user's visible images matching `q`, best first. `after` is the
+    (rank, id) of the last row of the previous page, the order is (rank desc, id)
+    so pages stay stable while the library grows.
+    """
+    images = ranked_images(user, q)
+    if after is not None:
+        rank, image_id = after
+        images = images.filter(Q(rank__lt=rank) | Q(rank=rank, id__gt=image_id))
+    return list(images.select_related('creator').order_by('-rank', 'id')[:limit + 1])
+
+
+def search_folders(user, q, limit):
+    return list(
+        Folder.objects.filter(Q(creator__is_staff=True) | Q(creator=user), name__icontains=q)
+        .with_visibility().order_by('name', 'id')[:limit]
+    )
+
+
+def folder_images(folder_id, limit, after=None):
+    """
+    One page of a folder's images in (label, id) order, `after` being the (label, id)
+    of the last row of the previous page. Returns up to limit + 1 rows.
+    """
+    images = Image.objects.filter(folder_id=folder_id)
+    if after is not None:
+        label, image_id = after
+        images = images.filter(Q(label__gt=label) | Q(label=label, id__gt=image_id))
+    return list(images.select_related('creator').order_by('label', 'id')[:limit + 1])
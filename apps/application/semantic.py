@@ -0,0 +1,303 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from ..models import Image
+
+# Labels are embedded as hashed character n-grams, which catches typos and inflections,
+# plus the average of their word vectors when a word vector file has been imported, which
+# is what relates "drink" to "juice" and "сок". Everything is computed locally.
+NGRAM_DIM = 256
+WORD_WEIGHT = 0.8
+MIN_SCORE = 0.2
+
+_WORD = re.compile(r'\w+')
+
+_words = {'dir': None, 'vocab': None, 'vectors': None}
+_segments = {'dir': None, 'names': None, 'data': []}
+
+_build_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semantic-index')
+_build_lock = threading.Lock()
+_build = {'future': None}
+
+
+def index_dir():
+    return Path(settings.SEMANTIC_INDEX_DIR)
+
+
+def is_built():
+    return (index_dir() / 'meta.json').exists()
+
+
+def _index_dim():
+    try:
+        return json.loads((index_dir() / 'meta.json').read_text())['dim']
+    except FileNotFoundError:
+        return None
+
+
+def _normalized(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _tokens(text):
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+def _ngram_vector(tokens):
+    vector = np.zeros(NGRAM_DIM, dtype=np.float32)
+    for token in tokens:
+        padded = f' {token} '
+        for n in (2, 3, 4):
+            for i in range(len(padded) - n + 1):
+                # crc32 rather than hash(), the buckets have to agree across processes
+                h = zlib.crc32(padded[i:i + n].encode('utf-8'))
+                vector[h % NGRAM_DIM] += 1.0 if h & 0x80000000 else -1.0
+    return _normalized(vector)
+
+
+def _word_vectors():
+    """The imported (vocab, vectors), both memory-mapped, or (None, None)."""
+    directory = index_dir()
+    if _words['dir'] != directory:
+        vocab = vectors = None
+        if (directory / 'vocab.npy').exists():
+            vocab = np.load(directory / 'vocab.npy', mmap_mode='r')
+            vectors = np.load(directory / 'words.npy', mmap_mode='r')
+        _words.update(dir=directory, vocab=vocab, vectors=vectors)
+    return _words['vocab'], _words['vectors']
+
+
+def import_word_vectors(path, max_words=None):
+    """
+    Imports word vectors in the fastText .vec text format. Aligned multilingual vectors
+    put Russian, Kazakh and English words for the same thing next to each other. Rows are
+    sorted by word so lookups are a binary search over the memory-mapped vocabulary.
+    """
+    words = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip().split(' ')
+            if len(parts) < 3:
+                continue  # the "count dim" header
+            word = parts[0].lower().replace('ё', 'е')
+            # .vec files are sorted by frequency, the first spelling wins
+            if word in words or len(word) > 32:
+                continue
+            words[word] = _normalized(np.asarray(parts[1:], dtype=np.float32))
+            if max_words and len(words) >= max_words:
+                break
+    vocab = sorted(words)
+
+    directory = index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / 'words.npy', np.stack([words[word] for word in vocab]))
+    np.save(directory / 'vocab.npy', np.array(vocab))
+    _words['dir'] = None
+    return len(vocab)
+
+
+def embed(text):
+    tokens = _tokens(text)
+    vector = _ngram_vector(tokens)
+    vocab, vectors = _word_vectors()
+    if vocab is None:
+        return vector
+
+    rows = []
+    for token in tokens:
+        i = np.searchsorted(vocab, token)
+        if i < len(vocab) and vocab[i] == token:
+            rows.append(i)
+    meaning = np.zeros(vectors.shape[1], dtype=np.float32)
+    if rows:
+        meaning = _normalized(np.asarray(vectors[rows]).mean(axis=0))
+    # the dot product of two of these is the weighted sum of both cosines
+    return np.concatenate([meaning * np.sqrt(WORD_WEIGHT), vector * np.sqrt(1 - WORD_WEIGHT)]).astype(np.float32)
+
+
+def _embedding_dim():
+    _, vectors = _word_vectors()
+    return NGRAM_DIM + (vectors.shape[1] if vectors is not None else 0)
+
+
+def is_current():
+    """
+    Whether this process embeds into the dimension the index was built with. Word
+    vectors imported by another process change it, so on a mismatch the cached ones
+    are dropped and read again.
+    """
+    dim = _index_dim()
+    if dim is not None and dim != _embedding_dim():
+        _words['dir'] = None
+    return dim is not None and dim == _embedding_dim()
+
+
+def _new_segment_name():
+    return f'{time.time_ns():020d}-{os.getpid()}'
+
+
+def _segment_names():
+    return sorted(
+        path.name[:-len('.vectors.npy')] for path in index_dir().glob('*.vectors.npy')
+        if not path.name.startswith('.')
+    )
+
+
+def _write_segment(name, ids, vectors):
+    directory = index_dir()
+    # vectors last, their file marks the segment as complete
+    for suffix, data in (('ids', ids), ('vectors', vectors)):
+        tmp = directory / f'.{name}.{suffix}.npy'
+        np.save(tmp, data)
+        os.replace(tmp, directory / f'{name}.{suffix}.npy')
+
+
+def _remove_segment(name):
+    for suffix in ('vectors', 'ids'):
+        (index_dir() / f'{name}.{suffix}.npy').unlink(missing_ok=True)
+
+
+def _load_segments():
+    """
+    [(ids, vectors)] of every segment, oldest first, memory-mapped and reused until
+    the set of segments changes.
+    """
+    directory = index_dir()
+    for _ in range(3):
+        names = tuple(_segment_names())
+        if _segments['dir'] == directory and _segments['names'] == names:
+            return _segments['data']
+        try:
+            data = [
+                (np.load(directory / f'{name}.ids.npy', mmap_mode='r'),
+                 np.load(directory / f'{name}.vectors.npy', mmap_mode='r'))
+                for name in names
+            ]
+        except FileNotFoundError:
+            continue  # compacted away by another process in the meantime
+        _segments.update(dir=directory, names=names, data=data)
+        return data
+    return []
+
+
+def _latest(ids):
+    # later segments replace the entries of earlier ones, keep the last row of every id
+    _, first = np.unique(ids[::-1], return_index=True)
+    return len(ids) - 1 - first
+
+
+def build(wait=True):
+    """
+    Embeds every label from scratch, replacing whatever index was there. Workers on
+    this host share the index directory, one builds at a time. Without `wait` a build
+    already running elsewhere is left to finish and None is returned.
+    """
+    directory = index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.build.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        old = _segment_names()
+
+        images = list(Image.objects.order_by('id').values_list('id', 'label'))
+        if images:
+            _write_segment(_new_segment_name(), np.array([image_id for image_id, _ in images], dtype=np.int64),
+                           np.stack([embed(label) for _, label in images]))
+        for name in old:
+            _remove_segment(name)
+
+        (directory / 'meta.json').write_text(json.dumps({'images': len(images), 'dim': len(embed(''))}))
+    return len(images)
+
+
+def _build_in_background():
+    try:
+        build(wait=False)
+    finally:
+        close_old_connections()
+
+
+def schedule_build():
+    """Starts a build off the request thread, unless this process is building already."""
+    with _build_lock:
+        if _build['future'] is None or _build['future'].done():
+            _build['future'] = _build_executor.submit(_build_in_background)
+
+
+def add(images):
+    """
+    Embeds (id, label) pairs into a new small segment, a no-op until the index has been
+    built. Segments pile up with every upload and are merged once there are too many.
+    """
+    images = list(images)
+    if not images or not is_current():
+        return
+    _write_segment(_new_segment_name(), np.array([image_id for image_id, _ in images], dtype=np.int64),
+                   np.stack([embed(label) for _, label in images]))
+    if len(_segment_names()) > settings.SEMANTIC_MAX_SEGMENTS:
+        compact()
+
+
+def compact():
+    names = _segment_names()
+    if len(names) < 2:
+        return
+    # segments of another dimension are left over from before a rebuild and unusable
+    dim = _embedding_dim()
+    segments = [segment for segment in _load_segments() if segment[1].shape[1] == dim]
+    if not segments:
+        return
+    ids = np.concatenate([segment_ids for segment_ids, _ in segments])
+    vectors = np.concatenate([segment_vectors for _, segment_vectors in segments])
+    keep = np.sort(_latest(ids))
+    # named right after the newest input, so segments written meanwhile still come later
+    _write_segment(f'{names[-1]}m', ids[keep], vectors[keep])
+    for name in names:
+        _remove_segment(name)
+
+
+def search(q, k, visible):
+    """
+    The best k (image_id, score) matches for `q`, best first. `visible(ids)` returns
+    the ones of `ids` the user may see, it is asked about growing windows of the
+    ranking until k are found, never about the whole library.
+    """
+    if not is_current():
+        return []
+    vector = embed(q)
+    segments = [segment for segment in _load_segments() if segment[1].shape[1] == len(vector)]
+    if not segments:
+        return []
+
+    ids = np.concatenate([segment_ids for segment_ids, _ in segments])
+    scores = np.concatenate([segment_vectors @ vector for _, segment_vectors in segments])
+    if len(segments) > 1:
+        keep = _latest(ids)
+        ids, scores = ids[keep], scores[keep]
+
+    mask = scores >= MIN_SCORE
+    ids, scores = ids[mask], scores[mask]
+    order = np.argsort(-scores, kind='stable')
+
+    results = []
+    start, window = 0, max(k * 4, 64)
+    while len(results) < k and start < len(order):
+        candidates = order[start:start + window]
+        allowed = set(visible([int(ids[i]) for i in candidates]))
+        results += [(int(ids[i]), float(scores[i])) for i in candidates if int(ids[i]) in allowed]
+        start, window = start + window, window * 2
+    return results[:k]
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ..models import AudioClipLock
+
+LOCK_POLL_INTERVAL = 0.1
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key inside one process: the first
+    caller runs the function, the others block until it finishes and get the
+    same result (or exception). Returns (result, shared).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+def acquire_lock(key):
+    """
+    Cross-worker lock on a clip key through the unique AudioClipLock row.
+    A lock older than TTS_LOCK_TTL_SECONDS belonged to a worker that died
+    and is taken over. Returns the token that releases it, or None.
+    """
+    token = uuid.uuid4().hex
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                AudioClipLock.objects.create(key=key, token=token)
+            return token
+        except IntegrityError:
+            stale_before = timezone.now() - timedelta(seconds=settings.TTS_LOCK_TTL_SECONDS)
+            deleted, _ = AudioClipLock.objects.filter(key=key, created_at__lt=stale_before).delete()
+            if not deleted:
+                return None
+    return None
+
+
+def release_lock(key, token):
+    AudioClipLock.objects.filter(key=key, token=token).delete()
+
+
+def _try_claim(key, lookup):
+    result = lookup()
+    if result is not None:
+        return result, None
+
+    token = acquire_lock(key)
+    if token is not None:
+        # the previous holder may have finished between the lookup and the lock
+        result = lookup()
+        if result is None:
+            return None, token
+        release_lock(key, token)
+    return result, None
+
+
+def claim(key, lookup, timeout=None):
+    """
+    Returns (result, token) once `lookup` returns a result or the lock for `key` is
+    ours, polling `lookup` meanwhile. The token is None unless the caller holds the
+    lock and has to release it when done. If waiting takes longer than the lock TTL
+    both are None and the caller goes ahead without the lock.
+    """
+    deadline = time.monotonic() + (timeout or settings.TTS_LOCK_TTL_SECONDS)
+    while True:
+        result, token = _try_claim(key, lookup)
+        if result is not None or token is not None:
+            return result, token
+        if time.monotonic() > deadline:
+            return None, None
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+async def aclaim(key, lookup, timeout=None):
+    """claim for coroutines, only the lookups and lock attempts take a thread, not the waiting."""
+    deadline = time.monotonic() + (timeout or settings.TTS_LOCK_TTL_SECONDS)
+    while True:
+        result, token = await sync_to_async(_try_claim)(key, lookup)
+        if result is not None or token is not None:
+            return result, token
+        if time.monotonic() > deadline:
+            return None, None
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+def run_once(key, lookup, create, timeout=None):
+    """
+    Returns (result, created). `lookup` returns the finished result or None, `create`
+    produces it and is only run by the worker that holds the lock for `key`. The
+    others poll `lookup` until the result shows up. If waiting takes longer than
+    the lock TTL the caller gives up on the lock and creates the result itself.
+    """
+    result, token = claim(key, lookup, timeout)
+    if result is not None:
+        return result, False
+    try:
+        return create(), True
+    finally:
+        if token is not None:
+            release_lock(key, token)
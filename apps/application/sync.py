@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import board_cache
+from ..models import ChangeLog, Folder, Image, Image_positions, Tab
+
+KINDS = ('tab', 'position', 'folder', 'image')
+
+_muted = ContextVar('sync_muted', default=False)
+
+
+@contextmanager
+def muted():
+    """
+    Ignores the per-row signals inside the block, for bulk writes that record
+    their changes themselves in one go.
+    """
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def is_muted():
+    return _muted.get()
+
+
+def record(changes):
+    """
+    Logs (scope, kind, object_id, deleted) changes under the next version of their
+    scope. Bumping and logging share a transaction, so once a version is visible
+    its entries are too.
+    """
+    changes = list(changes)
+    if not changes or is_muted():
+        return
+    with transaction.atomic():
+        revisions = board_cache.bump(*[change[0] for change in changes])
+        ChangeLog.objects.bulk_create([
+            ChangeLog(scope=scope, revision=revisions[scope], kind=kind, object_id=object_id, deleted=deleted)
+            for scope, kind, object_id, deleted in changes
+        ])
+
+
+def prune(days):
+    return ChangeLog.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()[0]
+
+
+def sync_scopes(board_id, user):
+    return [board_cache.board_scope(board_id), board_cache.LIBRARY_SCOPE, board_cache.user_scope(user.id)]
+
+
+def format_cursor(revisions):
+    return '.'.join(str(revision) for revision in revisions)
+
+
+def parse_cursor(cursor):
+    revisions = [int(part) for part in cursor.split('.')]
+    if len(revisions) != 3 or any(revision < 0 for revision in revisions):
+        raise ValueError(f"Invalid sync cursor '{cursor}'.")
+    return revisions
+
+
+def _needs_reset(scopes, since, current):
+    for scope, revision, latest in zip(scopes, since, current):
+        if revision > latest:
+            # a cursor from the future, the log was reset
+            return True
+        if revision < latest:
+            oldest = ChangeLog.objects.filter(scope=scope).aggregate(oldest=Min('revision'))['oldest']
+            if oldest is None or oldest > revision + 1:
+                # the entries in between were pruned
+                return True
+    return False
+
+
+def visible_folders(user):
+    return Folder.objects.filter(Q(creator__is_staff=True) | Q(creator=user))
+
+
+def board_changes(board, user, since=None):
+    """
+    Everything a client with cursor `since` is missing for `board`. Without a usable
+    cursor all of it is returned with reset=True. The querysets hold what was added
+    or changed, `deleted` the ids of what is gone, per kind.
+    """
+    scopes = sync_scopes(board.id, user)
+    # read before the data, changes that land in between are just sent again next time
+    current = board_cache.versions(*scopes)
+
+    querysets = {
+        'tab': Tab.objects.filter(board=board).order_by('id'),
+        'position': Image_positions.objects.filter(tab__board=board).select_related('image').order_by('id'),
+        'folder': visible_folders(user).with_visibility().order_by('name', 'id'),
+        'image': Image.objects.filter(Q(folder__creator__is_staff=True) | Q(folder__creator=user))
+        .select_related('creator').order_by('id'),
+    }
+    deleted = {kind: [] for kind in KINDS}
+
+    reset = since is None or _needs_reset(scopes, since, current)
+    if not reset:
+        entries = ChangeLog.objects.filter(
+            reduce(or_, [Q(scope=scope, revision__gt=revision) for scope, revision in zip(scopes, since)])
+        ).order_by('id').values_list('kind', 'object_id', 'deleted')
+        latest = {}
+        for kind, object_id, is_deleted in entries:
+            latest[(kind, object_id)] = is_deleted
+
+        for kind in KINDS:
+            changed = [object_id for (k, object_id), is_deleted in latest.items() if k == kind and not is_deleted]
+            deleted[kind] = sorted(object_id for (k, object_id), is_deleted in latest.items() if k == kind and is_deleted)
+            if not changed:
+                querysets[kind] = querysets[kind].none()
+                continue
+            querysets[kind] = list(querysets[kind].filter(id__in=changed))
+            # changed since, but out of reach now (moved out of the visible library)
+            found = {obj.id for obj in querysets[kind]}
+            deleted[kind] = sorted(set(deleted[kind]) | (set(changed) - found))
+
+    return {
+        'cursor': format_cursor(current),
+        'reset': reset,
+        'changed': querysets,
+        'deleted': deleted,
+    }
@@ -0,0 +1,328 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from . import singleflight, tts_backends, variants
+from .audio_cache import get_audio_cache
+from ..models import AudioClip, ClipFallback, PendingClip
+
+TTS_MODEL = 'tts-1'
+TTS_VOICE = 'nova'
+TTS_FORMAT = 'mp3'
+
+CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+    'aac': 'audio/aac',
+    'flac': 'audio/flac',
+}
+
+STREAM_CHUNK_SIZE = 4096
+
+_storage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tts-store')
+_synthesis_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tts-synth')
+
+_flights = singleflight.SingleFlight()
+
+# clip keys this process is synthesizing or uploading, so none is submitted twice. Other
+# workers see them through their PendingClip rows.
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def normalize_text(text):
+    # "Мама ", "мама" and "МАМА" are the same card label, they should share one clip
+    return ' '.join(text.split()).lower()
+
+
+def clip_key(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    payload = '\n'.join([normalize_text(text), voice, model, response_format])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def clip_path(key, response_format=TTS_FORMAT):
+    return f'audio/tts/{key[:2]}/{key}.{response_format}'
+
+
+def clip_url(path):
+    return f"{os.getenv('R2_BASE_URL', '').rstrip('/')}/{quote(path)}"
+
+
+def synthesize(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    """
+    Returns (audio_content, voice, model), the voice and model of the backend that
+    produced the audio. After a fallback they are not the ones asked for.
+    """
+    audio_content, backend = tts_backends.registry.synthesize(text, voice, model, response_format)
+    return audio_content, backend.voice_for(voice), backend.model_for(model)
+
+
+async def asynthesize(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    audio_content, backend = await tts_backends.registry.asynthesize(text, voice, model, response_format)
+    return audio_content, backend.voice_for(voice), backend.model_for(model)
+
+
+def remember_fallback(key, substitute_key):
+    # until the breaker cooldown is over the requested backend is not asked again anyway
+    ClipFallback.objects.update_or_create(key=key, defaults={
+        'fallback_key': substitute_key,
+        'expires_at': timezone.now() + timedelta(seconds=settings.TTS_BREAKER_COOLDOWN_SECONDS),
+    })
+
+
+def fallback_key(key):
+    """The key of the clip a fallback backend recently produced in place of `key`, or None."""
+    return ClipFallback.objects.filter(key=key, expires_at__gt=timezone.now()) \
+        .values_list('fallback_key', flat=True).first()
+
+
+def find_clip(key):
+    """The clip stored under `key`, else the one a fallback backend recently produced instead."""
+    clip = AudioClip.objects.filter(key=key).first()
+    substitute = fallback_key(key) if clip is None else None
+    if substitute is not None:
+        clip = AudioClip.objects.filter(key=substitute).first()
+    return clip
+
+
+def _save_clip_bytes(key, response_format, audio_content):
+    path = S3Boto3Storage().save(clip_path(key, response_format), ContentFile(audio_content))
+    get_audio_cache().put(key, audio_content)
+    return path
+
+
+def store_clip(key, text, voice, model, response_format, audio_content):
+    path = _save_clip_bytes(key, response_format, audio_content)
+
+    clip, created = AudioClip.objects.get_or_create(
+        key=key,
+        defaults={
+            'text': normalize_text(text),
+            'voice': voice,
+            'model': model,
+            'response_format': response_format,
+            'path': path,
+        }
+    )
+    if created:
+        variants.schedule_variants(clip, audio_content)
+    return clip, created
+
+
+def get_or_create_clip(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    """
+    Returns (clip, created). A hit is a single indexed lookup, OpenAI and R2 are
+    only touched when the phrase has never been synthesized with these settings.
+    When a fallback backend stepped in the clip is stored under that backend's
+    voice and model, its key is not the one asked for.
+    """
+    key = clip_key(text, voice, model, response_format)
+    clip = find_clip(key)
+    if clip is not None:
+        return clip, False
+
+    (clip, created), shared = _flights.do(key, _create_clip, key, text, voice, model, response_format)
+    return clip, created and not shared
+
+
+def _create_clip(key, text, voice, model, response_format):
+    # concurrent requests for the same phrase share one synthesis: threads of this
+    # process through _flights, other workers through the lock table
+    return singleflight.run_once(key, lambda: find_clip(key),
+                                 lambda: _synthesize_clip(key, text, voice, model, response_format))
+
+
+def _synthesize_clip(key, text, voice, model, response_format):
+    return _store_synthesized(key, text, voice, model, response_format,
+                              *synthesize(text, voice, model, response_format))
+
+
+def _store_synthesized(key, text, voice, model, response_format, audio_content, voice_used, model_used):
+    used_key = clip_key(text, voice_used, model_used, response_format)
+    if used_key == key:
+        return store_clip(key, text, voice, model, response_format, audio_content)[0]
+
+    # fallback audio never goes under the requested key, the phrase gets synthesized
+    # with the requested backend again once the fallback entry expired
+    remember_fallback(key, used_key)
+    clip = AudioClip.objects.filter(key=used_key).first()
+    if clip is None:
+        clip = store_clip(used_key, text, voice_used, model_used, response_format, audio_content)[0]
+    return clip
+
+
+def get_clip_bytes(clip):
+    cache = get_audio_cache()
+    data = cache.get(clip.key)
+    if data is None:
+        with S3Boto3Storage().open(clip.path, 'rb') as f:
+            data = f.read()
+        cache.put(clip.key, data)
+    return data
+
+
+def pending_clip(key):
+    """
+    The PendingClip of `key`, or None. One left untouched for longer than the lock
+    TTL belonged to a worker that died.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.TTS_LOCK_TTL_SECONDS)
+    return PendingClip.objects.filter(key=key, updated_at__gte=stale_before).first()
+
+
+def _mark_pending(key, audio_content=None):
+    PendingClip.objects.update_or_create(key=key, defaults={'audio': audio_content})
+
+
+def _reserve_pending(key):
+    """Claims `key` for this process. Only the set is touched under the lock, the row is written after."""
+    with _pending_lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+        return True
+
+
+def _clear_pending(key):
+    # the AudioClip row exists by now, or the attempt failed and the key is unknown again
+    PendingClip.objects.filter(key=key).delete()
+    with _pending_lock:
+        _pending.discard(key)
+
+
+def _create_clip_in_background(key, text, voice, model, response_format):
+    try:
+        return get_or_create_clip(text, voice, model, response_format)
+    finally:
+        _clear_pending(key)
+        close_old_connections()
+
+
+def schedule_clip(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    """
+    Starts synthesis off the request thread and returns the clip key right away.
+    Scheduling a phrase that is already being synthesized is a no-op.
+    """
+    key = clip_key(text, voice, model, response_format)
+    if _reserve_pending(key):
+        _mark_pending(key)
+        _synthesis_executor.submit(_create_clip_in_background, key, text, voice, model, response_format)
+    return key
+
+
+def _store_clip_in_background(key, text, voice, model, response_format, audio_content, lock):
+    try:
+        store_clip(key, text, voice, model, response_format, audio_content)
+    finally:
+        _clear_pending(key)
+        if lock is not None:
+            singleflight.release_lock(*lock)
+        close_old_connections()
+
+
+def schedule_store(key, text, voice, model, response_format, audio_content, lock=None):
+    """
+    For audio that already exists in memory: it goes into the local cache right
+    away and is uploaded to R2 off the request thread. Until the upload is done
+    the key is pending and the clip endpoint serves the audio from its PendingClip
+    row, whichever worker gets the request. `lock` is a singleflight (key, token)
+    released once the clip is stored.
+    """
+    get_audio_cache().put(key, audio_content)
+    if _reserve_pending(key):
+        _mark_pending(key, audio_content)
+        _storage_executor.submit(_store_clip_in_background, key, text, voice, model, response_format, audio_content,
+                                 lock)
+    elif lock is not None:
+        singleflight.release_lock(*lock)
+
+
+def _relay_stream(chunks, key, text, voice, model, response_format, token):
+    received = []
+    stored = False
+    try:
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+        used_key = clip_key(text, voice, model, response_format)
+        if used_key != key:
+            remember_fallback(key, used_key)
+        # the lock is held until the clip is stored, waiters serve the pending row meanwhile
+        schedule_store(used_key, text, voice, model, response_format, b''.join(received),
+                       lock=(key, token) if token is not None else None)
+        stored = True
+    finally:
+        # an abandoned response closes this generator, the provider stream goes with it
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        if not stored and token is not None:
+            singleflight.release_lock(key, token)
+
+
+def _finished_audio(key):
+    """
+    The audio of `key` once it is stored or its pending row holds it, which is the
+    case for a stream that went out and is being uploaded, else None.
+    """
+    clip = find_clip(key)
+    if clip is not None:
+        return get_clip_bytes(clip)
+    pending = pending_clip(fallback_key(key) or key)
+    return bytes(pending.audio) if pending is not None and pending.audio is not None else None
+
+
+def stream_synthesis(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    """
+    Opens the synthesis stream right away, so provider errors surface before any
+    response headers go out and the registry can still fall back, and returns an
+    iterator over the audio chunks. Once the whole clip went out it is handed to a
+    background thread for the R2 upload. A stream the client abandoned halfway is
+    not stored. Concurrent requests for the phrase wait for the one streaming it
+    and get its audio in a single chunk, without waiting for the upload.
+    """
+    key = clip_key(text, voice, model, response_format)
+    audio_content, token = singleflight.claim(key, lambda: _finished_audio(key))
+    if audio_content is not None:
+        return iter([audio_content])
+
+    try:
+        chunks, backend = tts_backends.registry.stream(text, voice, model, response_format, STREAM_CHUNK_SIZE)
+    except BaseException:
+        if token is not None:
+            singleflight.release_lock(key, token)
+        raise
+    return _relay_stream(chunks, key, text, backend.voice_for(voice), backend.model_for(model), response_format,
+                         token)
+
+
+async def aget_or_create_clip(text, voice=TTS_VOICE, model=TTS_MODEL, response_format=TTS_FORMAT):
+    """
+    get_or_create_clip for the async views, under the same lock. Waiting for another
+    worker and the OpenAI request happen on the event loop, only the database queries
+    and the R2 upload, which has no async client, take a thread.
+    """
+    key = clip_key(text, voice, model, response_format)
+    clip, token = await singleflight.aclaim(key, lambda: find_clip(key))
+    if clip is not None:
+        return clip, False
+
+    try:
+        audio_content, voice_used, model_used = await asynthesize(text, voice, model, response_format)
+        clip = await sync_to_async(_store_synthesized)(key, text, voice, model, response_format,
+                                                       audio_content, voice_used, model_used)
+    finally:
+        if token is not None:
+            await sync_to_async(singleflight.release_lock)(key, token)
+    return clip, True
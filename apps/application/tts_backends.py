@@ -0,0 +1,309 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+from . import play_sound
+
+
+class TTSBackend:
+    name = None
+    models = ()
+    voices = ()
+    default_voice = None
+    formats = ('mp3',)
+    # only serve phrases asked for with another backend's model when that one is down
+    fallback = True
+
+    def voice_for(self, voice):
+        return voice if voice in self.voices else self.default_voice
+
+    def model_for(self, model):
+        return model if model in self.models else self.models[0]
+
+    def synthesize(self, text, voice, model, response_format):
+        raise NotImplementedError
+
+    async def asynthesize(self, text, voice, model, response_format):
+        return await sync_to_async(self.synthesize, thread_sensitive=False)(text, voice, model, response_format)
+
+    def stream(self, text, voice, model, response_format, chunk_size):
+        """
+        Returns an iterator over the audio chunks. Provider errors have to surface
+        here rather than while iterating, so the registry can still fall back.
+        """
+        return iter([self.synthesize(text, voice, model, response_format)])
+
+
+class OpenAIBackend(TTSBackend):
+    name = 'openai'
+    models = ('tts-1', 'tts-1-hd')
+    voices = ('alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer')
+    default_voice = 'nova'
+    formats = ('mp3', 'opus', 'aac', 'flac')
+
+    def synthesize(self, text, voice, model, response_format):
+        client = OpenAI(api_key=os.getenv('OPEN_AI_API_KEY'))
+        response = client.audio.speech.create(
+            model=self.model_for(model),
+            voice=self.voice_for(voice),
+            input=text,
+            response_format=response_format,
+        )
+        return response.content
+
+    async def asynthesize(self, text, voice, model, response_format):
+        client = AsyncOpenAI(api_key=os.getenv('OPEN_AI_API_KEY'))
+        response = await client.audio.speech.create(
+            model=self.model_for(model),
+            voice=self.voice_for(voice),
+            input=text,
+            response_format=response_format,
+        )
+        return response.content
+
+    def stream(self, text, voice, model, response_format, chunk_size):
+        client = OpenAI(api_key=os.getenv('OPEN_AI_API_KEY'))
+        stack = ExitStack()
+        response = stack.enter_context(client.audio.speech.with_streaming_response.create(
+            model=self.model_for(model),
+            voice=self.voice_for(voice),
+            input=text,
+            response_format=response_format,
+        ))
+        return self._iter_chunks(stack, response, chunk_size)
+
+    @staticmethod
+    def _iter_chunks(stack, response, chunk_size):
+        with stack:
+            yield from response.iter_bytes(chunk_size)
+
+
+class GTTSBackend(TTSBackend):
+    name = 'gtts'
+    models = (play_sound.GTTS_MODEL,)
+    voices = ('ru', 'kk', 'en')
+    default_voice = play_sound.GTTS_LANG
+
+    def synthesize(self, text, voice, model, response_format):
+        return play_sound.synthesize(text, lang=self.voice_for(voice))
+
+
+class LocalBackend(TTSBackend):
+    """
+    Stand-in that needs no network, produces deterministic bytes instantly. Used by
+    tests and local development through the 'local' model, never as a fallback.
+    """
+    name = 'local'
+    models = ('local',)
+    voices = ('local',)
+    default_voice = 'local'
+    formats = ('mp3', 'opus', 'aac', 'flac')
+    fallback = False
+
+    def synthesize(self, text, voice, model, response_format):
+        return b'LOCAL' + hashlib.sha256(f'{text}\n{voice}\n{response_format}'.encode('utf-8')).digest()
+
+
+class BackendStats:
+    """
+    Latency and error bookkeeping plus a circuit breaker. Calls slower than
+    TTS_SLOW_SECONDS count as failures for the breaker, so a provider that
+    hangs gets routed around just like one that errors.
+    """
+
+    def __init__(self, window=50):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        # 0 while the breaker is closed
+        self.open_until = 0
+        self.probing = False
+
+    def allow(self):
+        """
+        Whether a call may go to the backend. Once the cooldown of a tripped breaker is
+        over a single call goes through as the half-open probe, the others are turned
+        away until it reports back.
+        """
+        with self._lock:
+            if not self.open_until:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def is_open(self):
+        with self._lock:
+            return bool(self.open_until) and (time.monotonic() < self.open_until or self.probing)
+
+    def _trip_if_needed(self):
+        if self.consecutive_failures >= settings.TTS_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + settings.TTS_BREAKER_COOLDOWN_SECONDS
+
+    def record_success(self, latency):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            slow = latency > settings.TTS_SLOW_SECONDS
+            self.outcomes.append(not slow)
+            self.probing = False
+            if slow:
+                self.consecutive_failures += 1
+                self._trip_if_needed()
+            else:
+                self.consecutive_failures = 0
+                self.open_until = 0
+
+    def record_failure(self, latency):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.latencies.append(latency)
+            self.outcomes.append(False)
+            self.probing = False
+            self.consecutive_failures += 1
+            self._trip_if_needed()
+
+    def mean_latency(self):
+        with self._lock:
+            return sum(self.latencies) / len(self.latencies) if self.latencies else 0
+
+    def error_rate(self):
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0
+
+    def score(self):
+        # expected time to a usable clip, a failed attempt costs roughly a retry
+        return self.mean_latency() * (1 + self.error_rate())
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean_latency': round(self.mean_latency(), 3),
+            'p95_latency': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else 0,
+            'error_rate': round(self.error_rate(), 3),
+            'circuit_open': self.is_open(),
+        }
+
+
+class BackendRegistry:
+    def __init__(self):
+        self._backends = {}
+        self._stats = {}
+
+    def register(self, backend):
+        self._backends[backend.name] = backend
+        self._stats[backend.name] = BackendStats()
+
+    def unregister(self, name):
+        self._backends.pop(name, None)
+        self._stats.pop(name, None)
+
+    def for_model(self, model):
+        for backend in self._backends.values():
+            if model in backend.models:
+                return backend
+        raise ValueError(f"No TTS backend for model '{model}'.")
+
+    def candidates(self, model, response_format):
+        """
+        The backend that owns `model` first, unless its breaker is open or it is
+        slow while a fallback is faster. Fallbacks follow ordered by score.
+        """
+        preferred = self.for_model(model)
+        fallbacks = sorted(
+            (b for b in self._backends.values()
+             if b is not preferred and b.fallback and response_format in b.formats),
+            key=lambda b: self._stats[b.name].score()
+        )
+        preferred_stats = self._stats[preferred.name]
+        if fallbacks and preferred_stats.mean_latency() > settings.TTS_SLOW_SECONDS \
+                and self._stats[fallbacks[0].name].score() < preferred_stats.score():
+            return fallbacks[:1] + [preferred] + fallbacks[1:]
+        return [preferred] + fallbacks
+
+    def _attempts(self, model, response_format):
+        # breakers are asked one backend at a time, a half-open one's probe is only
+        # taken by a call that is actually made
+        candidates = self.candidates(model, response_format)
+        allowed = False
+        for backend in candidates:
+            if self._stats[backend.name].allow():
+                allowed = True
+                yield backend
+        if not allowed:
+            # with every breaker open, trying the preferred backend beats failing outright
+            yield candidates[0]
+
+    def _run(self, model, response_format, call):
+        """Returns (result, backend) of the first backend `call` succeeds with."""
+        error = None
+        for backend in self._attempts(model, response_format):
+            stats = self._stats[backend.name]
+            started = time.monotonic()
+            try:
+                result = call(backend)
+            except Exception as e:
+                stats.record_failure(time.monotonic() - started)
+                error = e
+                continue
+            except BaseException:
+                # a probe has to report back either way
+                stats.record_failure(time.monotonic() - started)
+                raise
+            stats.record_success(time.monotonic() - started)
+            return result, backend
+        raise error
+
+    def synthesize(self, text, voice, model, response_format):
+        """
+        Returns (audio_content, backend). With a fallback the audio is in that
+        backend's voice, see its voice_for and model_for.
+        """
+        return self._run(model, response_format,
+                         lambda backend: backend.synthesize(text, voice, model, response_format))
+
+    def stream(self, text, voice, model, response_format, chunk_size):
+        """Returns (chunks, backend). Only opening the stream counts for the breaker."""
+        return self._run(model, response_format,
+                         lambda backend: backend.stream(text, voice, model, response_format, chunk_size))
+
+    async def asynthesize(self, text, voice, model, response_format):
+        error = None
+        for backend in self._attempts(model, response_format):
+            stats = self._stats[backend.name]
+            started = time.monotonic()
+            try:
+                audio_content = await backend.asynthesize(text, voice, model, response_format)
+            except Exception as e:
+                stats.record_failure(time.monotonic() - started)
+                error = e
+                continue
+            except BaseException:
+                stats.record_failure(time.monotonic() - started)
+                raise
+            stats.record_success(time.monotonic() - started)
+            return audio_content, backend
+        raise error
+
+    def stats(self):
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+registry = BackendRegistry()
+registry.register(OpenAIBackend())
+registry.register(GTTSBackend())
+registry.register(LocalBackend())
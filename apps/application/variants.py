@@ -0,0 +1,139 @@
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .audio_cache import get_audio_cache
+from ..models import AudioVariant
+
+# name -> how to produce it; the stored original is always available as well
+VARIANTS = {
+    'opus-24k': {
+        'codec': 'libopus',
+        'bitrate': '24k',
+        'container': 'ogg',
+        'extension': 'opus',
+        'content_type': 'audio/ogg',
+    },
+    'mp3-32k': {
+        'codec': 'libmp3lame',
+        'bitrate': '32k',
+        'container': 'mp3',
+        'extension': 'mp3',
+        'content_type': 'audio/mpeg',
+    },
+}
+
+SLOW_CONNECTION_TYPES = ('slow-2g', '2g', '3g')
+SLOW_DOWNLINK_MBPS = 1.0
+
+# transcoding is CPU bound, one at a time keeps it from starving the web workers
+_transcode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts-transcode')
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def ffmpeg_available():
+    return shutil.which(settings.FFMPEG_BINARY) is not None
+
+
+def transcode(audio_content, name):
+    variant = VARIANTS[name]
+    result = subprocess.run(
+        [
+            settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0', '-vn', '-ac', '1',
+            '-c:a', variant['codec'], '-b:a', variant['bitrate'],
+            '-f', variant['container'], 'pipe:1',
+        ],
+        input=audio_content,
+        capture_output=True,
+        check=True,
+        timeout=30,
+    )
+    return result.stdout
+
+
+def cache_key(clip_key, name):
+    return f'{clip_key}.{name}'
+
+
+def variant_path(clip, name):
+    return f"{clip.path.rsplit('.', 1)[0]}.{name}.{VARIANTS[name]['extension']}"
+
+
+def create_variants(clip, audio_content):
+    existing = set(AudioVariant.objects.filter(clip=clip).values_list('name', flat=True))
+    for name in VARIANTS:
+        if name in existing:
+            continue
+        data = transcode(audio_content, name)
+        path = S3Boto3Storage().save(variant_path(clip, name), ContentFile(data))
+        get_audio_cache().put(cache_key(clip.key, name), data)
+        AudioVariant.objects.get_or_create(clip=clip, name=name, defaults={'path': path, 'size': len(data)})
+
+
+def _create_variants_in_background(clip, audio_content):
+    try:
+        create_variants(clip, audio_content)
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard(clip.key)
+        close_old_connections()
+
+
+def schedule_variants(clip, audio_content):
+    if not ffmpeg_available():
+        return
+    with _scheduled_lock:
+        if clip.key in _scheduled:
+            return
+        _scheduled.add(clip.key)
+    _transcode_executor.submit(_create_variants_in_background, clip, audio_content)
+
+
+def negotiate(request):
+    """
+    Picks a variant from an explicit ?variant= or from client hints. Clients that
+    say they are on a slow or metered link get the small opus file when their
+    Accept header allows ogg, a low-bitrate mp3 otherwise. Everyone else gets
+    the original. Returns a VARIANTS key or None.
+    """
+    requested = request.GET.get('variant')
+    if requested in VARIANTS:
+        return requested
+
+    save_data = request.headers.get('Save-Data', '').lower() == 'on'
+    slow = request.headers.get('ECT', '').lower() in SLOW_CONNECTION_TYPES
+    try:
+        slow = slow or float(request.headers.get('Downlink', '')) < SLOW_DOWNLINK_MBPS
+    except ValueError:
+        pass
+
+    if not (save_data or slow):
+        return None
+    accept = request.headers.get('Accept', '')
+    if 'audio/ogg' in accept or 'audio/opus' in accept:
+        return 'opus-24k'
+    return 'mp3-32k'
+
+
+def get_variant_bytes(clip, name):
+    """Returns the variant bytes, or None if it has not been produced yet."""
+    cache = get_audio_cache()
+    data = cache.get(cache_key(clip.key, name))
+    if data is not None:
+        return data
+
+    variant = AudioVariant.objects.filter(clip=clip, name=name).first()
+    if variant is None:
+        return None
+    with S3Boto3Storage().open(variant.path, 'rb') as f:
+        data = f.read()
+    cache.put(cache_key(clip.key, name), data)
+    return data
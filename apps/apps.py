@@ -5,3 +5,5 @@ class AppsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps'
 
+    def ready(self):
+        from . import signals  # noqa: F401
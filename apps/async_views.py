@@ -0,0 +1,172 @@
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .application import compose, derivatives, duplicates, tts
+from .models import Board, Folder, Image
+from .serializers import PlaySoundSerializer, BoardSerializer, HistorySerializer, ImageSerializer, \
+    TextToSpeechSerializer
+
+# Async counterparts of the I/O bound endpoints in views.py. DRF's APIView is sync only,
+# so these are plain Django views that only make sense when served through pecs.asgi.
+
+
+async def authenticate(request):
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def body_data(request):
+    """The JSON body, what DRF's request.data is for the sync views. None if it does not parse."""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def unauthorized():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                        status=status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncTextToSpeechView(View):
+
+    async def get(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return unauthorized()
+
+        # the text comes in the body, like for TextToSpeechView
+        data = body_data(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TextToSpeechSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            clip, created = await tts.aget_or_create_clip(serializer.data['text'])
+        except Exception as e:
+            return JsonResponse({"error": f"Failed to upload audio to R2: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return JsonResponse({"audio_url": tts.clip_url(clip.path), "cached": not created},
+                            status=status.HTTP_200_OK)
+
+
+class AsyncPlaySoundView(View):
+
+    async def get(self, request):
+        serializer = PlaySoundSerializer(data=request.GET)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        input_data = serializer.validated_data.get('input_data')
+        board_id = serializer.validated_data.get('board_id')
+
+        try:
+            board = await Board.objects.aget(id=board_id)
+        except Board.DoesNotExist:
+            return JsonResponse({'success': False, 'message': "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        user = await authenticate(request)
+        if user is not None:
+            history_serializer = HistorySerializer(data={
+                'text': input_data,
+                'date': datetime.today().date(),
+                'time': datetime.now().strftime("%H:%M:%S"),
+                'user': user.id,
+                'board': board.id
+            })
+            if not await sync_to_async(history_serializer.is_valid)():
+                return JsonResponse(history_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            await sync_to_async(history_serializer.save)()
+
+        key, clip, ready = await sync_to_async(compose.resolve_phrase)(
+            input_data,
+            labels=serializer.validated_data.get('labels'),
+            compose=serializer.validated_data.get('compose'),
+            crossfade_ms=serializer.validated_data.get('crossfade_ms'),
+        )
+
+        board_data = await sync_to_async(lambda: BoardSerializer(board).data)()
+        return JsonResponse({
+            'success': True,
+            'message': "Sound played successfully.",
+            'audio_ready': ready,
+            'audio_url': tts.clip_url(clip.path) if clip is not None else None,
+            'clip_url': request.build_absolute_uri(reverse('tts-clip', args=[key])),
+            'board': board_data
+        }, status=status.HTTP_200_OK)
+
+
+class AsyncFolderImageView(View):
+
+    async def post(self, request, id):
+        user = await authenticate(request)
+        if user is None:
+            return unauthorized()
+
+        image_data = request.FILES.get('image')
+        label = request.POST.get('label', '')
+
+        if not image_data:
+            return JsonResponse({"error": "'image' field is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not label:
+            return JsonResponse({"error": "'label' field is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            folder = await Folder.objects.aget(id=id)
+        except Folder.DoesNotExist:
+            return JsonResponse({"error": "Folder with the specified ID does not exist."},
+                                status=status.HTTP_404_NOT_FOUND)
+
+        # upload first, off the event loop, then create the row with the stored name
+        # so the model save does not trigger a second, blocking upload
+        field = Image._meta.get_field('image')
+        original = await sync_to_async(image_data.read, thread_sensitive=False)()
+        image_data.seek(0)
+        # a photo already in the user's library reuses its stored object instead of a new upload
+        phash = await sync_to_async(duplicates.fingerprint_or_blank, thread_sensitive=False)(original)
+        duplicate = await sync_to_async(duplicates.find_duplicate)(user, phash)
+        try:
+            if duplicate:
+                name = duplicate.image.name
+            else:
+                name = await sync_to_async(field.storage.save, thread_sensitive=False)(
+                    field.generate_filename(None, image_data.name), image_data
+                )
+            image = await Image.objects.acreate(
+                folder=folder, image=name, label=label, creator=user,
+                phash=duplicate.phash if duplicate else phash,
+                derivatives=dict(duplicate.derivatives) if duplicate else {},
+            )
+        except Exception as e:
+            return JsonResponse({"error": f"Failed to upload image: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        await sync_to_async(duplicates.index_fingerprint)(image.id, image.phash)
+        if derivatives.missing(image):
+            derivatives.schedule_derivatives(image, original)
+
+        image_details = await sync_to_async(lambda: ImageSerializer(image).data)()
+        return JsonResponse({
+            "message": "Image uploaded successfully.",
+            "folder_id": folder.id,
+            "image_id": image.id,
+            "image_details": image_details,
+            "duplicate_of": duplicate.id if duplicate else None,
+        }, status=status.HTTP_201_CREATED)
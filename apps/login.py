@@ -154,6 +154,12 @@ def is_caregiver(user):
     return user.groups.filter(name='CAREGIVER').exists()
 
 
+def user_roles(user):
+    # (is_recipient, is_caregiver) in one query instead of two
+    names = set(user.groups.filter(name__in=['RECIPIENT', 'CAREGIVER']).values_list('name', flat=True))
+    return 'RECIPIENT' in names, 'CAREGIVER' in names
+
+
 def verify_code(request, code_check):
     try:
         code = models.Codes.objects.get(code=code_check)
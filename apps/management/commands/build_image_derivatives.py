@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.application import derivatives
+from apps.models import Image
+
+
+def create(image):
+    try:
+        derivatives.create_derivatives(image)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Create the resized WebP/JPEG copies of library images that do not have them yet, " \
+           "such as images uploaded before derivatives existed. Safe to rerun."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', type=int, action='append', default=[], help="Folder ID (repeatable)")
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_DERIVATIVE_WORKERS)
+
+    def handle(self, *args, **options):
+        images = Image.objects.order_by('id')
+        if options['folder']:
+            images = images.filter(folder_id__in=options['folder'])
+        pending = [image for image in images.iterator() if derivatives.missing(image)]
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(create, image): image for image in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Image {futures[future].id}: {e}")
+                self.stdout.write(f"\r{done + failed}/{len(pending)} images ({failed} failed)", ending='')
+                self.stdout.flush()
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f"Created derivatives for {done} images, {failed} failed."))
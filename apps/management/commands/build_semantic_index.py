@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.application import semantic
+
+
+class Command(BaseCommand):
+    help = "Build the semantic search index over card labels from scratch. Without word vectors " \
+           "labels only match by spelling, import aligned fastText vectors for synonyms."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', help="Word vectors in the fastText .vec format to import first")
+        parser.add_argument('--max-words', type=int, default=200000,
+                            help="Import only the most frequent words of the vectors file")
+
+    def handle(self, *args, **options):
+        if options['vectors']:
+            try:
+                words = semantic.import_word_vectors(options['vectors'], options['max_words'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not import word vectors: {e}")
+            self.stdout.write(f"Imported {words} word vectors.")
+
+        images = semantic.build()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {images} card labels."))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.application import duplicates, images
+from apps.models import Image
+
+
+class Command(BaseCommand):
+    help = "List clusters of near-identical library images. With --backfill, images uploaded " \
+           "before fingerprints existed are downloaded and fingerprinted first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--distance', type=int, default=settings.IMAGE_DUPLICATE_DISTANCE,
+                            help="Fingerprint bits two images may differ in")
+        parser.add_argument('--backfill', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            for image in Image.objects.filter(phash='').order_by('id').iterator():
+                try:
+                    phash = duplicates.fingerprint_or_blank(images.read_original(image))
+                except Exception as e:
+                    self.stderr.write(f"Image {image.id}: {e}")
+                    continue
+                # update() rather than save(), a fingerprint changes nothing clients see
+                Image.objects.filter(id=image.id).update(phash=phash)
+                duplicates.index_fingerprint(image.id, phash)
+
+        clusters = duplicates.clusters(options['distance'])
+        for group in clusters:
+            stored = {image.image.name for image in group}
+            self.stdout.write(f"{len(group)} images, {len(stored)} stored files:")
+            for image in group:
+                self.stdout.write(f"  #{image.id} {image.label!r} in {image.folder} by {image.creator} "
+                                  f"({image.phash}, {image.image.name})")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(clusters)} clusters, {sum(len(group) for group in clusters)} images."
+        ))
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.application import presynthesis
+from apps.models import Board, Folder
+
+
+class Command(BaseCommand):
+    help = "Synthesize card label audio ahead of time for boards and folders. Safe to rerun, " \
+           "labels that already have a clip are skipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--board', type=int, action='append', default=[], help="Board ID (repeatable)")
+        parser.add_argument('--folder', type=int, action='append', default=[], help="Folder ID (repeatable)")
+        parser.add_argument('--all-folders', action='store_true', help="Every folder in the library")
+        parser.add_argument('--workers', type=int, default=settings.TTS_PRESYNTHESIS_WORKERS)
+
+    def handle(self, *args, **options):
+        labels = []
+
+        for board_id in options['board']:
+            try:
+                labels += presynthesis.board_labels(Board.objects.get(id=board_id))
+            except Board.DoesNotExist:
+                raise CommandError(f"Board {board_id} does not exist.")
+
+        folders = Folder.objects.all() if options['all_folders'] else Folder.objects.filter(id__in=options['folder'])
+        missing = set(options['folder']) - set(folders.values_list('id', flat=True))
+        if missing:
+            raise CommandError(f"Folders {sorted(missing)} do not exist.")
+        for folder in folders:
+            labels += presynthesis.folder_labels(folder)
+
+        if not labels:
+            raise CommandError("Nothing to synthesize, pass --board, --folder or --all-folders.")
+
+        def progress(done, failed, total):
+            self.stdout.write(f"\r{done + failed}/{total} synthesized ({failed} failed)", ending='')
+            self.stdout.flush()
+
+        done, failed, total = presynthesis.presynthesize(labels, workers=options['workers'], progress=progress)
+        if total:
+            self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"{done} labels synthesized, {failed} failed, everything else was already cached."
+        ))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.application import sync
+
+
+class Command(BaseCommand):
+    help = "Delete board sync change log entries older than the retention period. Clients with " \
+           "an older cursor get a full reset on their next sync."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_CHANGELOG_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = sync.prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} change log entries."))
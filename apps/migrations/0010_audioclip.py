@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:56
+
+import storages.backends.s3
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0009_alter_codes_time_alter_history_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioClip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('text', models.CharField(max_length=1000)),
+                ('voice', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=50)),
+                ('response_format', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TextEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=1000)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(storage=storages.backends.s3.S3Storage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0012_audiocliplock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('path', models.CharField(max_length=255)),
+                ('size', models.IntegerField(default=0)),
+                ('clip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='apps.audioclip')),
+            ],
+            options={
+                'unique_together': {('clip', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0014_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=100)),
+                ('revision', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(choices=[('tab', 'Tab'), ('position', 'Image position'), ('folder', 'Folder'), ('image', 'Image')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'revision'], name='apps_change_scope_b9af5f_idx')],
+            },
+        ),
+    ]
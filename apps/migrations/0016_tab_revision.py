@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0015_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tab',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from itertools import count
+
+from django.db import migrations, models
+
+
+def parse_coordinate(value):
+    try:
+        return max(int(float(value)), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def next_free_cell(occupied, straps_num):
+    for x in count():
+        for y in range(max(straps_num, 1)):
+            if (x, y) not in occupied:
+                return x, y
+
+
+def to_grid(apps, schema_editor):
+    Tab = apps.get_model('apps', 'Tab')
+    Image_positions = apps.get_model('apps', 'Image_positions')
+
+    straps = dict(Tab.objects.values_list('id', 'straps_num'))
+    by_tab = defaultdict(list)
+    for position in Image_positions.objects.order_by('tab_id', 'id'):
+        by_tab[position.tab_id].append(position)
+
+    for tab_id, positions in by_tab.items():
+        occupied = set()
+        unplaced = []
+        for position in positions:
+            cell = parse_coordinate(position.position_x), parse_coordinate(position.position_y)
+            if None in cell or cell in occupied:
+                unplaced.append(position)
+                continue
+            occupied.add(cell)
+            position.grid_x, position.grid_y = cell
+        # unreadable coordinates and cards stacked on one cell move to the first free cells
+        for position in unplaced:
+            position.grid_x, position.grid_y = next_free_cell(occupied, straps[tab_id])
+            occupied.add((position.grid_x, position.grid_y))
+        Image_positions.objects.bulk_update(positions, ['grid_x', 'grid_y'], batch_size=500)
+
+
+def from_grid(apps, schema_editor):
+    Image_positions = apps.get_model('apps', 'Image_positions')
+    positions = list(Image_positions.objects.all())
+    for position in positions:
+        position.position_x = str(position.grid_x)
+        position.position_y = str(position.grid_y)
+    Image_positions.objects.bulk_update(positions, ['position_x', 'position_y'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0016_tab_revision'),
+    ]
+
+    operations = [
+        # nullable first, so the old columns can be added back when migrating backwards
+        migrations.AlterField(
+            model_name='image_positions',
+            name='position_x',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='image_positions',
+            name='position_y',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='image_positions',
+            name='grid_x',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image_positions',
+            name='grid_y',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(to_grid, from_grid),
+        migrations.RemoveField(
+            model_name='image_positions',
+            name='position_x',
+        ),
+        migrations.RemoveField(
+            model_name='image_positions',
+            name='position_y',
+        ),
+        migrations.RenameField(
+            model_name='image_positions',
+            old_name='grid_x',
+            new_name='position_x',
+        ),
+        migrations.RenameField(
+            model_name='image_positions',
+            old_name='grid_y',
+            new_name='position_y',
+        ),
+        migrations.AlterField(
+            model_name='image_positions',
+            name='position_x',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='image_positions',
+            name='position_y',
+            field=models.IntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='image_positions',
+            constraint=models.UniqueConstraint(fields=('tab', 'position_y', 'position_x'), name='unique_tab_cell'),
+        ),
+    ]
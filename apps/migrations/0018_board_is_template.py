@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0017_image_positions_grid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='is_template',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
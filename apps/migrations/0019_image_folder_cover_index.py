@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0018_board_is_template'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['folder', 'id'], name='image_folder_id_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Full-text and trigram indexes for the library search, PostgreSQL only. The vector
+# expression must match IMAGE_VECTOR_SQL in apps/application/search.py.
+FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS image_label_fts_idx ON apps_image USING GIN "
+    "((to_tsvector('russian', label) || to_tsvector('simple', label)))",
+    "CREATE INDEX IF NOT EXISTS image_label_trgm_idx ON apps_image USING GIN (label gin_trgm_ops)",
+]
+BACKWARDS = [
+    "DROP INDEX IF EXISTS image_label_trgm_idx",
+    "DROP INDEX IF EXISTS image_label_fts_idx",
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in FORWARDS:
+        schema_editor.execute(statement)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in BACKWARDS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0019_image_folder_cover_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0020_image_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['folder', 'label', 'id'], name='image_folder_label_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0022_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='phash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=19),
+        ),
+    ]
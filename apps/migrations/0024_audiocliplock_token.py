@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0023_image_phash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiocliplock',
+            name='token',
+            field=models.CharField(default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+INDEX_CHUNKS = 5
+
+
+def index_fingerprints(apps, schema_editor):
+    # duplicates.chunk_values as of this migration
+    Image = apps.get_model('apps', 'Image')
+    FingerprintChunk = apps.get_model('apps', 'FingerprintChunk')
+    width = 64 // INDEX_CHUNKS
+    chunks = []
+    for image_id, phash in Image.objects.exclude(phash='').values_list('id', 'phash').iterator():
+        bits = int(phash[:16], 16)
+        for chunk in range(INDEX_CHUNKS):
+            size = 64 - chunk * width if chunk == INDEX_CHUNKS - 1 else width
+            chunks.append(FingerprintChunk(image_id=image_id, chunk=chunk,
+                                           value=(bits >> (chunk * width)) & ((1 << size) - 1)))
+    FingerprintChunk.objects.bulk_create(chunks, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0025_pendingclip_clipfallback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FingerprintChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk', models.PositiveSmallIntegerField()),
+                ('value', models.IntegerField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            related_name='fingerprint_chunks', to='apps.image')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chunk', 'value'], name='fingerprint_chunk_idx')],
+            },
+        ),
+        migrations.RunPython(index_fingerprints, migrations.RunPython.noop),
+    ]
@@ -14,6 +14,77 @@ class TextEntry(models.Model):
     text = models.CharField(max_length=1000)
 
 
+class AudioClip(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    text = models.CharField(max_length=1000)
+    voice = models.CharField(max_length=50)
+    model = models.CharField(max_length=50)
+    response_format = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.text
+
+
+class AudioVariant(models.Model):
+    clip = models.ForeignKey(AudioClip, on_delete=models.CASCADE, related_name='variants')
+    name = models.CharField(max_length=20)
+    path = models.CharField(max_length=255)
+    size = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('clip', 'name')
+
+
+class AudioClipLock(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    # the holder's, a worker whose stale lock was taken over must not release the new one
+    token = models.CharField(max_length=32, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class PendingClip(models.Model):
+    # a clip being synthesized or uploaded, seen by every worker until its AudioClip row exists
+    key = models.CharField(max_length=64, unique=True)
+    # composed and streamed audio, served from here while it is uploaded
+    audio = models.BinaryField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ClipFallback(models.Model):
+    # the clip a fallback backend produced in place of `key`, until the requested backend is asked again
+    key = models.CharField(max_length=64, unique=True)
+    fallback_key = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+
+
+class CacheVersion(models.Model):
+    # 'board:<id>', 'library' or 'user:<id>', bumped by the signals in apps/signals.py
+    scope = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+
+class ChangeLog(models.Model):
+    KIND_CHOICES = [
+        ('tab', 'Tab'),
+        ('position', 'Image position'),
+        ('folder', 'Folder'),
+        ('image', 'Image'),
+    ]
+
+    # revision is the CacheVersion of the scope right after the change
+    scope = models.CharField(max_length=100)
+    revision = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['scope', 'revision'])]
+
+
 # Create your models here.
 class Care_recipient(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -46,17 +117,30 @@ class Care_giver(models.Model):
         return id
 
 
+class FolderQuerySet(models.QuerySet):
+    def with_visibility(self):
+        # staff folders are public, the flag comes along with the folder instead of a creator fetch per row
+        return self.annotate(creator_is_staff=models.F('creator__is_staff'))
+
+
 class Folder(models.Model):
     name = models.CharField(max_length=100)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, default=0)
 
+    objects = FolderQuerySet.as_manager()
+
     def __str__(self):
-        if (self.creator.is_staff):
+        if (self.is_public()):
             return self.name
         return self.name + ' (личное)'
 
+    def is_public(self):
+        if hasattr(self, 'creator_is_staff'):
+            return self.creator_is_staff
+        return self.creator.is_staff
+
     def is_private(self):
-        if (self.creator.is_staff):
+        if (self.is_public()):
             return False
         return True
 
@@ -68,16 +152,41 @@ class Image(models.Model):
     public = models.BooleanField(default=True)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     image_url = models.URLField()
+    # resized copies made after the upload, derivative name -> storage name
+    derivatives = models.JSONField(default=dict, blank=True)
+    # perceptual fingerprint of the stored picture, see images.fingerprint
+    phash = models.CharField(max_length=19, blank=True, default='', db_index=True)
+
+    class Meta:
+        indexes = [
+            # first image of a folder, used as its cover
+            models.Index(fields=['folder', 'id'], name='image_folder_id_idx'),
+            # folder listings are paged by (label, id)
+            models.Index(fields=['folder', 'label', 'id'], name='image_folder_label_idx'),
+        ]
 
     def __str__(self):
         return self.label
 
 
+class FingerprintChunk(models.Model):
+    # a piece of the image's phash, see duplicates.chunk_values. Near-identical images
+    # share at least one, so an upload only compares itself with those found by the index
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='fingerprint_chunks')
+    chunk = models.PositiveSmallIntegerField()
+    value = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['chunk', 'value'], name='fingerprint_chunk_idx')]
+
+
 class Board(models.Model):
     name = models.CharField(max_length=100)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     access_users = models.ManyToManyField(Care_giver, null=True, blank=True)
     color = models.CharField(max_length=50, default='#cc4b48')
+    # templates are cloned onto recipients' boards, staff templates are offered to everyone
+    is_template = models.BooleanField(default=False, db_index=True)
 
     def __str__(self):
         return self.name
@@ -88,6 +197,8 @@ class Tab(models.Model):
     straps_num = models.IntegerField(default=3, validators=[MinValueValidator(1), MaxValueValidator(5)])
     board = models.ForeignKey(Board, on_delete=models.CASCADE)
     color = models.CharField(max_length=50, default='#619451')
+    # bumped by every layout save, clients send the one they edited for optimistic concurrency
+    revision = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         if self.name is not None:
@@ -97,10 +208,17 @@ class Tab(models.Model):
 
 class Image_positions(models.Model):
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
-    position_x = models.CharField(max_length=50)
-    position_y = models.CharField(max_length=50)
+    # grid cell, y is the strap (row) and x the slot on it
+    position_x = models.IntegerField()
+    position_y = models.IntegerField()
     tab = models.ForeignKey(Tab, on_delete=models.CASCADE)
 
+    class Meta:
+        # one card per cell, the unique index on (tab, y, x) also serves layout and occupancy lookups
+        constraints = [
+            models.UniqueConstraint(fields=['tab', 'position_y', 'position_x'], name='unique_tab_cell'),
+        ]
+
 
 class History(models.Model):
     text = models.CharField(max_length=250)
@@ -115,3 +233,22 @@ class Codes(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=False)
     time = models.TimeField(default=datetime.datetime.now().strftime("%H:%M:%S"))
 
+
+
+class PresynthesisJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    board = models.ForeignKey(Board, on_delete=models.CASCADE, null=True, blank=True)
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    total = models.IntegerField(default=0)
+    done = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
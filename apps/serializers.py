@@ -3,7 +3,8 @@ from urllib.parse import quote
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers
 
-from .models import Care_recipient, Care_giver, Image, Board, Tab, Image_positions, History, Codes, Folder, TextEntry
+from .models import Care_recipient, Care_giver, Image, Board, Tab, Image_positions, History, Codes, Folder, TextEntry, \
+    PresynthesisJob
 
 
 class TextToSpeechSerializer(serializers.ModelSerializer):
@@ -63,38 +64,49 @@ class FolderSerializer(serializers.ModelSerializer):
 #         return None
 
 
+R2_BASE_URL = "https://pub-f6fd6da427b441459aff60f0c2f6b9e3.r2.dev/"
+
+
 class ImageSerializer(serializers.ModelSerializer):
     creator_name = serializers.CharField(source="creator.username", read_only=True)
     image_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
-        fields = ['id', 'label', 'folder', 'public', 'creator_id', 'creator_name', 'image_url']
+        fields = ['id', 'label', 'folder', 'public', 'creator_id', 'creator_name', 'image_url', 'srcset']
 
     def get_image_url(self, obj):
         try:
             if obj.image:
-                r2_base_url = "https://pub-f6fd6da427b441459aff60f0c2f6b9e3.r2.dev/"
                 encoded_image_name = quote(obj.image.name)
-                return f"{r2_base_url}{encoded_image_name}"
+                return f"{R2_BASE_URL}{encoded_image_name}"
             return None
         except Exception as e:
             print(f"Error getting image URL: {e}")
             return None
 
+    def get_srcset(self, obj):
+        # {"webp": {"128": url, ...}, "jpeg": {"256": url}}, empty until the resized copies exist
+        srcset = {}
+        for name, path in (obj.derivatives or {}).items():
+            image_format, size = name.split('-')
+            srcset.setdefault(image_format, {})[size] = f"{R2_BASE_URL}{quote(path)}"
+        return srcset
+
 
 class BoardSerializer(serializers.ModelSerializer):
     access_users = CaregiverSerializer(many=True, read_only=True)
 
     class Meta:
         model = Board
-        fields = ['id', 'name', 'creator', 'access_users', 'color']
+        fields = ['id', 'name', 'creator', 'access_users', 'color', 'is_template']
 
 
 class TabSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tab
-        fields = ['id', 'name', 'straps_num', 'board', 'color']
+        fields = ['id', 'name', 'straps_num', 'board', 'color', 'revision']
 
 
 class ImagePositionSerializer(serializers.ModelSerializer):
@@ -127,6 +139,56 @@ class VerifyCodeSerializer(serializers.Serializer):
 class PlaySoundSerializer(serializers.Serializer):
     input_data = serializers.CharField()
     board_id = serializers.IntegerField()
+    labels = serializers.ListField(child=serializers.CharField(), required=False)
+    compose = serializers.BooleanField(required=False, default=False)
+    crossfade_ms = serializers.IntegerField(required=False, default=0, min_value=0, max_value=500)
+
+
+class BoardCloneSerializer(serializers.Serializer):
+    recipients = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                       max_length=100)
+    name = serializers.CharField(max_length=100, required=False)
+    as_template = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if not data['as_template'] and not data['recipients']:
+            raise serializers.ValidationError("Pass recipients or as_template.")
+        return data
+
+
+class BundleRequestSerializer(serializers.Serializer):
+    # sha256 hashes of the entries the client already has
+    have = serializers.ListField(child=serializers.CharField(max_length=64), required=False, default=list)
+
+
+class LayoutOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['create', 'move', 'delete'])
+    id = serializers.IntegerField(required=False)
+    image = serializers.IntegerField(required=False)
+    position_x = serializers.IntegerField(min_value=0, required=False)
+    position_y = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        required = {
+            'create': ['image', 'position_x', 'position_y'],
+            'move': ['id', 'position_x', 'position_y'],
+            'delete': ['id'],
+        }[data['op']]
+        missing = [field for field in required if field not in data]
+        if missing:
+            raise serializers.ValidationError(f"'{data['op']}' needs {', '.join(missing)}.")
+        return data
+
+
+class LayoutSaveSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+    operations = serializers.ListField(child=LayoutOperationSerializer(), max_length=500)
+
+
+class PresynthesisJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PresynthesisJob
+        fields = ['id', 'board', 'folder', 'status', 'total', 'done', 'failed', 'created_at', 'updated_at']
 
 
 class SignupSerializer(serializers.ModelSerializer):
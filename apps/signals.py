@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .application import board_cache, semantic, sync
+from .models import Board, Folder, Image, Image_positions, Tab
+
+
+def library_scope(folder):
+    # staff folders are the shared library, everything else only shows up for its creator
+    if folder is None:
+        return board_cache.LIBRARY_SCOPE
+    return board_cache.LIBRARY_SCOPE if folder.is_public() else board_cache.user_scope(folder.creator_id)
+
+
+@receiver([post_save, post_delete], sender=Board)
+def board_changed(sender, instance, **kwargs):
+    board_cache.bump(board_cache.board_scope(instance.id))
+
+
+@receiver([post_save, post_delete], sender=Tab)
+def tab_changed(sender, instance, signal, **kwargs):
+    sync.record([(board_cache.board_scope(instance.board_id), 'tab', instance.id, signal is post_delete)])
+
+
+@receiver([post_save, post_delete], sender=Image_positions)
+def image_position_changed(sender, instance, signal, **kwargs):
+    if sync.is_muted():
+        return
+    # cascaded deletes come after their tab is gone, the tab bumped the board already
+    board_id = Tab.objects.filter(id=instance.tab_id).values_list('board_id', flat=True).first()
+    if board_id is not None:
+        sync.record([(board_cache.board_scope(board_id), 'position', instance.id, signal is post_delete)])
+
+
+@receiver([post_save, post_delete], sender=Image)
+def image_changed(sender, instance, signal, **kwargs):
+    folder = Folder.objects.filter(id=instance.folder_id).with_visibility().first()
+    # boards show the labels of their cards, wherever the image lives
+    positions = Image_positions.objects.filter(image_id=instance.id).values_list('id', 'tab__board_id')
+    scopes = {library_scope(folder), board_cache.user_scope(instance.creator_id)}
+    sync.record(
+        # the uploader's own list of images changes too, even for images in someone else's folder
+        [(scope, 'image', instance.id, signal is post_delete) for scope in sorted(scopes)]
+        + [(board_cache.board_scope(board_id), 'position', position_id, False) for position_id, board_id in positions]
+    )
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    # deleted images need nothing, search only returns what is still in the visible library
+    if update_fields is not None and 'label' not in update_fields:
+        return
+    image = instance.id, instance.label
+    # a broken index is logged, it must not fail the save
+    transaction.on_commit(lambda: semantic.add([image]), robust=True)
+
+
+@receiver([post_save, post_delete], sender=Folder)
+def folder_changed(sender, instance, signal, **kwargs):
+    sync.record([(library_scope(instance), 'folder', instance.id, signal is post_delete)])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, User):
+        user_ids = [instance.id]
+    else:
+        user_ids = pk_set or User.objects.filter(groups=instance).values_list('id', flat=True)
+    board_cache.bump(*[board_cache.user_scope(user_id) for user_id in user_ids])
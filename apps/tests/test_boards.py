@@ -0,0 +1,616 @@
+import json
+import tempfile
+import zipfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from apps.application import audio_cache, bundle, images, tts
+from apps.models import AudioClip, Board, Care_giver, Care_recipient, ChangeLog, Folder, Image, Image_positions, Tab
+
+# versions, board, tabs, positions, groups, and on a cold catalog the staff folders, covers and
+# images, the user's folders, covers, images and uploads
+BOARD_DETAIL_QUERIES = 5
+CATALOG_QUERIES = 7
+
+
+class BoardDetailQueryTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='boarduser', password='testpass123')
+        self.user.groups.add(Group.objects.create(name='CAREGIVER'))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+
+    def make_board(self, folders, images_per_folder, tabs, positions_per_tab):
+        board = Board.objects.create(name='Board', creator=self.user)
+        images = []
+        for f in range(folders):
+            creator = self.admin if f % 2 else self.user
+            folder = Folder.objects.create(name=f'Folder {f}', creator=creator)
+            for i in range(images_per_folder):
+                images.append(Image.objects.create(label=f'card {f}-{i}', image=f'images/{f}-{i}.png',
+                                                   folder=folder, creator=creator))
+        for t in range(tabs):
+            tab = Tab.objects.create(name=f'Tab {t}', straps_num=4, board=board)
+            for p in range(positions_per_tab):
+                Image_positions.objects.create(image=images[p % len(images)], tab=tab,
+                                               position_x=p % 4, position_y=p // 4)
+        return board
+
+    def test_query_count_does_not_grow_with_board_size(self):
+        # from two folders on there are staff and private ones, both with covers
+        for size in (2, 3, 8):
+            board = self.make_board(folders=size, images_per_folder=size, tabs=size, positions_per_tab=size)
+            with self.assertNumQueries(BOARD_DETAIL_QUERIES + CATALOG_QUERIES):
+                response = self.client.get(reverse('board', args=[board.id]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['tabs_img']), size)
+
+    def test_boards_share_the_library_catalog(self):
+        board = self.make_board(folders=3, images_per_folder=3, tabs=2, positions_per_tab=3)
+        other_board = Board.objects.create(name='Other', creator=self.user)
+        Tab.objects.create(name='Tab', straps_num=4, board=other_board)
+        self.client.get(reverse('board', args=[board.id]))
+
+        with self.assertNumQueries(BOARD_DETAIL_QUERIES):
+            response = self.client.get(reverse('board', args=[other_board.id]))
+        self.assertEqual(len(response.data['folders']), 3)
+        self.assertEqual(len(response.data['images']), 9)
+
+    def test_response_content(self):
+        board = self.make_board(folders=2, images_per_folder=2, tabs=2, positions_per_tab=3)
+        other = User.objects.create_user(username='other', password='testpass123')
+        Folder.objects.create(name='Hidden', creator=other)
+
+        response = self.client.get(reverse('board', args=[board.id]))
+
+        self.assertFalse(response.data['is_cr'])
+        self.assertTrue(response.data['is_cg'])
+        self.assertEqual([f['name'] for f in response.data['folders']], ['Folder 0', 'Folder 1'])
+        self.assertEqual([f['is_private'] for f in response.data['folders']], [True, False])
+        self.assertEqual(len(response.data['images']), 4)
+        for folder in response.data['folders']:
+            cover = response.data['c_images'][folder['id']]
+            self.assertEqual(cover[0]['label'], f"card {folder['name'][-1]}-0")
+        first_tab = response.data['tabs_img'][0]
+        self.assertEqual([p['image_label'] for p in first_tab['images']], ['card 0-0', 'card 0-1', 'card 1-0'])
+        self.assertEqual(first_tab['tab']['id'], response.data['tabs'][0]['id'])
+
+    def test_missing_board(self):
+        response = self.client.get(reverse('board', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_tab(self):
+        board = Board.objects.create(name='Board', creator=self.user)
+
+        response = self.client.post(reverse('board', args=[board.id]),
+                                    {'name': 'Food', 'straps': 4, 'color': '#ffffff'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tab.objects.get(board=board).name, 'Food')
+        sync_url = reverse('board-sync', args=[board.id])
+        self.assertEqual(self.client.post(sync_url, {}, format='json').status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class BoardSnapshotTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='boarduser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+
+        self.board = Board.objects.create(name='Board', creator=self.user)
+        self.folder = Folder.objects.create(name='Mine', creator=self.user)
+        self.image = Image.objects.create(label='сок', image='images/juice.png', folder=self.folder, creator=self.user)
+        self.tab = Tab.objects.create(name='Tab', straps_num=4, board=self.board)
+        self.position = Image_positions.objects.create(image=self.image, tab=self.tab, position_x=0, position_y=0)
+        self.url = reverse('board', args=[self.board.id])
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_unchanged_board_is_not_modified(self):
+        etag = self.get_etag()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_snapshot_is_reused_without_serialization(self):
+        self.get_etag()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['tabs_img'][0]['images'][0]['image_label'], 'сок')
+
+    def test_board_writes_change_the_etag(self):
+        etag = self.get_etag()
+        self.position.position_x = 1
+        self.position.save()
+        self.assertNotEqual(self.get_etag(), etag)
+
+        etag = self.get_etag()
+        Tab.objects.create(name='Second', straps_num=4, board=self.board)
+        self.assertNotEqual(self.get_etag(), etag)
+
+        etag = self.get_etag()
+        self.image.label = 'сок яблочный'
+        self.image.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['tabs_img'][0]['images'][0]['image_label'], 'сок яблочный')
+
+    def test_library_writes_change_the_etag(self):
+        etag = self.get_etag()
+        Folder.objects.create(name='Staff', creator=self.admin)
+        self.assertNotEqual(self.get_etag(), etag)
+
+        etag = self.get_etag()
+        self.user.groups.add(Group.objects.create(name='RECIPIENT'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_cr'])
+
+    def test_other_users_private_folders_keep_the_etag(self):
+        etag = self.get_etag()
+        other = User.objects.create_user(username='other', password='testpass123')
+        Folder.objects.create(name='Theirs', creator=other)
+        self.assertEqual(self.get_etag(), etag)
+
+    def test_deleted_board(self):
+        etag = self.get_etag()
+        self.board.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BoardSyncTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='boarduser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.board = Board.objects.create(name='Board', creator=self.user)
+        self.folder = Folder.objects.create(name='Mine', creator=self.user)
+        self.image = Image.objects.create(label='сок', image='images/juice.png', folder=self.folder, creator=self.user)
+        self.tab = Tab.objects.create(name='Tab', straps_num=4, board=self.board)
+        self.position = Image_positions.objects.create(image=self.image, tab=self.tab, position_x=0, position_y=0)
+        self.url = reverse('board-sync', args=[self.board.id])
+
+    def sync(self, cursor=None):
+        response = self.client.get(self.url, {'since': cursor} if cursor else {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_first_sync_returns_everything(self):
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual([t['id'] for t in data['tabs']], [self.tab.id])
+        self.assertEqual([p['id'] for p in data['positions']], [self.position.id])
+        self.assertEqual([i['id'] for i in data['images']], [self.image.id])
+        self.assertEqual([f['id'] for f in data['folders']], [self.folder.id])
+
+    def test_unchanged_board_syncs_nothing(self):
+        cursor = self.sync()['cursor']
+        data = self.sync(cursor)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['cursor'], cursor)
+        for key in ('tabs', 'positions', 'folders', 'images'):
+            self.assertEqual(data[key], [])
+            self.assertEqual(data['deleted'][key], [])
+
+    def test_delta_contains_only_changes_and_tombstones(self):
+        other_image = Image.objects.create(label='вода', image='images/water.png', folder=self.folder,
+                                           creator=self.user)
+        cursor = self.sync()['cursor']
+
+        self.position.position_x = 2
+        self.position.save()
+        moved = Image_positions.objects.create(image=other_image, tab=self.tab, position_x=1, position_y=0)
+        moved_id, other_image_id = moved.id, other_image.id
+        moved.delete()
+        new_tab = Tab.objects.create(name='Second', straps_num=4, board=self.board)
+        other_image.delete()
+
+        data = self.sync(cursor)
+
+        self.assertFalse(data['reset'])
+        self.assertEqual([p['id'] for p in data['positions']], [self.position.id])
+        self.assertEqual(data['positions'][0]['position_x'], 2)
+        self.assertEqual(data['deleted']['positions'], [moved_id])
+        self.assertEqual([t['id'] for t in data['tabs']], [new_tab.id])
+        self.assertEqual(data['images'], [])
+        self.assertEqual(data['deleted']['images'], [other_image_id])
+        self.assertEqual(self.sync(data['cursor'])['positions'], [])
+
+    def test_label_change_resends_positions(self):
+        cursor = self.sync()['cursor']
+        self.image.label = 'сок яблочный'
+        self.image.save()
+
+        data = self.sync(cursor)
+
+        self.assertEqual([i['label'] for i in data['images']], ['сок яблочный'])
+        self.assertEqual([p['image_label'] for p in data['positions']], ['сок яблочный'])
+
+    def test_other_users_changes_are_not_synced(self):
+        cursor = self.sync()['cursor']
+        other = User.objects.create_user(username='other', password='testpass123')
+        folder = Folder.objects.create(name='Theirs', creator=other)
+        Image.objects.create(label='чай', image='images/tea.png', folder=folder, creator=other)
+        staff_folder = Folder.objects.create(name='Staff', creator=self.admin)
+
+        data = self.sync(cursor)
+
+        self.assertEqual([f['id'] for f in data['folders']], [staff_folder.id])
+        self.assertEqual(data['images'], [])
+
+    def test_pruned_log_resets(self):
+        cursor = self.sync()['cursor']
+        self.position.position_x = 3
+        self.position.save()
+        ChangeLog.objects.update(created_at=timezone.now() - timedelta(days=60))
+        call_command('prune_changelog', days=30, stdout=open('/dev/null', 'w'))
+
+        data = self.sync(cursor)
+
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['positions']), 1)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TabLayoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='boarduser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.board = Board.objects.create(name='Board', creator=self.user)
+        self.folder = Folder.objects.create(name='Mine', creator=self.user)
+        self.images = [
+            Image.objects.create(label=f'card {i}', image=f'images/{i}.png', folder=self.folder, creator=self.user)
+            for i in range(40)
+        ]
+        self.tab = Tab.objects.create(name='Tab', straps_num=6, board=self.board)
+        self.positions = [
+            Image_positions.objects.create(image=image, tab=self.tab, position_x=i % 5, position_y=i // 5)
+            for i, image in enumerate(self.images[:30])
+        ]
+        self.url = reverse('tab-layout', args=[self.tab.id])
+
+    def save_layout(self, operations, revision=0):
+        return self.client.post(self.url, {'revision': revision, 'operations': operations}, format='json')
+
+    def test_rearrangement_is_one_request_with_constant_queries(self):
+        operations = [
+            {'op': 'move', 'id': p.id, 'position_x': i // 6, 'position_y': i % 6}
+            for i, p in enumerate(self.positions[:26])
+        ]
+        operations += [{'op': 'delete', 'id': p.id} for p in self.positions[26:]]
+        operations += [{'op': 'create', 'image': image.id, 'position_x': 5 + i, 'position_y': 0}
+                       for i, image in enumerate(self.images[30:])]
+
+        with self.assertNumQueries(19):
+            response = self.save_layout(operations)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['revision'], 1)
+        self.assertEqual(len(response.data['created']), 10)
+        self.assertEqual(Image_positions.objects.filter(tab=self.tab).count(), 36)
+        moved = Image_positions.objects.get(id=self.positions[7].id)
+        self.assertEqual((moved.position_x, moved.position_y), (1, 1))
+
+    def test_layout_save_is_synced(self):
+        cursor = self.client.get(reverse('board-sync', args=[self.board.id])).data['cursor']
+        response = self.save_layout([
+            {'op': 'move', 'id': self.positions[0].id, 'position_x': 5, 'position_y': 5},
+            {'op': 'delete', 'id': self.positions[1].id},
+        ])
+
+        data = self.client.get(reverse('board-sync', args=[self.board.id]), {'since': cursor}).data
+
+        self.assertEqual([p['id'] for p in data['positions']], [self.positions[0].id])
+        self.assertEqual(data['deleted']['positions'], [self.positions[1].id])
+        self.assertEqual([t['revision'] for t in data['tabs']], [response.data['revision']])
+
+    def test_stale_revision_conflicts(self):
+        self.save_layout([{'op': 'delete', 'id': self.positions[0].id}])
+
+        response = self.save_layout([{'op': 'delete', 'id': self.positions[1].id}], revision=0)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['revision'], 1)
+        self.assertEqual(len(response.data['positions']), 29)
+        self.assertTrue(Image_positions.objects.filter(id=self.positions[1].id).exists())
+
+    def test_positions_of_other_tabs_are_rejected(self):
+        other_tab = Tab.objects.create(name='Other', straps_num=5, board=self.board)
+        other = Image_positions.objects.create(image=self.images[0], tab=other_tab, position_x=0, position_y=0)
+
+        response = self.save_layout([
+            {'op': 'move', 'id': self.positions[0].id, 'position_x': 5, 'position_y': 5},
+            {'op': 'delete', 'id': other.id},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Image_positions.objects.filter(id=other.id).exists())
+        self.tab.refresh_from_db()
+        self.assertEqual(self.tab.revision, 0)
+        self.assertEqual(Image_positions.objects.get(id=self.positions[0].id).position_x, 0)
+
+    def test_swap_cards(self):
+        first, second = self.positions[0], self.positions[1]
+        response = self.save_layout([
+            {'op': 'move', 'id': first.id, 'position_x': second.position_x, 'position_y': second.position_y},
+            {'op': 'move', 'id': second.id, 'position_x': first.position_x, 'position_y': first.position_y},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first.refresh_from_db()
+        self.assertEqual((first.position_x, first.position_y), (1, 0))
+
+    def test_collisions_are_rejected(self):
+        response = self.save_layout([
+            {'op': 'create', 'image': self.images[35].id, 'position_x': 0, 'position_y': 0},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.tab.refresh_from_db()
+        self.assertEqual(self.tab.revision, 0)
+
+    def test_only_the_board_owner_and_shared_caregivers_save_layouts(self):
+        stranger = User.objects.create_user(username='stranger', password='testpass123')
+        self.client.force_authenticate(user=stranger)
+        self.assertEqual(self.save_layout([{'op': 'delete', 'id': self.positions[0].id}]).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Image_positions.objects.filter(id=self.positions[0].id).exists())
+
+        self.board.access_users.add(Care_giver.objects.create(user=stranger))
+        self.assertEqual(self.save_layout([{'op': 'delete', 'id': self.positions[0].id}]).status_code,
+                         status.HTTP_200_OK)
+
+    def test_next_free_cell(self):
+        # the 30 cards fill slots 0..4 on all six straps, one gets taken out
+        self.positions[7].delete()
+        response = self.client.get(reverse('tab-next-cell', args=[self.tab.id]))
+        self.assertEqual((response.data['position_x'], response.data['position_y']), (2, 1))
+
+        Image_positions.objects.create(image=self.images[0], tab=self.tab, position_x=2, position_y=1)
+        response = self.client.get(reverse('tab-next-cell', args=[self.tab.id]))
+        self.assertEqual((response.data['position_x'], response.data['position_y']), (5, 0))
+
+        self.client.force_authenticate(user=User.objects.create_user(username='stranger', password='testpass123'))
+        response = self.client.get(reverse('tab-next-cell', args=[self.tab.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_operations(self):
+        response = self.save_layout([{'op': 'move', 'id': self.positions[0].id}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # below the last strap
+        response = self.save_layout([{'op': 'create', 'image': self.images[35].id, 'position_x': 0, 'position_y': 6}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.save_layout([{'op': 'create', 'image': 9999, 'position_x': '0', 'position_y': '0'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BoardCloneTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='caregiver', password='testpass123')
+        self.caregiver = Care_giver.objects.create(user=self.user)
+        self.recipients = []
+        for i in range(10):
+            recipient = Care_recipient.objects.create(
+                user=User.objects.create_user(username=f'child{i}', password='testpass123')
+            )
+            self.caregiver.recipients.add(recipient)
+            self.recipients.append(recipient.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.board = Board.objects.create(name='Class board', creator=self.user, color='#123456')
+        folder = Folder.objects.create(name='Mine', creator=self.user)
+        images = [Image.objects.create(label=f'card {i}', image=f'images/{i}.png', folder=folder, creator=self.user)
+                  for i in range(12)]
+        for t in range(3):
+            tab = Tab.objects.create(name=f'Tab {t}', straps_num=4, board=self.board)
+            for i, image in enumerate(images):
+                Image_positions.objects.create(image=image, tab=tab, position_x=i % 4, position_y=i // 4)
+
+    def clone(self, **data):
+        return self.client.post(reverse('board-clone', args=[self.board.id]), data, format='json')
+
+    def test_clone_to_many_recipients_with_constant_queries(self):
+        with self.assertNumQueries(11):
+            response = self.clone(recipients=[self.recipients[0].id])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # six copies stay within one insert batch on sqlite as well
+        with self.assertNumQueries(11):
+            response = self.clone(recipients=[user.id for user in self.recipients[:6]], name='Copy')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        copy = Board.objects.get(creator=self.recipients[5], name='Copy')
+        self.assertEqual(copy.color, '#123456')
+        self.assertEqual(list(copy.access_users.all()), [self.caregiver])
+        tabs = list(Tab.objects.filter(board=copy).order_by('id'))
+        self.assertEqual([tab.name for tab in tabs], ['Tab 0', 'Tab 1', 'Tab 2'])
+        self.assertEqual(
+            list(Image_positions.objects.filter(tab=tabs[2]).order_by('id')
+                 .values_list('image__label', 'position_x', 'position_y')),
+            list(Image_positions.objects.filter(tab__board=self.board, tab__name='Tab 2').order_by('id')
+                 .values_list('image__label', 'position_x', 'position_y')),
+        )
+        self.assertEqual(Image_positions.objects.filter(tab__board__name='Copy').count(), 6 * 36)
+
+    def test_templates(self):
+        response = self.clone(as_template=True, name='Template')
+        template_id = response.data['boards'][0]['id']
+        self.assertTrue(response.data['boards'][0]['is_template'])
+
+        templates = self.client.get(reverse('board-templates')).data['templates']
+        self.assertEqual([t['id'] for t in templates], [template_id])
+        boards = self.client.get(reverse('my_boards')).data['boards']
+        self.assertNotIn(template_id, [b['id'] for b in boards])
+
+        response = self.client.post(reverse('board-clone', args=[template_id]),
+                                    {'recipients': [self.recipients[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Image_positions.objects.filter(tab__board__creator=self.recipients[0]).count(), 36)
+
+    def test_staff_templates_are_shared(self):
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        template = Board.objects.create(name='Staff template', creator=staff, is_template=True)
+        Board.objects.create(name='Staff board', creator=staff)
+
+        templates = self.client.get(reverse('board-templates')).data['templates']
+        self.assertEqual([t['id'] for t in templates], [template.id])
+        response = self.client.post(reverse('board-clone', args=[template.id]),
+                                    {'recipients': [self.recipients[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_only_own_recipients(self):
+        stranger = User.objects.create_user(username='stranger', password='testpass123')
+        response = self.clone(recipients=[self.recipients[0].id, stranger.id])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Board.objects.filter(creator=self.recipients[0]).exists())
+
+    def test_foreign_boards_can_not_be_cloned(self):
+        stranger = User.objects.create_user(username='stranger', password='testpass123')
+        board = Board.objects.create(name='Theirs', creator=stranger)
+        response = self.client.post(reverse('board-clone', args=[board.id]),
+                                    {'recipients': [self.recipients[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+def png_bytes(size=(1200, 900)):
+    out = BytesIO()
+    PILImage.new('RGB', size, (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class BoardBundleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='boarduser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.audio = audio_cache.AudioCache(1024 * 1024, cache_dir.name, 1024 * 1024)
+        mock.patch.object(audio_cache, '_audio_cache', self.audio).start()
+        self.read_original = mock.patch.object(images, 'read_original', return_value=png_bytes()).start()
+        self.schedule_clip = mock.patch.object(tts, 'schedule_clip').start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.board = Board.objects.create(name='Board', creator=self.user)
+        folder = Folder.objects.create(name='Mine', creator=self.user)
+        self.juice = Image.objects.create(label='сок', image='images/juice.png', folder=folder, creator=self.user)
+        self.water = Image.objects.create(label='вода', image='images/water.png', folder=folder, creator=self.user)
+        self.tab = Tab.objects.create(name='Tab', straps_num=4, board=self.board)
+        self.position = Image_positions.objects.create(image=self.juice, tab=self.tab, position_x=0, position_y=0)
+        Image_positions.objects.create(image=self.water, tab=self.tab, position_x=1, position_y=0)
+
+        key = tts.clip_key('сок')
+        AudioClip.objects.create(key=key, text='сок', voice=tts.TTS_VOICE, model=tts.TTS_MODEL,
+                                 response_format='mp3', path=tts.clip_path(key))
+        self.audio.put(key, b'ID3 juice')
+        self.url = reverse('board-bundle', args=[self.board.id])
+
+    def open_bundle(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(BytesIO(response.content))
+
+    def test_bundle_contents(self):
+        archive = self.open_bundle(self.client.get(self.url))
+        manifest = json.loads(archive.read('manifest.json'))
+        board = json.loads(archive.read('board.json'))
+
+        audio_path = f"audio/{tts.clip_key('сок')}.mp3"
+        self.assertEqual(archive.read(audio_path), b'ID3 juice')
+        with PILImage.open(BytesIO(archive.read(f'images/{self.juice.id}.webp'))) as picture:
+            self.assertEqual(picture.size, (256, 192))
+        self.assertEqual(set(manifest['entries']), set(archive.namelist()) - {'manifest.json'})
+        self.assertEqual(manifest['pending_audio'], ['вода'])
+        self.schedule_clip.assert_called_once_with('вода')
+        self.assertEqual(board['cards'][str(self.juice.id)]['audio'], audio_path)
+        self.assertIsNone(board['cards'][str(self.water.id)]['audio'])
+        self.assertEqual(len(board['positions']), 2)
+
+    def test_only_missing_entries_are_sent(self):
+        manifest = self.client.get(self.url, {'manifest': '1'}).data
+        have = [entry['sha256'] for path, entry in manifest['entries'].items() if path != 'board.json']
+
+        archive = self.open_bundle(self.client.post(self.url, {'have': have}, format='json'))
+
+        self.assertEqual(sorted(archive.namelist()), ['board.json', 'manifest.json'])
+
+    def test_unchanged_bundle_is_not_modified(self):
+        etag = self.client.get(self.url, {'manifest': '1'})['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.position.position_x = 2
+        self.position.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_requests_build_nothing(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch.object(bundle, 'collect') as collect, self.assertNumQueries(4):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        collect.assert_not_called()
+
+        # a new clip changes the bundle without touching the board
+        key = tts.clip_key('вода')
+        AudioClip.objects.create(key=key, text='вода', voice=tts.TTS_VOICE, model=tts.TTS_MODEL,
+                                 response_format='mp3', path=tts.clip_path(key))
+        self.audio.put(key, b'ID3 water')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_complete_bundles_cache_only_the_manifest(self):
+        key = tts.clip_key('вода')
+        AudioClip.objects.create(key=key, text='вода', voice=tts.TTS_VOICE, model=tts.TTS_MODEL,
+                                 response_format='mp3', path=tts.clip_path(key))
+        self.audio.put(key, b'ID3 water')
+        etag = bundle.revision(self.board)
+
+        first, _ = bundle.build(self.board, etag)
+        with mock.patch.object(bundle, 'collect') as collect:
+            self.assertEqual(bundle.get_manifest(self.board, etag), first)
+        collect.assert_not_called()
+        self.assertEqual(cache.get(f'board-bundle-manifest:{self.board.id}:{etag}'), first)
+
+        self.position.position_x = 2
+        self.position.save()
+        third, _ = bundle.build(self.board, bundle.revision(self.board))
+        self.assertNotEqual(third['hash'], first['hash'])
+        # resized images are reused across versions
+        self.assertEqual(self.read_original.call_count, 2)
@@ -0,0 +1,594 @@
+import fcntl
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from apps.application import catalog, derivatives, duplicates, images, search, semantic
+from apps.models import Board, Folder, Image
+from apps.serializers import FolderSerializer
+
+
+class LibraryViewTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+
+    def add_folder(self, name, creator, images=2):
+        folder = Folder.objects.create(name=name, creator=creator)
+        for i in range(images):
+            Image.objects.create(label=f'{name} {i}', image=f'library/{name}-{i}.png', folder=folder, creator=creator)
+        return folder
+
+    def test_query_count_does_not_grow_with_folders(self):
+        for i in range(3):
+            self.add_folder(f'Staff {i}', self.admin)
+        # versions, staff folders and covers, own folders and uploads
+        with self.assertNumQueries(5):
+            self.client.get(reverse('library'))
+
+        for i in range(3, 20):
+            self.add_folder(f'Staff {i}', self.admin)
+        self.add_folder('Mine', self.user)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('library'))
+        self.assertEqual(len(response.data['folders']), 21)
+
+    def test_catalog_layers_are_reused_until_a_write(self):
+        self.add_folder('Staff', self.admin)
+        self.add_folder('Mine', self.user)
+        self.client.get(reverse('library'))
+
+        # only the versions are read while nothing changed
+        with self.assertNumQueries(1):
+            self.client.get(reverse('library'))
+
+        # a private upload rebuilds the user's overlay, the staff layer is still shared
+        Image.objects.create(label='new', image='library/new.png', folder=Folder.objects.get(name='Mine'),
+                             creator=self.user)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('library'))
+        self.assertEqual(len(response.data['private_imgs']), 3)
+
+        # and a staff folder write rebuilds the shared layer for everyone
+        self.add_folder('Staff 2', self.admin)
+        self.client.force_authenticate(user=self.other)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('library'))
+        self.assertEqual([f['name'] for f in response.data['folders']], ['Staff', 'Staff 2'])
+
+    def test_folders_and_covers(self):
+        self.add_folder('Еда', self.admin)
+        self.add_folder('Animals', self.admin)
+        self.add_folder('Empty', self.admin, images=0)
+        self.add_folder('Mine', self.user)
+        self.add_folder('Theirs', self.other)
+
+        response = self.client.get(reverse('library'))
+
+        self.assertEqual([f['name'] for f in response.data['folders']], ['Animals', 'Empty', 'Еда', 'Mine'])
+        self.assertEqual([f['is_private'] for f in response.data['folders']], [False, False, False, True])
+        self.assertEqual(response.data['images']['Еда'], [{'image': 'library/Еда-0.png'}])
+        self.assertEqual(response.data['images']['Empty'], [])
+        self.assertNotIn('Theirs', response.data['images'])
+        self.assertEqual(len(response.data['private_imgs']), 2)
+
+    def test_staff_see_their_folders_once(self):
+        self.add_folder('Staff', self.admin)
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.get(reverse('library'))
+
+        self.assertEqual([f['name'] for f in response.data['folders']], ['Staff'])
+
+    def test_image_lists_are_not_loaded(self):
+        self.add_folder('Staff', self.admin, images=3)
+        with mock.patch.object(catalog, 'public_images') as public_images, \
+                mock.patch.object(catalog, 'user_images') as user_images:
+            response = self.client.get(reverse('library'))
+
+        self.assertEqual(response.data['images']['Staff'], [{'image': 'library/Staff-0.png'}])
+        public_images.assert_not_called()
+        user_images.assert_not_called()
+
+        # the board payload reuses the cached folders, only the image lists are read on top of the board
+        board = Board.objects.create(name='Board', creator=self.user)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('board', args=[board.id]))
+        self.assertEqual(len(response.data['images']), 3)
+
+
+class FolderVisibilityTests(TestCase):
+    def test_listing_is_one_query(self):
+        admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        user = User.objects.create_user(username='libraryuser', password='testpass123')
+        for i in range(5):
+            Folder.objects.create(name=f'Staff {i}', creator=admin)
+            Folder.objects.create(name=f'Mine {i}', creator=user)
+
+        with self.assertNumQueries(1):
+            data = FolderSerializer(Folder.objects.with_visibility().order_by('name'), many=True).data
+
+        self.assertEqual([f['is_private'] for f in data], [True] * 5 + [False] * 5)
+        self.assertEqual(data[0]['display_name'], 'Mine 0 (личное)')
+        self.assertEqual(data[5]['display_name'], 'Staff 0')
+
+    def test_plain_folders_still_work(self):
+        user = User.objects.create_user(username='libraryuser', password='testpass123')
+        folder = Folder.objects.create(name='Mine', creator=user)
+
+        self.assertTrue(Folder.objects.get(id=folder.id).is_private())
+
+
+class LibrarySearchTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.staff_folder = Folder.objects.create(name='Напитки', creator=self.admin)
+        self.own_folder = Folder.objects.create(name='Мои напитки', creator=self.user)
+        other_folder = Folder.objects.create(name='Чужое', creator=self.other)
+        for label in ['сок апельсиновый', 'сок', 'вода', 'яблочный сок']:
+            Image.objects.create(label=label, image=f'library/{label}.png', folder=self.staff_folder,
+                                 creator=self.admin)
+        Image.objects.create(label='мой сок', image='library/mine.png', folder=self.own_folder, creator=self.user)
+        Image.objects.create(label='чужой сок', image='library/theirs.png', folder=other_folder, creator=self.other)
+
+    def search(self, **params):
+        response = self.client.get(reverse('library-search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_visible_matches_best_first(self):
+        data = self.search(q='сок')
+
+        labels = [image['label'] for image in data['results']]
+        self.assertEqual(labels[0], 'сок')
+        self.assertEqual(labels[1], 'сок апельсиновый')
+        self.assertEqual(set(labels), {'сок', 'сок апельсиновый', 'яблочный сок', 'мой сок'})
+        self.assertIsNone(data['next_cursor'])
+
+    def test_keyset_pages(self):
+        seen = []
+        cursor = None
+        for _ in range(5):
+            params = {'q': 'сок', 'limit': 1}
+            if cursor:
+                params['cursor'] = cursor
+            with self.assertNumQueries(1):
+                data = self.search(**params)
+            seen += [image['label'] for image in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [image['label'] for image in self.search(q='сок')['results']])
+
+    def test_postgres_rank_is_double_precision(self):
+        with mock.patch.object(search, 'is_postgres', return_value=True):
+            sql = str(search.ranked_images(self.user, 'сок').query)
+        self.assertIn('))::double precision) AS "rank"', sql)
+
+    @skipUnless(connection.vendor == 'postgresql', 'full text ranking needs PostgreSQL')
+    def test_keyset_pages_over_tied_ranks_on_postgres(self):
+        for i in range(6):
+            Image.objects.create(label='апельсиновый сок', image=f'library/orange-{i}.png', folder=self.staff_folder,
+                                 creator=self.admin)
+        expected = [image['id'] for image in self.search(q='сок', limit=50)['results']]
+
+        seen = []
+        params = {'q': 'сок', 'limit': 2}
+        while True:
+            data = self.search(**params)
+            seen += [image['id'] for image in data['results']]
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+
+        self.assertEqual(seen, expected)
+
+    def test_folder_names(self):
+        data = self.search(q='питки', folders='1')
+        self.assertEqual([f['name'] for f in data['folders']], ['Мои напитки', 'Напитки'])
+        self.assertEqual(data['results'], [])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('library-search')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('library-search'), {'q': 'сок', 'cursor': 'nope'}).status_code, 400)
+
+
+class FolderImagePageTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.folder = Folder.objects.create(name='Еда', creator=self.admin)
+        # duplicate labels make sure ties on the label are broken by id
+        for label in ['хлеб', 'яблоко', 'суп', 'каша', 'суп', 'молоко', 'суп']:
+            Image.objects.create(label=label, image=f'library/{label}.png', folder=self.folder, creator=self.admin)
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('folder_image', args=[self.folder.id]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_follow_label_and_id(self):
+        expected = list(Image.objects.filter(folder=self.folder).order_by('label', 'id').values_list('id', flat=True))
+
+        seen = []
+        params = {'limit': 3}
+        while True:
+            with self.assertNumQueries(3):
+                data = self.get_page(**params)
+            self.assertLessEqual(len(data['images']), 3)
+            seen += [image['id'] for image in data['images']]
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+
+        self.assertEqual(seen, expected)
+
+    def test_default_page_holds_the_whole_small_folder(self):
+        data = self.get_page()
+        self.assertEqual(len(data['images']), 7)
+        self.assertEqual(data['images'][0]['creator_name'], 'admin')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('folder_image', args=[self.folder.id]), {'cursor': 'WzFd'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LibrarySemanticSearchTests(TestCase):
+    def setUp(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        override = override_settings(SEMANTIC_INDEX_DIR=index_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.staff_folder = Folder.objects.create(name='Staff', creator=self.admin)
+        self.own_folder = Folder.objects.create(name='Mine', creator=self.user)
+        other_folder = Folder.objects.create(name='Theirs', creator=self.other)
+        for label in ['сок', 'вода', 'машина']:
+            Image.objects.create(label=label, image=f'library/{label}.png', folder=self.staff_folder,
+                                 creator=self.admin)
+        Image.objects.create(label='juice', image='library/juice.png', folder=self.own_folder, creator=self.user)
+        Image.objects.create(label='воды', image='library/water.png', folder=other_folder, creator=self.other)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('library-semantic-search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [image['label'] for image in response.data['results']]
+
+    def add_image(self, label, folder=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Image.objects.create(label=label, image=f'library/{label}.png', folder=folder or self.own_folder,
+                                        creator=self.user)
+
+    def test_spelling_matches_within_the_visible_library(self):
+        with mock.patch.object(semantic, 'schedule_build') as schedule_build:
+            response = self.client.get(reverse('library-semantic-search'), {'q': 'воды'})
+        # never built on the request thread
+        self.assertEqual(response.status_code, 503)
+        schedule_build.assert_called_once()
+        self.assertFalse(semantic.is_built())
+
+        semantic.build()
+        # the other user's "воды" stays out
+        self.assertEqual(self.search('воды'), ['вода'])
+
+    def test_only_the_hits_are_loaded(self):
+        semantic.build()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.search('сок', k=1), ['сок'])
+
+    def test_a_running_build_is_not_waited_for(self):
+        semantic.build()
+        with open(semantic.index_dir() / '.build.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertIsNone(semantic.build(wait=False))
+
+    def test_word_vectors_relate_synonyms(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.vec', encoding='utf-8', delete=False) as f:
+            f.write('5 3\ndrink 1 0 0\njuice 0.9 0.1 0\nсок 0.95 0.05 0\nвода 0.7 0 0.3\nмашина 0 0 1\n')
+        self.addCleanup(lambda: os.unlink(f.name))
+        call_command('build_semantic_index', vectors=f.name, stdout=StringIO())
+
+        labels = self.search('drink')
+
+        self.assertEqual(set(labels[:2]), {'сок', 'juice'})
+        self.assertIn('вода', labels)
+        self.assertNotIn('машина', labels)
+
+    def test_uploads_are_indexed_incrementally(self):
+        call_command('build_semantic_index', stdout=StringIO())
+        image = self.add_image('молоко')
+
+        self.assertEqual(self.search('молоко'), ['молоко'])
+
+        # relabelling replaces the old entry
+        with self.captureOnCommitCallbacks(execute=True):
+            image.label = 'кефир'
+            image.save()
+        self.assertEqual(self.search('молоко'), [])
+        self.assertEqual(self.search('кефир'), ['кефир'])
+
+    def test_saves_that_keep_the_label_are_not_reindexed(self):
+        image = self.add_image('молоко')
+        with mock.patch.object(semantic, 'add') as add, self.captureOnCommitCallbacks(execute=True):
+            image.derivatives = {'small': 'x.webp'}
+            image.save(update_fields=['derivatives'])
+            image.save(update_fields=['label'])
+
+        add.assert_called_once_with([(image.id, 'молоко')])
+
+    @override_settings(SEMANTIC_MAX_SEGMENTS=2)
+    def test_stale_word_vectors_are_reloaded(self):
+        semantic.build()
+        self.assertEqual(self.search('сок'), ['сок'])
+        with tempfile.NamedTemporaryFile('w', suffix='.vec', encoding='utf-8', delete=False) as f:
+            f.write('2 3\ndrink 1 0 0\nсок 0.95 0.05 0\n')
+        self.addCleanup(lambda: os.unlink(f.name))
+        call_command('build_semantic_index', vectors=f.name, stdout=StringIO())
+        # as if another process imported them, this one still embeds without
+        semantic._words.update(dir=semantic.index_dir(), vocab=None, vectors=None)
+
+        self.assertEqual(self.search('drink'), ['сок'])
+        semantic._words.update(dir=semantic.index_dir(), vocab=None, vectors=None)
+        for label in ['drink', 'хлеб']:
+            self.add_image(label)
+
+        self.assertEqual(self.search('drink')[0], 'drink')
+        self.assertEqual({vectors.shape[1] for _, vectors in semantic._load_segments()}, {semantic.NGRAM_DIM + 3})
+
+    def test_index_errors_do_not_fail_the_save(self):
+        with mock.patch.object(semantic, 'add', side_effect=ValueError('broken index')), \
+                self.assertLogs('django', 'ERROR'):
+            image = self.add_image('молоко')
+
+        self.assertTrue(Image.objects.filter(id=image.id).exists())
+
+    @override_settings(SEMANTIC_MAX_SEGMENTS=2)
+    def test_segments_are_compacted(self):
+        call_command('build_semantic_index', stdout=StringIO())
+        for label in ['хлеб', 'суп', 'каша', 'чай']:
+            self.add_image(label)
+
+        self.assertLessEqual(len(semantic._segment_names()), 2)
+        for label in ['хлеб', 'суп', 'каша', 'чай', 'сок']:
+            self.assertEqual(self.search(label)[0], label)
+
+    def test_missing_query(self):
+        self.assertEqual(self.client.get(reverse('library-semantic-search')).status_code, 400)
+
+
+def photo_bytes(size=(3000, 2000), color=(30, 120, 200), quality=75):
+    picture = PILImage.new('RGB', size, color)
+    # a few shapes, so the difference hash has something to describe
+    for box, fill in (((0.1, 0.1, 0.4, 0.5), (240, 240, 240)), ((0.5, 0.3, 0.9, 0.8), (20, 20, 20))):
+        picture.paste(fill, tuple(int(v * size[i % 2]) for i, v in enumerate(box)))
+    out = BytesIO()
+    picture.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.folder = Folder.objects.create(name='Mine', creator=self.user)
+        cache.clear()
+
+        self.stored = {}
+
+        def save(name, content, max_length=None):
+            self.stored[name] = content.read()
+            return name
+
+        storage = Image._meta.get_field('image').storage
+        mock.patch.object(storage, 'save', side_effect=save).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_upload_schedules_derivatives_from_the_uploaded_bytes(self):
+        data = photo_bytes()
+        with mock.patch.object(derivatives, 'schedule_derivatives') as schedule:
+            response = self.client.post(reverse('folder_image', args=[self.folder.id]), {
+                'label': 'море',
+                'image': SimpleUploadedFile('sea.jpg', data, content_type='image/jpeg'),
+            }, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['image_details']['srcset'], {})
+        image, original = schedule.call_args.args
+        self.assertEqual(image.id, response.data['image_id'])
+        self.assertEqual(original, data)
+
+    def test_derivatives_are_small_and_listed_in_srcset(self):
+        image = Image.objects.create(label='море', image='sea.jpg', folder=self.folder, creator=self.user)
+        board = Board.objects.create(name='Board', creator=self.user)
+        self.client.get(reverse('board', args=[board.id]))
+
+        original = photo_bytes()
+        derivatives.create_derivatives(image, original)
+
+        self.assertEqual(set(Image.objects.get(id=image.id).derivatives), set(derivatives.DERIVATIVES))
+        thumbnail = self.stored['sea.webp-128.webp']
+        self.assertLess(len(thumbnail) * 10, len(original))
+        with PILImage.open(BytesIO(thumbnail)) as picture:
+            self.assertEqual((picture.format, picture.size), ('WEBP', (128, 85)))
+        with PILImage.open(BytesIO(self.stored['sea.jpeg-256.jpg'])) as picture:
+            self.assertEqual(picture.format, 'JPEG')
+
+        # the cached board payload is invalidated, the new copies show up right away
+        srcset = self.client.get(reverse('board', args=[board.id])).data['images'][0]['srcset']
+        self.assertEqual(set(srcset), {'webp', 'jpeg'})
+        self.assertEqual(set(srcset['webp']), {'128', '256', '512'})
+        self.assertTrue(srcset['webp']['128'].endswith('/sea.webp-128.webp'))
+
+    def test_existing_derivatives_are_kept(self):
+        image = Image.objects.create(label='море', image='sea.jpg', folder=self.folder, creator=self.user,
+                                     derivatives={name: f'old-{name}' for name in derivatives.DERIVATIVES})
+        with mock.patch.object(derivatives.images, 'read_original') as read_original:
+            derivatives.create_derivatives(image)
+        read_original.assert_not_called()
+        self.assertEqual(self.stored, {})
+
+    def test_transparency_turns_white_in_jpeg(self):
+        picture = PILImage.new('RGBA', (300, 300), (0, 0, 0, 0))
+        picture.paste((200, 30, 30, 255), (100, 100, 200, 200))
+        out = BytesIO()
+        picture.save(out, 'PNG')
+
+        with PILImage.open(BytesIO(images.resize(out.getvalue(), 256, 'JPEG'))) as resized:
+            corner = resized.getpixel((0, 0))
+            centre = resized.getpixel((128, 128))
+        self.assertTrue(all(channel > 245 for channel in corner))
+        self.assertGreater(centre[0], 150)
+
+    def test_image_deleted_while_resizing(self):
+        image = Image.objects.create(label='море', image='sea.jpg', folder=self.folder, creator=self.user)
+        Image.objects.filter(id=image.id).delete()
+        storage = Image._meta.get_field('image').storage
+
+        with mock.patch.object(storage, 'delete') as delete:
+            derivatives.create_derivatives(image, photo_bytes())
+
+        self.assertEqual(sorted(call.args[0] for call in delete.call_args_list), sorted(self.stored))
+
+    def test_background_failures_are_logged(self):
+        image = Image.objects.create(label='море', image='sea.jpg', folder=self.folder, creator=self.user)
+
+        with self.assertLogs('apps.application.derivatives', 'ERROR') as logs:
+            derivatives._create_derivatives_in_background(image, b'not an image')
+
+        self.assertIn(f'image {image.id}', logs.output[0])
+        self.assertNotIn(image.id, derivatives._scheduled)
+
+
+class DuplicateImageTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.user = User.objects.create_user(username='libraryuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.folder = Folder.objects.create(name='Mine', creator=self.user)
+
+        self.uploads = []
+
+        def save(name, content, max_length=None):
+            self.uploads.append(name)
+            return name
+
+        storage = Image._meta.get_field('image').storage
+        mock.patch.object(storage, 'save', side_effect=save).start()
+        self.schedule = mock.patch.object(derivatives, 'schedule_derivatives').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def upload(self, data, name='photo.jpg', folder=None):
+        response = self.client.post(reverse('folder_image', args=[(folder or self.folder).id]), {
+            'label': 'фото',
+            'image': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_fingerprint_survives_rescaling_but_not_recolouring(self):
+        original = images.fingerprint(photo_bytes())
+
+        self.assertLessEqual(duplicates.distance(original, images.fingerprint(photo_bytes((800, 533), quality=40))), 2)
+        self.assertIsNone(duplicates.distance(original, images.fingerprint(photo_bytes(color=(200, 40, 40)))))
+
+    def test_reupload_reuses_the_stored_object(self):
+        first = self.upload(photo_bytes(), 'photo5413594006895570478_y.jpg')
+        Image.objects.filter(id=first['image_id']).update(derivatives={'webp-128': 'photo.webp-128.webp'})
+
+        second = self.upload(photo_bytes((1200, 800), quality=50), 'photo5413594006895570478_x.jpg')
+
+        self.assertIsNone(first['duplicate_of'])
+        self.assertEqual(second['duplicate_of'], first['image_id'])
+        self.assertEqual(self.uploads, ['photo5413594006895570478_y.jpg'])
+        copy = Image.objects.get(id=second['image_id'])
+        self.assertEqual(copy.image.name, 'photo5413594006895570478_y.jpg')
+        self.assertEqual(copy.phash, Image.objects.get(id=first['image_id']).phash)
+        self.assertEqual(copy.derivatives, {'webp-128': 'photo.webp-128.webp'})
+        self.assertEqual(copy.fingerprint_chunks.count(), duplicates.INDEX_CHUNKS)
+
+    def test_other_pictures_and_other_libraries_are_uploaded(self):
+        self.upload(photo_bytes())
+        self.assertIsNone(self.upload(photo_bytes(color=(200, 40, 40)), 'red.jpg')['duplicate_of'])
+
+        # someone else's private photo is not in this user's library
+        self.client.force_authenticate(user=self.other)
+        other_folder = Folder.objects.create(name='Theirs', creator=self.other)
+        self.assertIsNone(self.upload(photo_bytes(), 'again.jpg', other_folder)['duplicate_of'])
+        self.assertEqual(len(self.uploads), 3)
+
+    def test_unreadable_upload_is_stored_as_before(self):
+        data = self.upload(b'not an image', 'broken.jpg')
+        self.assertIsNone(data['duplicate_of'])
+        self.assertEqual(Image.objects.get(id=data['image_id']).phash, '')
+
+    def test_near_duplicates_come_from_the_chunk_index(self):
+        near = '00000000000000ff' + '123'
+        image = Image.objects.create(label='a', image='a.jpg', folder=self.folder, creator=self.user, phash=near)
+        # not indexed yet, only the exact fingerprint would find it
+        self.assertIsNone(duplicates.find_duplicate(self.user, '00000000000000f0' + '123'))
+
+        duplicates.index_fingerprint(image.id, image.phash)
+        self.assertEqual(duplicates.find_duplicate(self.user, '00000000000000f0' + '123'), image)
+        self.assertIsNone(duplicates.find_duplicate(self.user, '0000000000000f00' + '123'))
+        self.assertEqual(image.fingerprint_chunks.count(), duplicates.INDEX_CHUNKS)
+
+    def add_image(self, label, phash, creator):
+        return Image.objects.create(label=label, image=f'{label}.jpg', folder=self.folder, creator=creator,
+                                    phash=phash)
+
+    def test_duplicate_report(self):
+        a = self.add_image('a', '00000000000000ff' + '123', self.user)
+        b = self.add_image('b', '00000000000000fe' + '123', self.user)
+        c = self.add_image('c', '00000000000000ff' + '123', self.other)
+        # a different picture, and the same one in another colour
+        self.add_image('d', 'ff00000000000000' + '123', self.user)
+        self.add_image('e', '00000000000000ff' + '9ab', self.user)
+
+        self.assertEqual([[image.id for image in group] for group in duplicates.clusters(1)], [[a.id, b.id, c.id]])
+        self.assertEqual([[image.id for image in group] for group in duplicates.clusters(0)], [[a.id, c.id]])
+
+        out = StringIO()
+        call_command('find_duplicate_images', distance=1, stdout=out)
+        self.assertIn('3 images, 3 stored files', out.getvalue())
+
+        client = self.client_class()
+        client.force_login(self.admin)
+        response = client.get('/admin/apps/image/', {'duplicates': 'yes'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({image.id for image in response.context['cl'].result_list}, {a.id, c.id})
@@ -0,0 +1,630 @@
+import itertools
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.application import audio_cache, presynthesis, singleflight, tts, tts_backends, variants
+from apps.models import AudioClip, AudioClipLock, AudioVariant, Board, ClipFallback, Folder, History, Image, \
+    Image_positions, PendingClip, PresynthesisJob, Tab
+
+
+def fake_synthesis(audio_contents):
+    # tts.synthesize as if the requested backend produced each of `audio_contents` in turn
+    audio_contents = iter(audio_contents)
+    return lambda text, voice=tts.TTS_VOICE, model=tts.TTS_MODEL, response_format=tts.TTS_FORMAT: (
+        next(audio_contents), voice, model
+    )
+
+
+class TextToSpeechCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ttsuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        synthesize = mock.patch.object(tts, 'synthesize', side_effect=fake_synthesis(itertools.repeat(b'ID3 fake mp3')))
+        save = mock.patch.object(tts.S3Boto3Storage, 'save', side_effect=lambda name, content: name)
+        self.synthesize = synthesize.start()
+        self.save = save.start()
+        mock.patch.object(tts, '_pending', set()).start()
+        self.addCleanup(mock.patch.stopall)
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache = audio_cache.AudioCache(1024, cache_dir.name, 4096)
+        mock.patch.object(audio_cache, '_audio_cache', self.cache).start()
+
+    def run_uploads(self, submit):
+        # what the storage executor would have run, on this thread and its connection
+        with mock.patch.object(tts, 'close_old_connections'):
+            for call in submit.call_args_list:
+                fn, *args = call.args
+                fn(*args)
+
+    def test_clip_key_normalizes_text(self):
+        self.assertEqual(tts.clip_key('  Мама  хочу '), tts.clip_key('мама хочу'))
+        self.assertNotEqual(tts.clip_key('мама'), tts.clip_key('мама', voice='alloy'))
+        self.assertNotEqual(tts.clip_key('мама'), tts.clip_key('мама', response_format='opus'))
+
+    def test_second_request_is_served_from_cache(self):
+        url = reverse('text-to-speach')
+
+        first = self.client.generic('GET', url, json.dumps({'text': 'Хочу пить'}), 'application/json')
+        second = self.client.generic('GET', url, json.dumps({'text': 'хочу  пить'}), 'application/json')
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertFalse(first.data['cached'])
+        self.assertTrue(second.data['cached'])
+        self.assertEqual(first.data['audio_url'], second.data['audio_url'])
+        self.assertEqual(self.synthesize.call_count, 1)
+        self.assertEqual(self.save.call_count, 1)
+        self.assertEqual(AudioClip.objects.count(), 1)
+
+    def test_clip_bytes_are_served_from_memory(self):
+        clip, _ = tts.get_or_create_clip('Хочу пить')
+
+        with mock.patch.object(tts.S3Boto3Storage, 'open') as storage_open:
+            response = self.client.get(reverse('tts-clip', args=[clip.key]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'ID3 fake mp3')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        storage_open.assert_not_called()
+        self.assertEqual(self.cache.stats()['memory']['hits'], 1)
+
+    def test_stream_mode_relays_chunks_and_stores_clip_afterwards(self):
+        client = mock.MagicMock()
+        speech = client.return_value.audio.speech.with_streaming_response.create.return_value
+        speech.__enter__.return_value.iter_bytes.return_value = iter([b'ID3 ', b'fake ', b'mp3'])
+
+        with mock.patch.object(tts_backends, 'OpenAI', client), \
+                mock.patch.object(tts._storage_executor, 'submit') as submit:
+            response = self.client.generic('GET', reverse('text-to-speach') + '?stream=1',
+                                           json.dumps({'text': 'Хочу пить'}), 'application/json')
+            self.assertTrue(response.streaming)
+            self.assertEqual(b''.join(response.streaming_content), b'ID3 fake mp3')
+
+        # other workers wait for the stream until its clip is stored, instead of synthesizing it again
+        self.assertTrue(AudioClipLock.objects.filter(key=tts.clip_key('хочу пить')).exists())
+        self.run_uploads(submit)
+        self.assertEqual(AudioClip.objects.count(), 1)
+        self.assertFalse(AudioClipLock.objects.exists())
+        self.assertEqual(self.cache.get(tts.clip_key('хочу пить')), b'ID3 fake mp3')
+        self.synthesize.assert_not_called()
+
+    def test_stream_flag_must_be_set(self):
+        url = reverse('text-to-speach')
+        for flag in ('0', 'false', 'no'):
+            response = self.client.generic('GET', f'{url}?stream={flag}', json.dumps({'text': 'Хочу пить'}),
+                                           'application/json')
+            self.assertIn('audio_url', response.data)
+
+        # the clip exists by now, the stream mode sends its bytes
+        response = self.client.generic('GET', url, json.dumps({'text': 'Хочу пить', 'stream': True}),
+                                       'application/json')
+        self.assertEqual(response.content, b'ID3 fake mp3')
+
+    def test_stream_waits_for_the_worker_streaming_the_phrase(self):
+        clip, _ = tts.get_or_create_clip('Хочу пить')
+        AudioClipLock.objects.create(key=clip.key, token='other')
+
+        with mock.patch.object(tts, 'find_clip', side_effect=[None, clip]), \
+                mock.patch.object(singleflight, 'LOCK_POLL_INTERVAL', 0), \
+                mock.patch.object(tts_backends.registry, 'stream') as stream:
+            chunks = tts.stream_synthesis('хочу пить')
+
+        self.assertEqual(b''.join(chunks), b'ID3 fake mp3')
+        stream.assert_not_called()
+
+    def test_pending_rows_are_written_outside_the_process_lock(self):
+        locked = []
+
+        def mark_pending(key, audio_content=None):
+            locked.append(tts._pending_lock.locked())
+
+        with mock.patch.object(tts, '_mark_pending', side_effect=mark_pending), \
+                mock.patch.object(tts._synthesis_executor, 'submit'), \
+                mock.patch.object(tts._storage_executor, 'submit'):
+            tts.schedule_clip('мама')
+            tts.schedule_store(tts.clip_key('папа'), 'папа', tts.TTS_VOICE, tts.TTS_MODEL, tts.TTS_FORMAT,
+                               b'ID3')
+
+        self.assertEqual(locked, [False, False])
+
+    def test_stream_waiters_do_not_wait_for_the_upload(self):
+        key = tts.clip_key('хочу пить')
+        AudioClipLock.objects.create(key=key, token='other')
+        PendingClip.objects.create(key=key, audio=b'ID3 streamed')
+
+        with mock.patch.object(tts_backends.registry, 'stream') as stream:
+            chunks = tts.stream_synthesis('хочу пить')
+
+        self.assertEqual(b''.join(chunks), b'ID3 streamed')
+        stream.assert_not_called()
+
+    def test_abandoned_stream_releases_the_lock(self):
+        chunks = iter([b'ID3 ', b'fake ', b'mp3'])
+        backend = tts_backends.registry.for_model('tts-1')
+        with mock.patch.object(tts_backends.registry, 'stream', return_value=(chunks, backend)):
+            stream = tts.stream_synthesis('хочу пить')
+            next(stream)
+            stream.close()
+
+        self.assertFalse(AudioClipLock.objects.exists())
+        self.assertEqual(AudioClip.objects.count(), 0)
+
+    def test_stream_mode_falls_back_when_the_provider_is_down(self):
+        client = mock.MagicMock()
+        client.return_value.audio.speech.with_streaming_response.create.side_effect = ConnectionError('down')
+        fallback_key = tts.clip_key('хочу пить', 'ru', 'gtts')
+
+        with mock.patch.object(tts_backends, 'OpenAI', client), \
+                mock.patch.object(tts_backends.GTTSBackend, 'synthesize', return_value=b'gtts mp3'), \
+                mock.patch.dict(tts_backends.registry._stats, openai=tts_backends.BackendStats(),
+                                gtts=tts_backends.BackendStats()), \
+                mock.patch.object(tts._storage_executor, 'submit') as submit:
+            response = self.client.generic('GET', reverse('text-to-speach') + '?stream=1',
+                                           json.dumps({'text': 'Хочу пить'}), 'application/json')
+            self.assertEqual(b''.join(response.streaming_content), b'gtts mp3')
+            self.assertEqual(tts_backends.registry.stats()['openai']['errors'], 1)
+        self.run_uploads(submit)
+
+        self.assertEqual(list(AudioClip.objects.values_list('key', flat=True)), [fallback_key])
+        self.assertEqual(tts.fallback_key(tts.clip_key('хочу пить')), fallback_key)
+
+    def test_fallback_audio_is_not_stored_under_the_requested_key(self):
+        self.synthesize.side_effect = lambda text, voice, model, response_format: (b'gtts mp3', 'ru', 'gtts')
+        key = tts.clip_key('хочу пить')
+
+        clip, created = tts.get_or_create_clip('Хочу пить')
+        again, _ = tts.get_or_create_clip('хочу пить')
+        response = self.client.get(reverse('tts-clip', args=[key]))
+
+        self.assertTrue(created)
+        self.assertEqual(clip.key, tts.clip_key('хочу пить', 'ru', 'gtts'))
+        self.assertFalse(AudioClip.objects.filter(key=key).exists())
+        self.assertEqual(again, clip)
+        self.assertEqual(self.synthesize.call_count, 1)
+        self.assertRedirects(response, reverse('tts-clip', args=[clip.key]), fetch_redirect_response=False)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        ClipFallback.objects.update(expires_at=timezone.now())
+        self.assertIsNone(tts.find_clip(key))
+
+    def test_play_sound_schedules_synthesis_and_returns_clip_url(self):
+        board = Board.objects.create(name='Board', creator=self.user)
+        key = tts.clip_key('мама')
+
+        with mock.patch.object(tts, 'schedule_clip', wraps=tts.schedule_clip) as schedule_clip, \
+                mock.patch.object(tts._synthesis_executor, 'submit') as submit:
+            response = self.client.get(reverse('call_play_sound'), {'input_data': 'Мама', 'board_id': board.id})
+            # the pending row is what another worker answers the poll from
+            tts._pending.clear()
+            clip_response = self.client.get(reverse('tts-clip', args=[key]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['audio_ready'])
+        self.assertIsNone(response.data['audio_url'])
+        self.assertTrue(response.data['clip_url'].endswith(reverse('tts-clip', args=[key])))
+        schedule_clip.assert_called_once_with('Мама', tts.TTS_VOICE, tts.TTS_MODEL)
+        submit.assert_called_once()
+        self.assertEqual(clip_response.status_code, status.HTTP_202_ACCEPTED)
+
+        PendingClip.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.client.get(reverse('tts-clip', args=[key])).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(History.objects.filter(user=self.user).count(), 1)
+
+    def test_play_sound_returns_cached_audio(self):
+        board = Board.objects.create(name='Board', creator=self.user)
+        tts.get_or_create_clip('мама')
+
+        with mock.patch.object(tts, 'schedule_clip') as schedule_clip:
+            response = self.client.get(reverse('call_play_sound'), {'input_data': 'мама', 'board_id': board.id})
+
+        self.assertTrue(response.data['audio_ready'])
+        self.assertIsNotNone(response.data['audio_url'])
+        schedule_clip.assert_not_called()
+
+    def test_play_sound_composes_phrase_from_card_clips(self):
+        board = Board.objects.create(name='Board', creator=self.user)
+        self.synthesize.side_effect = fake_synthesis([b'ID3\x00\x00\x00\x00\x00\x00\x00xx', b'yy'])
+        tts.get_or_create_clip('хочу')
+        tts.get_or_create_clip('пить')
+
+        with mock.patch.object(tts, 'schedule_clip') as schedule_clip, \
+                mock.patch.object(tts._storage_executor, 'submit') as submit:
+            response = self.client.get(reverse('call_play_sound'), {
+                'input_data': 'хочу пить', 'board_id': board.id, 'labels': ['хочу', 'пить'], 'compose': 'true',
+            })
+            tts._pending.clear()
+            clip_response = self.client.get(response.data['clip_url'])
+
+        self.assertTrue(response.data['audio_ready'])
+        self.assertEqual(clip_response.content, b'xxyy')
+        self.assertEqual(clip_response['Cache-Control'], 'no-cache')
+        schedule_clip.assert_not_called()
+        submit.assert_called_once()
+
+        self.run_uploads(submit)
+        self.assertFalse(PendingClip.objects.exists())
+        self.assertEqual(self.client.get(response.data['clip_url']).content, b'xxyy')
+
+    def test_compose_falls_back_to_full_synthesis_when_a_card_is_missing(self):
+        board = Board.objects.create(name='Board', creator=self.user)
+        with mock.patch.object(tts, 'schedule_clip') as schedule_clip:
+            response = self.client.get(reverse('call_play_sound'), {
+                'input_data': 'хочу пить', 'board_id': board.id, 'labels': ['хочу', 'пить'], 'compose': 'true',
+            })
+
+        self.assertFalse(response.data['audio_ready'])
+        scheduled = [call.args[0] for call in schedule_clip.call_args_list]
+        self.assertEqual(scheduled, ['хочу', 'пить', 'хочу пить'])
+
+    def test_clip_view_serves_low_bitrate_variant_to_slow_clients(self):
+        clip, _ = tts.get_or_create_clip('Хочу пить')
+        AudioVariant.objects.create(clip=clip, name='opus-24k', path='audio/x.opus-24k.opus', size=4)
+        self.cache.put(variants.cache_key(clip.key, 'opus-24k'), b'OggS')
+        url = reverse('tts-clip', args=[clip.key])
+
+        slow = self.client.get(url, HTTP_ECT='2g', HTTP_ACCEPT='audio/ogg, audio/mpeg')
+        fast = self.client.get(url, HTTP_ACCEPT='audio/ogg, audio/mpeg')
+
+        self.assertEqual(slow.content, b'OggS')
+        self.assertEqual(slow['Content-Type'], 'audio/ogg')
+        self.assertIn('immutable', slow['Cache-Control'])
+        self.assertIn('ECT', slow['Vary'])
+        self.assertEqual(fast.content, b'ID3 fake mp3')
+
+    def test_clip_view_falls_back_to_original_while_variant_is_missing(self):
+        clip, _ = tts.get_or_create_clip('Хочу пить')
+
+        with mock.patch.object(variants, 'schedule_variants') as schedule_variants:
+            response = self.client.get(reverse('tts-clip', args=[clip.key]) + '?variant=mp3-32k')
+
+        self.assertEqual(response.content, b'ID3 fake mp3')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        schedule_variants.assert_called_once_with(clip, b'ID3 fake mp3')
+
+
+class AsyncTextToSpeechTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password='testpass123')
+        self.auth = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        self.synthesize = mock.patch.object(
+            tts, 'asynthesize', side_effect=fake_synthesis(itertools.repeat(b'ID3 fake mp3'))
+        ).start()
+        self.sync_synthesize = mock.patch.object(tts, 'synthesize').start()
+        mock.patch.object(tts, '_save_clip_bytes', side_effect=lambda key, fmt, content: tts.clip_path(key, fmt)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def get(self, data, **kwargs):
+        # the text is sent in the body, like to TextToSpeechView
+        return self.async_client.generic('GET', reverse('async-text-to-speech'), json.dumps(data),
+                                         'application/json', **kwargs)
+
+    async def test_requires_authentication(self):
+        response = await self.get({'text': 'сок'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_second_request_is_served_from_cache(self):
+        first = await self.get({'text': 'Сок'}, headers=self.auth)
+        second = await self.get({'text': 'сок'}, headers=self.auth)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertFalse(first.json()['cached'])
+        self.assertTrue(second.json()['cached'])
+        self.synthesize.assert_awaited_once()
+        self.sync_synthesize.assert_not_called()
+        self.assertFalse(await AudioClipLock.objects.aexists())
+
+    async def test_text_in_query_string_is_not_read(self):
+        response = await self.async_client.get(reverse('async-text-to-speech'), {'text': 'сок'}, headers=self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.synthesize.assert_not_called()
+
+
+class AudioCacheTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        memory = audio_cache.MemoryLRU(10)
+        memory.put('a', b'aaaa')
+        memory.put('b', b'bbbb')
+        memory.get('a')
+        memory.put('c', b'cccc')
+
+        self.assertIsNone(memory.get('b'))
+        self.assertEqual(memory.get('a'), b'aaaa')
+        self.assertEqual(memory.stats()['evictions'], 1)
+
+    def test_disk_tier_refills_memory_and_survives_restart(self):
+        cache = audio_cache.AudioCache(4, self.cache_dir, 100)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+
+        self.assertIsNone(cache.memory.get('a'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.disk.stats()['hits'], 1)
+
+        restarted = audio_cache.AudioCache(4, self.cache_dir, 100)
+        self.assertEqual(restarted.get('b'), b'bbbb')
+
+    def test_disk_tier_respects_size_cap(self):
+        disk = audio_cache.DiskLRU(self.cache_dir, 8)
+        disk.put('a', b'aaaa')
+        disk.put('b', b'bbbb')
+        disk.put('c', b'cccc')
+
+        self.assertIsNone(disk.get('a'))
+        self.assertEqual(disk.stats()['bytes'], 8)
+        self.assertEqual(disk.stats()['evictions'], 1)
+
+
+class PresynthesisTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='presynth', password='testpass123')
+        self.folder = Folder.objects.create(name='Еда', creator=self.user)
+        self.board = Board.objects.create(name='Board', creator=self.user)
+        tab = Tab.objects.create(name='Tab', board=self.board)
+        for x, label in enumerate(['Сок', 'сок ', 'Вода', 'Хлеб']):
+            image = Image.objects.create(label=label, image='x.jpg', folder=self.folder, creator=self.user)
+            Image_positions.objects.create(image=image, position_x=x, position_y=0, tab=tab)
+        AudioClip.objects.create(key=tts.clip_key('вода'), text='вода', voice=tts.TTS_VOICE,
+                                 model=tts.TTS_MODEL, response_format=tts.TTS_FORMAT, path='audio/x.mp3')
+
+    def test_pending_labels_skip_cached_and_duplicate_labels(self):
+        pending = presynthesis.pending_labels(presynthesis.board_labels(self.board))
+        self.assertEqual(sorted(tts.normalize_text(label) for label in pending), ['сок', 'хлеб'])
+
+    def test_command_synthesizes_only_missing_labels(self):
+        out = StringIO()
+        with mock.patch.object(presynthesis.tts, 'get_or_create_clip') as get_or_create_clip:
+            call_command('presynthesize_audio', folder=[self.folder.id], workers=2, stdout=out)
+
+        self.assertEqual(get_or_create_clip.call_count, 2)
+        self.assertIn('2 labels synthesized, 0 failed', out.getvalue())
+
+    def test_phrase_is_composed_from_presynthesized_clips(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        save = mock.patch.object(tts, '_save_clip_bytes', side_effect=lambda key, fmt, content: tts.clip_path(key, fmt))
+        with mock.patch.object(tts, 'synthesize', side_effect=fake_synthesis([b'xx', b'yy'])), save, \
+                mock.patch.object(tts.variants, 'schedule_variants'), \
+                mock.patch.object(presynthesis, 'close_old_connections'):
+            # what the presynthesis workers run, on this thread and its connection
+            for label in presynthesis.pending_labels(presynthesis.board_labels(self.board)):
+                presynthesis._synthesize_label(label)
+
+        stored = {'сок': b'xx', 'хлеб': b'yy'}
+        with mock.patch.object(tts, 'synthesize') as synthesize, \
+                mock.patch.object(tts, 'get_clip_bytes', side_effect=lambda clip: stored[clip.text]), \
+                mock.patch.object(tts, 'schedule_clip') as schedule_clip, \
+                mock.patch.object(tts, 'schedule_store') as schedule_store:
+            response = client.get(reverse('call_play_sound'), {
+                'input_data': 'сок хлеб', 'board_id': self.board.id, 'labels': ['Сок', 'Хлеб'], 'compose': 'true',
+            })
+
+        self.assertTrue(response.data['audio_ready'])
+        self.assertEqual(schedule_store.call_args.args[-1], b'xxyy')
+        synthesize.assert_not_called()
+        schedule_clip.assert_not_called()
+
+    def test_progress_keeps_the_job_alive(self):
+        job = PresynthesisJob.objects.create(board=self.board, creator=self.user)
+        PresynthesisJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        with mock.patch.object(presynthesis.tts, 'get_or_create_clip'):
+            presynthesis.run_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.total), ('done', 2, 2))
+        self.assertGreater(job.updated_at, timezone.now() - timedelta(minutes=1))
+
+    def test_jobs_are_scoped_to_the_user(self):
+        other = User.objects.create_user(username='stranger', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(user=other)
+
+        with mock.patch.object(presynthesis, 'start_job') as start_job:
+            board_response = client.post(reverse('tts-presynthesize'), {'board_id': self.board.id})
+            folder_response = client.post(reverse('tts-presynthesize'), {'folder_id': self.folder.id})
+        job = PresynthesisJob.objects.create(board=self.board, creator=self.user)
+        job_response = client.get(reverse('tts-presynthesize-job', args=[job.id]))
+
+        self.assertEqual(board_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(folder_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(job_response.status_code, status.HTTP_404_NOT_FOUND)
+        start_job.assert_not_called()
+
+        client.force_authenticate(user=self.user)
+        self.assertEqual(client.get(reverse('tts-presynthesize-job', args=[job.id])).status_code, status.HTTP_200_OK)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flights = singleflight.SingleFlight()
+        calls = []
+        results = []
+
+        def synthesize():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'clip'
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', synthesize)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('clip', False)] + [('clip', True)] * 4)
+
+
+class ClipLockTests(TestCase):
+    def test_waits_for_the_worker_holding_the_lock(self):
+        AudioClipLock.objects.create(key='key')
+        lookup = mock.Mock(side_effect=[None, None, 'clip'])
+        create = mock.Mock()
+
+        with mock.patch.object(singleflight, 'LOCK_POLL_INTERVAL', 0):
+            result = singleflight.run_once('key', lookup, create)
+
+        self.assertEqual(result, ('clip', False))
+        create.assert_not_called()
+
+    async def test_async_claim_waits_for_the_worker_holding_the_lock(self):
+        await AudioClipLock.objects.acreate(key='key')
+        lookup = mock.Mock(side_effect=[None, None, 'clip'])
+
+        with mock.patch.object(singleflight, 'LOCK_POLL_INTERVAL', 0):
+            result = await singleflight.aclaim('key', lookup)
+
+        self.assertEqual(result, ('clip', None))
+        self.assertEqual(lookup.call_count, 3)
+
+    def test_takes_over_a_stale_lock(self):
+        lock = AudioClipLock.objects.create(key='key')
+        AudioClipLock.objects.filter(id=lock.id).update(created_at=timezone.now() - timedelta(hours=1))
+
+        result = singleflight.run_once('key', lambda: None, lambda: 'clip')
+
+        self.assertEqual(result, ('clip', True))
+        self.assertFalse(AudioClipLock.objects.exists())
+
+    def test_a_taken_over_lock_is_not_released_by_its_old_holder(self):
+        token = singleflight.acquire_lock('key')
+        AudioClipLock.objects.filter(key='key').update(created_at=timezone.now() - timedelta(hours=1))
+        new_token = singleflight.acquire_lock('key')
+
+        singleflight.release_lock('key', token)
+
+        self.assertEqual(list(AudioClipLock.objects.values_list('token', flat=True)), [new_token])
+
+
+class FlakyBackend(tts_backends.TTSBackend):
+    name = 'flaky'
+    models = ('flaky',)
+    voices = ('flaky',)
+    default_voice = 'flaky'
+
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def synthesize(self, text, voice, model, response_format):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError('provider down')
+        return b'FLAKY'
+
+
+@override_settings(TTS_SLOW_SECONDS=0.05, TTS_BREAKER_FAILURES=2, TTS_BREAKER_COOLDOWN_SECONDS=60)
+class BackendRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = tts_backends.BackendRegistry()
+        self.fallback = tts_backends.LocalBackend()
+        self.fallback.fallback = True
+        self.registry.register(self.fallback)
+
+    def test_local_backend_is_never_a_fallback(self):
+        backend = tts_backends.LocalBackend()
+        self.assertEqual(backend.synthesize('мама', 'local', 'local', 'mp3'),
+                         backend.synthesize('мама', 'local', 'local', 'mp3'))
+        self.assertEqual([b.name for b in tts_backends.registry.candidates('tts-1', 'mp3')], ['openai', 'gtts'])
+
+    def test_failures_trip_the_breaker_and_fall_back(self):
+        flaky = FlakyBackend(fail=True)
+        self.registry.register(flaky)
+
+        for _ in range(3):
+            audio_content, backend = self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')
+            self.assertTrue(audio_content.startswith(b'LOCAL'))
+            self.assertIs(backend, self.fallback)
+
+        self.assertEqual(flaky.calls, 2)
+        stats = self.registry.stats()
+        self.assertTrue(stats['flaky']['circuit_open'])
+        self.assertEqual(stats['flaky']['errors'], 2)
+        self.assertEqual(stats['local']['calls'], 3)
+
+    def test_half_open_breaker_lets_one_probe_through(self):
+        flaky = FlakyBackend(fail=True)
+        self.registry.register(flaky)
+        for _ in range(2):
+            self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')
+        stats = self.registry._stats['flaky']
+        stats.open_until = time.monotonic()
+
+        # the cooldown is over, the first call probes and the ones meanwhile fall back
+        self.assertTrue(stats.allow())
+        self.assertIs(self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')[1], self.fallback)
+        self.assertEqual(flaky.calls, 2)
+
+        stats.record_success(0)
+        flaky.fail = False
+        self.assertEqual(self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3'), (b'FLAKY', flaky))
+        self.assertFalse(stats.is_open())
+
+    def test_failed_probe_opens_the_breaker_again(self):
+        flaky = FlakyBackend(fail=True)
+        self.registry.register(flaky)
+        for _ in range(2):
+            self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')
+        self.registry._stats['flaky'].open_until = time.monotonic()
+
+        self.assertIs(self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')[1], self.fallback)
+
+        self.assertEqual(flaky.calls, 3)
+        self.assertTrue(self.registry.stats()['flaky']['circuit_open'])
+        self.assertIs(self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')[1], self.fallback)
+        self.assertEqual(flaky.calls, 3)
+
+    def test_slow_backend_is_routed_around(self):
+        slow = FlakyBackend(delay=0.1)
+        self.registry.register(slow)
+
+        self.assertEqual(self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3'), (b'FLAKY', slow))
+        self.assertEqual(self.registry.candidates('flaky', 'mp3')[0], self.fallback)
+
+    def test_error_is_raised_when_every_backend_fails(self):
+        self.registry.unregister('local')
+        self.registry.register(FlakyBackend(fail=True))
+
+        with self.assertRaises(ConnectionError):
+            self.registry.synthesize('мама', 'flaky', 'flaky', 'mp3')
+
+
+class VariantNegotiationTests(SimpleTestCase):
+    def negotiate(self, **headers):
+        return variants.negotiate(RequestFactory().get('/tts/clip/key', **headers))
+
+    def test_client_hints_pick_the_variant(self):
+        self.assertIsNone(self.negotiate())
+        self.assertIsNone(self.negotiate(HTTP_ECT='4g', HTTP_DOWNLINK='10'))
+        self.assertEqual(self.negotiate(HTTP_SAVE_DATA='on'), 'mp3-32k')
+        self.assertEqual(self.negotiate(HTTP_DOWNLINK='0.4', HTTP_ACCEPT='audio/ogg'), 'opus-24k')
+        self.assertEqual(self.negotiate(HTTP_ECT='3g', HTTP_ACCEPT='audio/mpeg'), 'mp3-32k')
+
+    def test_explicit_variant_wins(self):
+        request = RequestFactory().get('/tts/clip/key', {'variant': 'opus-24k'})
+        self.assertEqual(variants.negotiate(request), 'opus-24k')
@@ -10,8 +10,10 @@ from rest_framework_simplejwt.views import (
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from django.urls import re_path
+from django.views.decorators.csrf import csrf_exempt
 from .views import *
 from .login import *
+from .async_views import AsyncTextToSpeechView, AsyncPlaySoundView, AsyncFolderImageView
 
 
 schema_view = get_schema_view(
@@ -41,9 +43,17 @@ urlpatterns = [
     path('signup', SignupUserView.as_view(), name='signup'),
     path('recipient_profile', RecipientProfileView.as_view(), name='recipient_profile'),
     path('library', LibraryView.as_view(), name='library'),
+    path('library/search', LibrarySearchView.as_view(), name='library-search'),
+    path('library/semantic-search', LibrarySemanticSearchView.as_view(), name='library-semantic-search'),
     path('my_boards', BoardCollectionView.as_view(), name='my_boards'),
     path('folder/<int:id>', FolderImageView.as_view(), name='folder_image'),
     path('board/<int:board_id>', BoardDetailView.as_view(), name='board'),
+    path('board/<int:board_id>/sync', BoardSyncView.as_view(), name='board-sync'),
+    path('board/<int:board_id>/clone', BoardCloneView.as_view(), name='board-clone'),
+    path('board/<int:board_id>/bundle', BoardBundleView.as_view(), name='board-bundle'),
+    path('board-templates', BoardTemplateView.as_view(), name='board-templates'),
+    path('tab/<int:tab_id>/layout', TabLayoutView.as_view(), name='tab-layout'),
+    path('tab/<int:tab_id>/next-cell', TabNextCellView.as_view(), name='tab-next-cell'),
     path('profile-page', ProfileView.as_view(), name='profile'),
     path('cr-profile-page', RecipientProfileView.as_view(), name='recipient_profile'),
     path("ajax/", PlaySoundView.as_view(), name='call_play_sound'),
@@ -56,6 +66,16 @@ urlpatterns = [
     path('folder', FolderCreateView.as_view(), name='folder-create'),
 
     path('tts', TextToSpeechView.as_view(), name='text-to-speach'),
+    path('tts/clip/<str:key>', AudioClipView.as_view(), name='tts-clip'),
+    path('tts/cache-stats', AudioCacheStatsView.as_view(), name='tts-cache-stats'),
+    path('tts/backends', TTSBackendStatsView.as_view(), name='tts-backends'),
+    path('tts/presynthesize', PresynthesisView.as_view(), name='tts-presynthesize'),
+    path('tts/presynthesize/<int:job_id>', PresynthesisJobView.as_view(), name='tts-presynthesize-job'),
+
+    path('async/tts', AsyncTextToSpeechView.as_view(), name='async-text-to-speech'),
+    path('async/ajax/', AsyncPlaySoundView.as_view(), name='async-play-sound'),
+    path('async/folder/<int:id>', csrf_exempt(AsyncFolderImageView.as_view()), name='async-folder-image'),
+
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # For obtaining tokens
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  # For refreshing tokens
 
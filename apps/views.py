@@ -1,31 +1,36 @@
 import base64
 import os
 import random
-from urllib.parse import quote
 
 from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, Q
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 
 import pecs.settings as settings
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from django.core.files.storage import default_storage
-from dotenv import load_dotenv
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from openai import OpenAI
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .application import play_sound
-from .login import is_recipient, is_caregiver
+from .application import board_cache, bundle, catalog, cloning, compose, derivatives, duplicates, layout, \
+    pagination, presynthesis, search, semantic, sync, tts, tts_backends, variants
+from .application.audio_cache import get_audio_cache
+from .login import is_recipient, is_caregiver, user_roles
 from .models import Care_recipient, Care_giver, Codes, Board, Folder, Image, Tab, Image_positions, History, \
-    R2StorageAudio
+    R2StorageAudio, AudioClip, PresynthesisJob
 from .serializers import VerifyCodeSerializer, PlaySoundSerializer, BoardSerializer, \
     HistorySerializer, ImageSerializer, FolderSerializer, TabSerializer, \
-    ImagePositionSerializer, TextToSpeechSerializer
-from storages.backends.s3boto3 import S3Boto3Storage
+    ImagePositionSerializer, TextToSpeechSerializer, PresynthesisJobSerializer, LayoutSaveSerializer, \
+    BoardCloneSerializer, BundleRequestSerializer
 
 
 class GenerateCodeView(APIView):
@@ -115,12 +120,17 @@ class PlaySoundView(APIView):
         query_serializer=PlaySoundSerializer(),
         responses={
             200: openapi.Response(
-                description="Sound played successfully",
+                description="Phrase recorded, audio ready or being synthesized",
                 schema=openapi.Schema(
                     type=openapi.TYPE_OBJECT,
                     properties={
                         'success': openapi.Schema(type=openapi.TYPE_BOOLEAN),
                         'message': openapi.Schema(type=openapi.TYPE_STRING),
+                        'audio_ready': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                        'audio_url': openapi.Schema(type=openapi.TYPE_STRING,
+                                                    description="R2 URL, null while the audio is synthesized"),
+                        'clip_url': openapi.Schema(type=openapi.TYPE_STRING,
+                                                   description="Cached audio bytes, 202 while synthesized"),
                         'board': openapi.Schema(type=openapi.TYPE_OBJECT)
                     }
                 )
@@ -146,7 +156,7 @@ class PlaySoundView(APIView):
             if user.is_authenticated:
                 history_data = {
                     'text': input_data,
-                    'date': datetime.today(),
+                    'date': datetime.today().date(),
                     'time': datetime.now().strftime("%H:%M:%S"),
                     'user': user.id,
                     'board': board.id
@@ -158,10 +168,19 @@ class PlaySoundView(APIView):
                 else:
                     return Response(history_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            play_sound.playtext(input_data)
+            key, clip, ready = compose.resolve_phrase(
+                input_data,
+                labels=serializer.validated_data.get('labels'),
+                compose=serializer.validated_data.get('compose'),
+                crossfade_ms=serializer.validated_data.get('crossfade_ms'),
+            )
+
             return Response({
                 'success': True,
                 'message': "Sound played successfully.",
+                'audio_ready': ready,
+                'audio_url': tts.clip_url(clip.path) if clip is not None else None,
+                'clip_url': request.build_absolute_uri(reverse('tts-clip', args=[key])),
                 'board': board_serializer.data
             }, status=status.HTTP_200_OK)
 
@@ -191,26 +210,22 @@ class LibraryView(APIView):
         }
     )
     def get(self, request):
-        folders = Folder.objects.all().order_by('name')
-        public_folders = [cat for cat in folders if not cat.is_private()]
-        private_folders = []
-
-        if not request.user.is_staff:
-            private_folders = list(Folder.objects.filter(creator=request.user).order_by('name'))
-
-        folders = public_folders + private_folders
-        images_data = {}
-
-        for folder in folders:
-            images_data[folder.name] = Image.objects.filter(folder=folder).values('image').distinct()[:1]
-
-        private_images = Image.objects.filter(creator=request.user).values('image', 'label').distinct()
+        # Staff folders first, then the user's own, each with the path of its first image as the cover.
+        # Both come from the cached catalog layers, rebuilt only after a folder or image changed,
+        # without the full image lists the board payload needs.
+        public, own = catalog.library(request.user, images=False)
+        folders = public['folders'] + own['folders']
+        cover_names = {**public['cover_names'], **own['cover_names']}
+        images_data = {
+            folder['name']: [{'image': cover_names[folder['id']]}] if folder['id'] in cover_names else []
+            for folder in folders
+        }
 
         response_data = {
             'current_path': request.path,
-            'folders': FolderSerializer(folders, many=True).data,
+            'folders': folders,
             'images': images_data,
-            'private_imgs': list(private_images),  # Convert to list if needed
+            'private_imgs': own['private_images'],
         }
         return Response(response_data)
 
@@ -230,6 +245,108 @@ class LibraryView(APIView):
     #     return Response(image_form.errors, status=400)
 
 
+class LibrarySearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Search cards in the user's visible library by label, best matches first. "
+                              "Pass next_cursor back as cursor for the following page.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Search text", type=openapi.TYPE_STRING,
+                              required=True),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('folders', openapi.IN_QUERY, description="Also match folder names",
+                              type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'results': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'folders': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'next_cursor': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            ),
+            400: openapi.Response(description="Missing query or invalid cursor"),
+        }
+    )
+    def get(self, request):
+        q = request.query_params.get('q', '').strip()[:100]
+        if not q:
+            return Response({"error": "'q' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        after = None
+        if request.query_params.get('cursor'):
+            try:
+                rank, image_id = pagination.decode_cursor(request.query_params['cursor'])
+                after = float(rank), int(image_id)
+            except (TypeError, ValueError):
+                return Response({"error": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = pagination.page_size(request.query_params.get('limit'), settings.LIBRARY_PAGE_SIZE,
+                                     settings.LIBRARY_MAX_PAGE_SIZE)
+        images, next_cursor = pagination.paginate(
+            search.search_images(request.user, q, limit, after), limit, lambda image: [image.rank, image.id]
+        )
+
+        response_data = {
+            'results': ImageSerializer(images, many=True).data,
+            'next_cursor': next_cursor,
+        }
+        # folders are few, they only come with the first page
+        if request.query_params.get('folders') in ('1', 'true') and after is None:
+            response_data['folders'] = FolderSerializer(search.search_folders(request.user, q, limit), many=True).data
+        return Response(response_data, status=status.HTTP_200_OK)
+
+
+class LibrarySemanticSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Cards in the user's visible library whose labels mean something close to the "
+                              "query, best first. Works offline against a local index.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Search text", type=openapi.TYPE_STRING,
+                              required=True),
+            openapi.Parameter('k', openapi.IN_QUERY, description="Number of cards", type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'results': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                }
+            ),
+            400: openapi.Response(description="Missing query"),
+            503: openapi.Response(description="The index is being built"),
+        }
+    )
+    def get(self, request):
+        q = request.query_params.get('q', '').strip()[:100]
+        if not q:
+            return Response({"error": "'q' is required."}, status=status.HTTP_400_BAD_REQUEST)
+        k = pagination.page_size(request.query_params.get('k'), settings.SEMANTIC_SEARCH_K,
+                                 settings.LIBRARY_MAX_PAGE_SIZE)
+
+        # a missing index, or one of another dimension than this process embeds into, is
+        # built in the background, uploads keep it up to date from then on
+        if not semantic.is_current():
+            semantic.schedule_build()
+            return Response({"error": "The search index is being built, try again shortly."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        visible = search.visible_images(request.user)
+        hits = semantic.search(q, k, lambda ids: visible.filter(id__in=ids).values_list('id', flat=True))
+        # only the hits get loaded and serialized
+        images = Image.objects.select_related('creator').in_bulk([image_id for image_id, _ in hits])
+        results = [
+            {**ImageSerializer(images[image_id]).data, 'score': round(score, 4)}
+            for image_id, score in hits if image_id in images
+        ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
 class BoardCollectionView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -251,7 +368,7 @@ class BoardCollectionView(APIView):
         }
     )
     def get(self, request):
-        boards = Board.objects.filter(creator=request.user)
+        boards = Board.objects.filter(creator=request.user, is_template=False)
         serializer = BoardSerializer(boards, many=True)
 
         response_data = {
@@ -313,8 +430,14 @@ upload_image_response = openapi.Response(
                                                  description="ID of the creator of the image"),
                     'creator_name': openapi.Schema(type=openapi.TYPE_STRING, description="Username of the creator"),
                     'image_url': openapi.Schema(type=openapi.TYPE_STRING, description="URL of the uploaded image"),
+                    'srcset': openapi.Schema(type=openapi.TYPE_OBJECT,
+                                             description="Resized copies by format and size, filled in shortly "
+                                                         "after the upload"),
                 }
-            )
+            ),
+            'duplicate_of': openapi.Schema(type=openapi.TYPE_INTEGER,
+                                           description="ID of the library image whose stored file was reused, "
+                                                       "null for a new photo"),
         }
     )
 )
@@ -341,14 +464,41 @@ folder_response = openapi.Response(
                         'creator_id': openapi.Schema(type=openapi.TYPE_INTEGER, description="ID of the creator"),
                         'creator_name': openapi.Schema(type=openapi.TYPE_STRING, description="Username of the creator"),
                         'image_url': openapi.Schema(type=openapi.TYPE_STRING, description="URL of the image"),
+                        'srcset': openapi.Schema(type=openapi.TYPE_OBJECT,
+                                                 description="Resized copies by format and size, e.g. "
+                                                             "{\"webp\": {\"128\": url}}"),
                     }
                 ),
                 description="List of images in the folder"
-            )
+            ),
+            'next_cursor': openapi.Schema(type=openapi.TYPE_STRING,
+                                          description="Cursor of the next page, null on the last one"),
         }
     )
 )
 
+folder_page_parameters = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, description="next_cursor of the previous page",
+                      type=openapi.TYPE_STRING),
+    openapi.Parameter('limit', openapi.IN_QUERY, description="Images per page", type=openapi.TYPE_INTEGER),
+]
+
+
+def folder_image_page(request, folder_id):
+    """The requested page of a folder's images and the cursor of the next one. Raises ValueError on a bad cursor."""
+    after = None
+    if request.query_params.get('cursor'):
+        try:
+            label, image_id = pagination.decode_cursor(request.query_params['cursor'])
+            after = str(label), int(image_id)
+        except TypeError:
+            raise ValueError("Invalid cursor.")
+
+    limit = pagination.page_size(request.query_params.get('limit'), settings.LIBRARY_PAGE_SIZE,
+                                 settings.LIBRARY_MAX_PAGE_SIZE)
+    return pagination.paginate(search.folder_images(folder_id, limit, after), limit,
+                               lambda image: [image.label, image.id])
+
 
 class FolderImageView(APIView):
 
@@ -366,24 +516,28 @@ class FolderImageView(APIView):
                 type=openapi.TYPE_INTEGER,
                 required=True,
             ),
-        ]
+        ] + folder_page_parameters
     )
     def get(self, request, id):
         try:
             folder = Folder.objects.get(id=id)
 
-            # images = Image.objects.filter(folder=folder).values('id', 'label', 'image').distinct()
-
-            images = Image.objects.filter(folder=folder).distinct()
+            # Paged by (label, id), large staff folders used to come back in one multi-megabyte response
+            try:
+                images, next_cursor = folder_image_page(request, folder.id)
+            except ValueError:
+                return Response({'error': 'Invalid cursor.'}, status=status.HTTP_400_BAD_REQUEST)
 
             serializer = ImageSerializer(images, many=True, context={'request': request})
+            is_cr, is_cg = user_roles(request.user)
 
             response_data = {
                 'id': folder.id,
                 'name': folder.name,
-                'is_cr': is_recipient(request.user),
-                'is_cg': is_caregiver(request.user),
-                'images': serializer.data  # Convert to list for JSON serialization
+                'is_cr': is_cr,
+                'is_cg': is_cg,
+                'images': serializer.data,  # Convert to list for JSON serialization
+                'next_cursor': next_cursor,
             }
 
             return Response(response_data, status=status.HTTP_200_OK)
@@ -436,13 +590,23 @@ class FolderImageView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+        # Kept for the thumbnails, so they do not have to be downloaded back from storage
+        original = image_data.read()
+        image_data.seek(0)
+
+        # A photo already in the user's library reuses its stored object and thumbnails instead of a new upload
+        phash = duplicates.fingerprint_or_blank(original)
+        duplicate = duplicates.find_duplicate(request.user, phash)
+
         # Create and save the image under the folder
         try:
             image = Image.objects.create(
                 folder=folder,
-                image=image_data,  # Store the image file
+                image=duplicate.image.name if duplicate else image_data,  # Store the image file
                 label=label,
                 creator=request.user,
+                phash=duplicate.phash if duplicate else phash,
+                derivatives=dict(duplicate.derivatives) if duplicate else {},
             )
         except Exception as e:
             return Response(
@@ -450,6 +614,12 @@ class FolderImageView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        duplicates.index_fingerprint(image.id, image.phash)
+
+        # Thumbnails are made in the background, tablets get them through srcset
+        if derivatives.missing(image):
+            derivatives.schedule_derivatives(image, original)
+
         # Serialize the response
         serializer = ImageSerializer(image)
 
@@ -457,7 +627,8 @@ class FolderImageView(APIView):
             "message": "Image uploaded successfully.",
             "folder_id": folder.id,
             "image_id": image.id,
-            "image_details": serializer.data
+            "image_details": serializer.data,
+            "duplicate_of": duplicate.id if duplicate else None,
         }
         return Response(response_message, status=status.HTTP_201_CREATED)
 
@@ -482,6 +653,7 @@ class BoardDetailView(APIView):
                     'board_id': openapi.Schema(type=openapi.TYPE_INTEGER),
                 }
             ),
+            304: openapi.Response(description="Board unchanged since the ETag sent in If-None-Match"),
             404: openapi.Response(description="Board not found")
         },
         manual_parameters=[
@@ -495,52 +667,62 @@ class BoardDetailView(APIView):
         ]
     )
     def get(self, request, board_id):
-        try:
-            board = Board.objects.get(id=board_id)
-        except Board.DoesNotExist:
-            return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Retrieve public folders created by staff and private folders created by the user
-        public_folders = Folder.objects.filter(creator__is_staff=True).order_by('name')
-        private_folders = Folder.objects.filter(creator=request.user).order_by('name')
-
-        # Combine the public and private folders
-        folders = public_folders | private_folders
-
-        # Fetch the images for each folder (distinction logic can be handled at the query level)
+        # Unchanged boards are answered from the versions alone, without touching the board
+        scope_versions = board_cache.versions(*sync.sync_scopes(board_id, request.user))
+        etag = board_cache.board_etag(board_id, request.user, scope_versions)
+        if board_cache.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response_data = board_cache.get_snapshot(etag)
+        if response_data is None:
+            try:
+                board = Board.objects.get(id=board_id)
+            except Board.DoesNotExist:
+                return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+            response_data = self.board_detail(request, board, catalog.library(request.user, scope_versions[1:]))
+            board_cache.set_snapshot(etag, response_data)
+
+        return Response(response_data, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+    def board_detail(self, request, board, library):
+        # Public folders created by staff and private folders created by the user, merged from the
+        # cached catalog layers; the cover of each folder is its first image
+        public, own = library
+        folders = sorted(public['folders'] + own['folders'], key=lambda folder: folder['name'])
+        covers = {**public['covers'], **own['covers']}
         c_images = {
-            folder.id: ImageSerializer(
-                Image.objects.filter(folder=folder).distinct()[:1], many=True
-            ).data
+            folder['id']: [covers[folder['id']]] if folder['id'] in covers else []
             for folder in folders
         }
+        images = sorted(public['images'] + own['images'], key=lambda image: image['id'])
 
-        # Retrieve all images in the combined folders
-        images = Image.objects.filter(folder__in=folders)
-
-        # Retrieve tabs for the board and associated image positions
-        tabs = Tab.objects.filter(board=board).order_by('id')
-        tabs_data = []
+        # Tabs with their positions and the labelled image of each position, two queries in total
+        tabs = list(
+            Tab.objects.filter(board=board).order_by('id').prefetch_related(
+                Prefetch('image_positions_set',
+                         queryset=Image_positions.objects.select_related('image').order_by('id'))
+            )
+        )
+        tabs_data = [
+            {'tab': TabSerializer(tab).data,
+             'images': ImagePositionSerializer(tab.image_positions_set.all(), many=True).data}
+            for tab in tabs
+        ]
 
-        for tab in tabs:
-            # Use prefetch_related for Image_positions to optimize queries
-            tab_positions = Image_positions.objects.filter(tab=tab).distinct()
-            tabs_img = ImagePositionSerializer(tab_positions, many=True).data
-            tabs_data.append({'tab': TabSerializer(tab).data, 'images': tabs_img})
+        is_cr, is_cg = user_roles(request.user)
 
         # Construct the response data
         response_data = {
             'tabs': TabSerializer(tabs, many=True).data,
-            'is_cr': is_recipient(request.user),
-            'is_cg': is_caregiver(request.user),
+            'is_cr': is_cr,
+            'is_cg': is_cg,
             'tabs_img': tabs_data,
-            'folders': FolderSerializer(folders, many=True).data,
+            'folders': folders,
             'c_images': c_images,  # Now using folder IDs as keys
-            'images': ImageSerializer(images, many=True).data,
+            'images': images,
             'board_id': board.id,
         }
-
-        return Response(response_data, status=status.HTTP_200_OK)
+        return response_data
 
     @swagger_auto_schema(
         operation_description="Create a new tab in a board",
@@ -582,6 +764,355 @@ class BoardDetailView(APIView):
                         status=status.HTTP_201_CREATED)
 
 
+class BoardSyncView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Changes to a board and the viewer's library since the cursor of a previous sync. "
+                              "Without a cursor, or when it is too old, everything is returned with reset=true.",
+        manual_parameters=[
+            openapi.Parameter('board_id', openapi.IN_PATH, description="Board ID", type=openapi.TYPE_INTEGER,
+                              required=True),
+            openapi.Parameter('since', openapi.IN_QUERY, description="Cursor returned by the previous sync",
+                              type=openapi.TYPE_STRING),
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'board_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'cursor': openapi.Schema(type=openapi.TYPE_STRING),
+                    'reset': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    'tabs': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'positions': openapi.Schema(type=openapi.TYPE_ARRAY,
+                                                items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'folders': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'images': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                    'deleted': openapi.Schema(type=openapi.TYPE_OBJECT),
+                }
+            ),
+            400: openapi.Response(description="Invalid cursor"),
+            404: openapi.Response(description="Board not found"),
+        }
+    )
+    def get(self, request, board_id):
+        since = request.query_params.get('since')
+        try:
+            since = sync.parse_cursor(since) if since else None
+        except ValueError:
+            return Response({"error": "Invalid sync cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            board = Board.objects.get(id=board_id)
+        except Board.DoesNotExist:
+            return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        changes = sync.board_changes(board, request.user, since)
+        changed = changes['changed']
+        return Response({
+            'board_id': board.id,
+            'cursor': changes['cursor'],
+            'reset': changes['reset'],
+            'tabs': TabSerializer(changed['tab'], many=True).data,
+            'positions': ImagePositionSerializer(changed['position'], many=True).data,
+            'folders': FolderSerializer(changed['folder'], many=True).data,
+            'images': ImageSerializer(changed['image'], many=True).data,
+            'deleted': {
+                'tabs': changes['deleted']['tab'],
+                'positions': changes['deleted']['position'],
+                'folders': changes['deleted']['folder'],
+                'images': changes['deleted']['image'],
+            },
+        }, status=status.HTTP_200_OK)
+
+
+class TabLayoutView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Apply a batch of card create/move/delete operations to a tab in one transaction. "
+                              "The revision must be the tab's current one, otherwise nothing is applied and "
+                              "409 is returned with the current layout.",
+        request_body=LayoutSaveSerializer,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'revision': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    'positions': openapi.Schema(type=openapi.TYPE_ARRAY,
+                                                items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                }
+            ),
+            400: openapi.Response(description="Invalid operations"),
+            404: openapi.Response(description="Tab not found"),
+            409: openapi.Response(description="The tab was changed since the given revision"),
+        }
+    )
+    def post(self, request, tab_id):
+        serializer = LayoutSaveSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        operations = serializer.validated_data['operations']
+
+        # only the board's creator and the caregivers it is shared with edit it, other tabs are not found
+        try:
+            tab = Tab.objects.filter(
+                Q(board__creator=request.user) | Q(board__access_users__user=request.user)
+            ).distinct().get(id=tab_id)
+        except Tab.DoesNotExist:
+            return Response({"error": "Tab not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        creates = [op for op in operations if op['op'] == 'create']
+        moves = {op['id']: op for op in operations if op['op'] == 'move'}
+        deletes = {op['id'] for op in operations if op['op'] == 'delete'}
+
+        # a card below the last strap would be on the tab without ever being shown
+        if any(op['position_y'] >= tab.straps_num for op in creates + list(moves.values())):
+            return Response({"error": f"Cards must be on one of the tab's {tab.straps_num} straps."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        image_ids = {op['image'] for op in creates}
+        if image_ids and Image.objects.filter(id__in=image_ids).count() != len(image_ids):
+            return Response({"error": "Unknown image in create operations."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # claims the revision, a concurrent save of the same revision updates nothing and gets a 409
+            if not Tab.objects.filter(id=tab.id, revision=serializer.validated_data['revision']) \
+                    .update(revision=F('revision') + 1):
+                tab.refresh_from_db(fields=['revision'])
+                return Response({
+                    "error": "The tab was changed by someone else.",
+                    "revision": tab.revision,
+                    "positions": ImagePositionSerializer(
+                        tab.image_positions_set.select_related('image').order_by('id'), many=True
+                    ).data,
+                }, status=status.HTTP_409_CONFLICT)
+
+            existing = {
+                position.id: position
+                for position in Image_positions.objects.filter(tab=tab, id__in=set(moves) | deletes)
+            }
+            unknown = (set(moves) | deletes) - set(existing)
+            if unknown:
+                transaction.set_rollback(True)
+                return Response({"error": f"Positions {sorted(unknown)} are not on this tab."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            moved = []
+            for position_id, op in moves.items():
+                if position_id in deletes:
+                    continue
+                position = existing[position_id]
+                position.position_x = op['position_x']
+                position.position_y = op['position_y']
+                moved.append(position)
+
+            try:
+                with sync.muted(), transaction.atomic():
+                    Image_positions.objects.filter(id__in=deletes).delete()
+                    # park the moved cards off the grid first, so swapping two cards does not
+                    # trip the one card per cell constraint halfway through the update
+                    Image_positions.objects.bulk_update(
+                        [Image_positions(id=position.id, position_y=-position.id) for position in moved], ['position_y']
+                    )
+                    Image_positions.objects.bulk_update(moved, ['position_x', 'position_y'])
+                    created = Image_positions.objects.bulk_create([
+                        Image_positions(tab=tab, image_id=op['image'], position_x=op['position_x'],
+                                        position_y=op['position_y'])
+                        for op in creates
+                    ])
+            except IntegrityError:
+                transaction.set_rollback(True)
+                return Response({"error": "Two cards would end up in the same cell."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            scope = board_cache.board_scope(tab.board_id)
+            sync.record(
+                [(scope, 'tab', tab.id, False)]
+                + [(scope, 'position', position.id, False) for position in created + moved]
+                + [(scope, 'position', position_id, True) for position_id in deletes]
+            )
+
+        return Response({
+            "revision": serializer.validated_data['revision'] + 1,
+            "created": [position.id for position in created],
+            "positions": ImagePositionSerializer(
+                tab.image_positions_set.select_related('image').order_by('id'), many=True
+            ).data,
+        }, status=status.HTTP_200_OK)
+
+
+class TabNextCellView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="First free grid cell on a tab, filling slot by slot across its straps",
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'tab': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'position_x': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'position_y': openapi.Schema(type=openapi.TYPE_INTEGER),
+                }
+            ),
+            404: openapi.Response(description="Tab not found"),
+        }
+    )
+    def get(self, request, tab_id):
+        # own and shared boards plus staff templates, anything else is not found
+        try:
+            tab = Tab.objects.filter(
+                Q(board__creator=request.user) | Q(board__access_users__user=request.user)
+                | Q(board__is_template=True, board__creator__is_staff=True)
+            ).distinct().get(id=tab_id)
+        except Tab.DoesNotExist:
+            return Response({"error": "Tab not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        x, y = layout.next_free_cell(tab)
+        return Response({'tab': tab.id, 'position_x': x, 'position_y': y}, status=status.HTTP_200_OK)
+
+
+class BoardTemplateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Board templates available to the user, their own and the ones made by staff",
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'templates': openapi.Schema(type=openapi.TYPE_ARRAY,
+                                                items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                }
+            ),
+        }
+    )
+    def get(self, request):
+        templates = cloning.visible_templates(request.user).prefetch_related('access_users__recipients')
+        return Response({'templates': BoardSerializer(templates, many=True).data}, status=status.HTTP_200_OK)
+
+
+class BoardCloneView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Copy a board with its tabs and cards to one or many of the caregiver's recipients, "
+                              "or into a new template of the user's own with as_template",
+        request_body=BoardCloneSerializer,
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'boards': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                }
+            ),
+            400: openapi.Response(description="Invalid data or recipients not linked to the caregiver"),
+            403: openapi.Response(description="Board can not be cloned by this user"),
+            404: openapi.Response(description="Board not found"),
+        }
+    )
+    def post(self, request, board_id):
+        serializer = BoardCloneSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            source = Board.objects.select_related('creator').get(id=board_id)
+        except Board.DoesNotExist:
+            return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        caregiver = Care_giver.objects.filter(user=request.user).first()
+        recipients = {}
+        if caregiver is not None:
+            recipients = {recipient.user_id: recipient.user
+                          for recipient in caregiver.recipients.select_related('user')}
+
+        # own boards, shared templates and the boards of the caregiver's recipients
+        if not (source.creator_id == request.user.id or source.creator_id in recipients
+                or (source.is_template and source.creator.is_staff)):
+            return Response({"error": "You can not clone this board."}, status=status.HTTP_403_FORBIDDEN)
+
+        if serializer.validated_data['as_template']:
+            boards = cloning.clone_board(source, [request.user], serializer.validated_data.get('name'),
+                                         is_template=True)
+        else:
+            requested = serializer.validated_data['recipients']
+            unknown = sorted(set(requested) - set(recipients))
+            if unknown:
+                return Response({"error": f"Users {unknown} are not your recipients."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            boards = cloning.clone_board(source, [recipients[user_id] for user_id in dict.fromkeys(requested)],
+                                         serializer.validated_data.get('name'), caregiver=caregiver)
+
+        return Response({'boards': [
+            {'id': board.id, 'name': board.name, 'creator': board.creator_id, 'is_template': board.is_template}
+            for board in boards
+        ]}, status=status.HTTP_201_CREATED)
+
+
+class BoardBundleView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Zip with everything needed to use a board offline: board.json with tabs and cards, "
+                              "resized card images, label audio and a manifest of content hashes. "
+                              "With manifest=1 only the manifest is returned.",
+        manual_parameters=[
+            openapi.Parameter('manifest', openapi.IN_QUERY, description="Return only the manifest",
+                              type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={
+            200: openapi.Response(description="application/zip bundle, or the manifest as JSON"),
+            304: openapi.Response(description="Bundle unchanged since the ETag sent in If-None-Match"),
+            404: openapi.Response(description="Board not found"),
+        }
+    )
+    def get(self, request, board_id):
+        try:
+            board = Board.objects.get(id=board_id)
+        except Board.DoesNotExist:
+            return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # answered from the versions alone, the bundle is only built on a miss
+        etag = bundle.revision(board)
+        if board_cache.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        if request.query_params.get('manifest') in ('1', 'true'):
+            return Response(bundle.get_manifest(board, etag), status=status.HTTP_200_OK, headers={'ETag': etag})
+        manifest, files = bundle.build(board, etag)
+        return self.zip_response(board, manifest, files, etag=etag)
+
+    @swagger_auto_schema(
+        operation_description="Bundle with only the entries whose hashes the client does not have yet",
+        request_body=BundleRequestSerializer,
+        responses={
+            200: openapi.Response(description="application/zip bundle"),
+            404: openapi.Response(description="Board not found"),
+        }
+    )
+    def post(self, request, board_id):
+        serializer = BundleRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            board = Board.objects.get(id=board_id)
+        except Board.DoesNotExist:
+            return Response({"error": "Board not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        manifest, files = bundle.build(board, bundle.revision(board))
+        return self.zip_response(board, manifest, files, have=serializer.validated_data['have'])
+
+    def zip_response(self, board, manifest, files, have=(), etag=None):
+        response = HttpResponse(bundle.archive(manifest, files, have), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="board-{board.id}.zip"'
+        if etag:
+            response['ETag'] = etag
+        return response
+
+
 class BoardFolderView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -595,7 +1126,7 @@ class BoardFolderView(APIView):
                 type=openapi.TYPE_INTEGER,
                 required=True
             ),
-        ],
+        ] + folder_page_parameters,
         responses={
             200: openapi.Schema(
                 type=openapi.TYPE_OBJECT,
@@ -605,10 +1136,11 @@ class BoardFolderView(APIView):
                         type=openapi.TYPE_ARRAY,
                         items=openapi.Schema(type=openapi.TYPE_OBJECT)
                     ),
+                    'next_cursor': openapi.Schema(type=openapi.TYPE_STRING),
                 }
             ),
             404: openapi.Response(description="folder not found"),
-            400: openapi.Response(description="folder ID is required")
+            400: openapi.Response(description="folder ID is required or the cursor is invalid")
         }
     )
     def get(self, request):
@@ -619,12 +1151,15 @@ class BoardFolderView(APIView):
             return Response({"error": "folder ID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            folder = Folder.objects.get(id=folder_id)
+            folder = Folder.objects.with_visibility().get(id=folder_id)
         except Folder.DoesNotExist:
             return Response({"error": "folder not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get all images related to the folder
-        folder_images = Image.objects.filter(folder_id=folder_id)
+        # One page of the folder's images
+        try:
+            folder_images, next_cursor = folder_image_page(request, folder.id)
+        except ValueError:
+            return Response({"error": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Serialize the folder and images
         folder_data = FolderSerializer(folder).data
@@ -632,7 +1167,8 @@ class BoardFolderView(APIView):
 
         response_data = {
             'folder': folder_data,
-            'folder_images': folder_images_data
+            'folder_images': folder_images_data,
+            'next_cursor': next_cursor,
         }
 
         return Response(response_data, status=status.HTTP_200_OK)
@@ -771,37 +1307,198 @@ class TextToSpeechView(APIView):
 
 
     def get(self, request):
-        load_dotenv()
         serializer = TextToSpeechSerializer(data=request.data)
         if serializer.is_valid():
-            r2_file_path = 'audio/' + serializer.data['text'] + '.mp3'
+            # a JSON body may carry a real boolean
+            if request.query_params.get('stream') in ('1', 'true') or request.data.get('stream') in ('1', 'true', True):
+                return self.stream(serializer.data['text'])
 
-            storage = S3Boto3Storage()
+            try:
+                clip, created = tts.get_or_create_clip(serializer.data['text'])
+            except Exception as e:
+                return Response({"error": f"Failed to upload audio to R2: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            client = OpenAI(api_key=os.getenv('OPEN_AI_API_KEY'))
+            return Response({
+                "audio_url": tts.clip_url(clip.path),
+                "clip_url": request.build_absolute_uri(reverse('tts-clip', args=[clip.key])),
+                "cached": not created,
+            }, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=400)
 
-            try:
-                response = client.audio.speech.create(
-                    model="tts-1",
-                    voice="nova",
-                    input= serializer.data['text'],
-                )
+    def stream(self, text):
+        content_type = tts.CONTENT_TYPES[tts.TTS_FORMAT]
+        clip = tts.find_clip(tts.clip_key(text))
 
-                audio_content = response.content
-                try:
-                    with storage.open(r2_file_path, 'wb') as f:
-                        f.write(audio_content)
+        try:
+            if clip is not None:
+                return HttpResponse(tts.get_clip_bytes(clip), content_type=content_type)
+            audio_stream = tts.stream_synthesis(text)
+        except Exception as e:
+            return Response({"error": f"Failed to synthesize audio: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-                    r2_base_url = os.getenv('R2_BASE_URL') + "/audio"
-                    encoded_audio_name = quote(serializer.data['text'] + ".mp3")
-                    r2_audio_url = f"{r2_base_url}{encoded_audio_name}"
+        return StreamingHttpResponse(audio_stream, content_type=content_type)
 
-                    return Response({"audio_url": r2_audio_url},
-                                    status=status.HTTP_200_OK)
 
-                except Exception as e:
-                    return Response({"error": f"Failed to upload audio to R2: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            except Exception as e:
-                return Response({"error": f"Failed to upload audio to R2: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return Response(serializer.errors, status=400)
+class AudioContentNegotiation(BaseContentNegotiation):
+    # the Accept header of an audio request names audio types, it picks the variant, not a renderer
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class AudioClipView(APIView):
+    content_negotiation_class = AudioContentNegotiation
+
+    @swagger_auto_schema(
+        operation_description="Get synthesized audio bytes, served from the local clip cache when possible. "
+                              "A low-bitrate variant is picked from ?variant= or the Save-Data, ECT and "
+                              "Downlink client hints.",
+        responses={
+            200: openapi.Response(description="Audio file"),
+            202: openapi.Response(description="Audio is still being synthesized, retry shortly"),
+            404: openapi.Response(description="Clip not found")
+        }
+    )
+    def get(self, request, key):
+        try:
+            clip = AudioClip.objects.get(key=key)
+        except AudioClip.DoesNotExist:
+            substitute = tts.fallback_key(key)
+            if substitute is not None:
+                # a fallback backend's clip stands in for a while, the redirect must not be cached
+                response = HttpResponseRedirect(reverse('tts-clip', args=[substitute]))
+                response['Cache-Control'] = 'no-cache'
+                return response
+            pending = tts.pending_clip(key)
+            if pending is not None:
+                if pending.audio is not None:
+                    # composed and streamed phrases are kept with the pending row while they are uploaded
+                    response = HttpResponse(bytes(pending.audio), content_type=tts.CONTENT_TYPES[tts.TTS_FORMAT])
+                    response['Cache-Control'] = 'no-cache'
+                    return response
+                return Response({"message": "Audio is being synthesized."}, status=status.HTTP_202_ACCEPTED,
+                                headers={'Retry-After': '1'})
+            return Response({"error": "Clip not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        variant = variants.negotiate(request)
+        content_type = tts.CONTENT_TYPES.get(clip.response_format, 'audio/mpeg')
+        substituted = False
+        try:
+            audio_content = variants.get_variant_bytes(clip, variant) if variant else None
+            if audio_content is not None:
+                content_type = variants.VARIANTS[variant]['content_type']
+            else:
+                audio_content = tts.get_clip_bytes(clip)
+                if variant:
+                    # clips stored before variants existed get them on first demand
+                    variants.schedule_variants(clip, audio_content)
+                    substituted = True
+        except Exception as e:
+            return Response({"error": f"Failed to load audio: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = HttpResponse(audio_content, content_type=content_type)
+        if substituted:
+            # the original stands in for a variant that is still being transcoded, ask again next time
+            response['Cache-Control'] = 'no-cache'
+        else:
+            # the key is a content hash, the bytes behind it never change
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response['Vary'] = 'Accept, Save-Data, ECT, Downlink'
+        response['Accept-CH'] = 'Save-Data, ECT, Downlink'
+        return response
+
 
+class AudioCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="Hit, miss and eviction counters of the local audio cache",
+        responses={200: openapi.Response(description="Cache statistics")}
+    )
+    def get(self, request):
+        return Response(get_audio_cache().stats(), status=status.HTTP_200_OK)
+
+
+class TTSBackendStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="Latency, error rate and circuit breaker state of each text-to-speech backend",
+        responses={200: openapi.Response(description="Backend statistics")}
+    )
+    def get(self, request):
+        return Response(tts_backends.registry.stats(), status=status.HTTP_200_OK)
+
+
+class PresynthesisView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Synthesize audio for every card label of a board or folder in the background",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'board_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'folder_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+            }
+        ),
+        responses={
+            202: openapi.Response(description="Job started"),
+            200: openapi.Response(description="A job for this board or folder is already running"),
+            400: openapi.Response(description="board_id or folder_id is required"),
+            404: openapi.Response(description="Board or folder not found")
+        }
+    )
+    def post(self, request):
+        board_id = request.data.get('board_id')
+        folder_id = request.data.get('folder_id')
+
+        if not board_id and not folder_id:
+            return Response({"error": "board_id or folder_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # own and shared boards plus staff templates, own and staff folders; anything else is not found
+        target = {}
+        try:
+            if board_id:
+                target['board'] = Board.objects.filter(
+                    Q(creator=request.user) | Q(access_users__user=request.user)
+                    | Q(is_template=True, creator__is_staff=True)
+                ).distinct().get(id=board_id)
+            else:
+                target['folder'] = sync.visible_folders(request.user).get(id=folder_id)
+        except (Board.DoesNotExist, Folder.DoesNotExist):
+            return Response({"error": "Board or folder not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # a job that stopped reporting progress died with its worker, a new one resumes from the missing clips
+        active = PresynthesisJob.objects.filter(
+            creator=request.user,
+            status__in=['pending', 'running'],
+            updated_at__gte=timezone.now() - timedelta(minutes=10),
+            **target
+        ).first()
+        if active is not None:
+            return Response(PresynthesisJobSerializer(active).data, status=status.HTTP_200_OK)
+
+        job = PresynthesisJob.objects.create(creator=request.user, **target)
+        presynthesis.start_job(job)
+        return Response(PresynthesisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class PresynthesisJobView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Get progress of a pre-synthesis job",
+        responses={
+            200: openapi.Response(description="Job progress"),
+            404: openapi.Response(description="Job not found")
+        }
+    )
+    def get(self, request, job_id):
+        try:
+            job = PresynthesisJob.objects.get(id=job_id, creator=request.user)
+        except PresynthesisJob.DoesNotExist:
+            return Response({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(PresynthesisJobSerializer(job).data, status=status.HTTP_200_OK)
@@ -136,6 +136,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'pecs.wsgi.application'
+ASGI_APPLICATION = 'pecs.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -232,3 +233,50 @@ AWS_S3_FILE_OVERWRITE = False  # Prevent files with same name overwriting each o
 
 MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}.{AWS_S3_ENDPOINT_URL.split("://")[1]}/'
 
+
+# Local text-to-speech byte cache (hot clips in memory, warm clips on local disk)
+TTS_MEMORY_CACHE_BYTES = int(os.getenv('TTS_MEMORY_CACHE_BYTES', 32 * 1024 * 1024))
+TTS_DISK_CACHE_DIR = os.getenv('TTS_DISK_CACHE_DIR', os.path.join(BASE_DIR, 'tts_cache'))
+TTS_DISK_CACHE_BYTES = int(os.getenv('TTS_DISK_CACHE_BYTES', 512 * 1024 * 1024))
+TTS_PRESYNTHESIS_WORKERS = int(os.getenv('TTS_PRESYNTHESIS_WORKERS', 4))
+# A worker holding a synthesis lock longer than this is assumed dead and the lock is taken over
+TTS_LOCK_TTL_SECONDS = int(os.getenv('TTS_LOCK_TTL_SECONDS', 60))
+
+# Text-to-speech backend routing: slower calls count as failures, that many failures in a row
+# open the circuit and route to the fallback backend for the cooldown
+TTS_SLOW_SECONDS = float(os.getenv('TTS_SLOW_SECONDS', 3.0))
+TTS_BREAKER_FAILURES = int(os.getenv('TTS_BREAKER_FAILURES', 3))
+TTS_BREAKER_COOLDOWN_SECONDS = int(os.getenv('TTS_BREAKER_COOLDOWN_SECONDS', 30))
+
+# Low-bitrate audio variants are transcoded with ffmpeg, skipped when it is not installed
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+# Serialized board payloads, keyed by content versions so a stale entry is never served
+BOARD_SNAPSHOT_TTL_SECONDS = int(os.getenv('BOARD_SNAPSHOT_TTL_SECONDS', 24 * 60 * 60))
+
+# Cached library layers, the shared staff library and one overlay per user, keyed by content versions
+LIBRARY_CATALOG_TTL_SECONDS = int(os.getenv('LIBRARY_CATALOG_TTL_SECONDS', 24 * 60 * 60))
+
+# Board sync change log entries older than this are pruned, clients behind that get a full reset
+SYNC_CHANGELOG_RETENTION_DAYS = int(os.getenv('SYNC_CHANGELOG_RETENTION_DAYS', 30))
+
+# Offline board bundles: card images are scaled to fit this many pixels
+BUNDLE_IMAGE_SIZE = int(os.getenv('BUNDLE_IMAGE_SIZE', 256))
+
+# Threads resizing uploaded images into their WebP/JPEG derivatives
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
+# Uploads whose fingerprint is at most this many bits from an image in the uploader's library
+# reuse its stored object, 0 only reuses exact matches. Up to 4 are found through the index,
+# see duplicates.INDEX_CHUNKS
+IMAGE_DUPLICATE_DISTANCE = int(os.getenv('IMAGE_DUPLICATE_DISTANCE', 4))
+
+# Keyset pagination of library listings and search
+LIBRARY_PAGE_SIZE = int(os.getenv('LIBRARY_PAGE_SIZE', 50))
+LIBRARY_MAX_PAGE_SIZE = int(os.getenv('LIBRARY_MAX_PAGE_SIZE', 200))
+
+# Local semantic search over card labels, see `manage.py build_semantic_index`. Every upload
+# adds a small segment, they are merged into one when there are more than this many
+SEMANTIC_INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR', os.path.join(BASE_DIR, 'semantic_index'))
+SEMANTIC_MAX_SEGMENTS = int(os.getenv('SEMANTIC_MAX_SEGMENTS', 32))
+SEMANTIC_SEARCH_K = int(os.getenv('SEMANTIC_SEARCH_K', 20))